@@ -1,27 +1,81 @@
 
-from flask import Flask, send_from_directory
+from flask import Flask, send_from_directory, request
 from config import Config
-from database import init_db
+from database import load_read_your_writes_token, issue_read_your_writes_token
+from storage.store import get_store
+from services.intake import start_drainer
 from routes.main import main_bp
 from routes.admin import admin_bp
+from routes.health import health_bp
+from middleware.compression import compress_response
+from middleware.rate_limit import rate_limit
+from middleware.load_shed import load_shed, hold_until_closed, release_on_teardown
+from middleware.in_flight import track_request, untrack_on_close, untrack_request
+from middleware.profiler import start_profile, finish_profile
+from middleware.access_log import start_request, log_request
+from services.structured_log import setup_logging
+import logging
 import os
 
+# JSON logs written in batches by a background thread, never on the request path
+setup_logging()
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 app.config.from_object(Config)
 
 # Register Blueprints
 app.register_blueprint(main_bp)
 app.register_blueprint(admin_bp)
+app.register_blueprint(health_bp)
 
 # Initialize Database
-init_db()
+get_store().init_schema()
+
+# Applies journaled submissions in arrival order (INTAKE_MODE other than 'off')
+start_drainer()
+
+# Access log: request ID, latency, DB time. Registered first on both sides,
+# so it times the whole request and its after_request hook runs last; a
+# streamed response is logged when it closes, like the profile below.
+app.before_request(start_request)
+app.after_request(log_request)
+
+# Opt-in per-request profile (X-Profile: 1 or ?profile=1, admins only).
+# Registered right after the access log on both sides, so the capture covers
+# every other hook, including load shedding and compression; only the access
+# log's own hooks run outside it.
+app.before_request(start_profile)
+app.after_request(finish_profile)
+
+# Runs before the remaining hooks so throttled requests never reach the database
+app.before_request(rate_limit)
+
+# Per-class concurrency limits: 503 + Retry-After instead of queueing on the
+# pool when the database is slow. The slot is held until the body is sent.
+app.before_request(load_shed)
+app.after_request(hold_until_closed)
+app.teardown_request(release_on_teardown)
+
+# In-flight counts for /readyz, held like the load-shedding slot until the
+# response is closed, so streamed exports count while they are being sent
+app.before_request(track_request)
+app.after_request(untrack_on_close)
+app.teardown_request(untrack_request)
+
+@app.before_request
+def route_reads():
+    load_read_your_writes_token(request)
 
 @app.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,X-Read-Your-Writes')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
-    return response
+    return issue_read_your_writes_token(request, response)
+
+# Registered after the CORS hook so it runs first; only the body encoding changes
+app.after_request(compress_response)
 
 @app.route('/favicon.ico')
 def favicon():
@@ -34,5 +88,5 @@ def xlsx_lib():
     return send_from_directory(os.path.join(app.root_path, 'static', 'js'), 'lib_xlsx.full.min.js')
 
 if __name__ == '__main__':
-    print(f"Flask Server running at http://localhost:{Config.PORT}/")
+    logger.info(f"Flask Server running at http://localhost:{Config.PORT}/")
     app.run(host='0.0.0.0', port=Config.PORT, debug=True)
@@ -7,4 +7,128 @@ class Config:
     DB_USER = "yilunwu"
     ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin123')
     DATABASE_URL = os.environ.get('DATABASE_URL')
+    # 'postgres' in production; 'sqlite' runs the registration flow and admin
+    # dashboard in-process (SQLITE_PATH may be ':memory:') for tests and benchmarks
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'postgres')
+    SQLITE_PATH = os.environ.get('SQLITE_PATH', ':memory:')
+    # Connections each process may hold per database, and how many of them are
+    # kept idle; a request finding all DB_POOL_MAX in use waits up to
+    # DB_POOL_TIMEOUT seconds. Prepared statements are cached per connection.
+    DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 30))
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+    STATEMENT_CACHE_SIZE = int(os.environ.get('STATEMENT_CACHE_SIZE', 64))
+    STATEMENT_PREPARE_THRESHOLD = int(os.environ.get('STATEMENT_PREPARE_THRESHOLD', 2))
+    # Optional streaming replica for read-only queries
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5))
+    REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('REPLICA_LAG_CHECK_INTERVAL', 2))
+    READ_YOUR_WRITES_SECONDS = int(os.environ.get('READ_YOUR_WRITES_SECONDS', 10))
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-key-please-change')
+    # Registration transactions aborted by a deadlock or serialization failure
+    # are re-run up to this many times in total, with jittered backoff (seconds)
+    TRANSACTION_MAX_ATTEMPTS = int(os.environ.get('TRANSACTION_MAX_ATTEMPTS', 4))
+    TRANSACTION_RETRY_BASE_DELAY = float(os.environ.get('TRANSACTION_RETRY_BASE_DELAY', 0.05))
+    TRANSACTION_RETRY_MAX_DELAY = float(os.environ.get('TRANSACTION_RETRY_MAX_DELAY', 1.0))
+    # Term that pre-term data belongs to and that is active on a fresh install.
+    # Workers re-read the active term at most every ACTIVE_TERM_CACHE_SECONDS.
+    DEFAULT_TERM = os.environ.get('DEFAULT_TERM', '114-2')
+    ACTIVE_TERM_CACHE_SECONDS = float(os.environ.get('ACTIVE_TERM_CACHE_SECONDS', 5))
+    # Seconds browsers and proxies may reuse /api/bootstrap before revalidating
+    BOOTSTRAP_MAX_AGE = int(os.environ.get('BOOTSTRAP_MAX_AGE', 5))
+    # Minimum trigram similarity for fuzzy student-name search candidates
+    SEARCH_MIN_SIMILARITY = float(os.environ.get('SEARCH_MIN_SIMILARITY', 0.1))
+    # Response compression (gzip always, brotli when the package is installed)
+    COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', '1') == '1'
+    COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+    BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))
+    COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+    # How long deletions stay visible to /admin/registrations?since=... clients
+    TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', 7))
+    # Token-bucket rate limits per endpoint: (scope, requests, per seconds).
+    # Scope 'ip' keys on the client address, 'name' on the normalized student
+    # name in the query string or JSON body; every listed bucket must allow it.
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+    RATE_LIMIT_STORAGE_URL = os.environ.get('RATE_LIMIT_STORAGE_URL', 'memory://')
+    TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))
+    RATE_LIMITS = {
+        'main.submit_registration': [('ip', 10, 60), ('name', 3, 60)],
+        'main.update_registration': [('ip', 10, 60), ('name', 5, 60)],
+        'main.query_registration': [('ip', 30, 60), ('name', 10, 60)],
+        'main.get_availability': [('ip', 60, 60)],
+        'main.get_bootstrap': [('ip', 60, 60)],
+        'main.get_intake_receipt': [('ip', 60, 60)],
+    }
+    # Write-behind intake for overload: 'off'; 'always' journals every submission
+    # and answers 202 with a receipt; 'fallback' tries the database first and
+    # journals when it fails (or while earlier submissions are still queued).
+    INTAKE_MODE = os.environ.get('INTAKE_MODE', 'off')
+    INTAKE_JOURNAL_PATH = os.environ.get('INTAKE_JOURNAL_PATH', 'intake/journal.jsonl')
+    INTAKE_POLL_INTERVAL = float(os.environ.get('INTAKE_POLL_INTERVAL', 0.2))
+    INTAKE_RETRY_DELAY = float(os.environ.get('INTAKE_RETRY_DELAY', 2))
+    # Resolved receipts each process keeps answering from memory, and days the
+    # database keeps applied receipts so a replay is recognized
+    INTAKE_INDEX_SIZE = int(os.environ.get('INTAKE_INDEX_SIZE', 10000))
+    INTAKE_RECEIPT_RETENTION_DAYS = int(os.environ.get('INTAKE_RECEIPT_RETENTION_DAYS', 7))
+    # The drainer starts a new journal file once the current one is fully
+    # resolved and at least this large
+    INTAKE_SEGMENT_BYTES = int(os.environ.get('INTAKE_SEGMENT_BYTES', 4 * 1024 * 1024))
+    # /readyz reports not ready above this database round trip (ms) or with this
+    # share of DB_POOL_MAX primary connections checked out (0 disables the pool check)
+    READY_MAX_DB_LATENCY_MS = float(os.environ.get('READY_MAX_DB_LATENCY_MS', 250))
+    READY_MAX_POOL_FRACTION = float(os.environ.get('READY_MAX_POOL_FRACTION', 0.9))
+    # Per-request profiles requested by admins; only the newest PROFILE_KEEP are kept
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+    PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))
+    # JSON logs: queued by the caller, written in batches by a background thread.
+    # LOG_FILE unset means stderr; records beyond LOG_QUEUE_SIZE are dropped.
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FILE = os.environ.get('LOG_FILE')
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+    LOG_BATCH_SIZE = int(os.environ.get('LOG_BATCH_SIZE', 200))
+    LOG_FLUSH_INTERVAL = float(os.environ.get('LOG_FLUSH_INTERVAL', 0.5))
+    # Rows fetched per round trip (and encoded per chunk) by streamed admin lists
+    STREAM_FETCH_SIZE = int(os.environ.get('STREAM_FETCH_SIZE', 500))
+    # Load shedding: each priority class gets (max in flight, max queued,
+    # max seconds queued, Retry-After seconds). Beyond that a request is refused
+    # with 503 at once. Classes are looked up by endpoint, then by blueprint;
+    # unlisted endpoints (pages, health checks, login) are never shed.
+    LOAD_SHED_ENABLED = os.environ.get('LOAD_SHED_ENABLED', '1') == '1'
+    LOAD_SHED_LIMITS = {
+        'registration': (12, 48, 2.0, 2),
+        'availability': (8, 16, 0.25, 1),
+        'admin': (4, 8, 5.0, 5),
+    }
+    LOAD_SHED_CLASSES = {
+        'main.submit_registration': 'registration',
+        'main.update_registration': 'registration',
+        'main.query_registration': 'availability',
+        'main.get_availability': 'availability',
+        'main.get_registration_time': 'availability',
+        'main.get_course_videos': 'availability',
+        'main.get_bootstrap': 'availability',
+        'main.get_intake_receipt': None,
+        'admin': 'admin',
+        'admin.login': None,
+        'admin.admin_page': None,
+    }
+    # Background jobs and mail. Without SMTP_HOST, mail is written to MAIL_OUTBOX_DIR.
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+    JOB_BACKOFF_BASE = float(os.environ.get('JOB_BACKOFF_BASE', 30))
+    JOB_BACKOFF_MAX = float(os.environ.get('JOB_BACKOFF_MAX', 3600))
+    # A running job whose worker has not finished it within the lease is
+    # reclaimed; finished jobs are deleted after the retention window
+    JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', 300))
+    JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', 14))
+    JOB_PRUNE_INTERVAL = float(os.environ.get('JOB_PRUNE_INTERVAL', 3600))
+    # Seconds between folds of the finance deltas into their counters (worker)
+    FINANCE_FOLD_INTERVAL = float(os.environ.get('FINANCE_FOLD_INTERVAL', 60))
+    SMTP_HOST = os.environ.get('SMTP_HOST')
+    SMTP_PORT = int(os.environ.get('SMTP_PORT', 587))
+    SMTP_USER = os.environ.get('SMTP_USER')
+    SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD')
+    SMTP_USE_TLS = os.environ.get('SMTP_USE_TLS', '1') == '1'
+    SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', 10))
+    MAIL_FROM = os.environ.get('MAIL_FROM', 'noreply@ivykidschool.com')
+    MAIL_OUTBOX_DIR = os.environ.get('MAIL_OUTBOX_DIR', 'mail_outbox')
@@ -2,18 +2,419 @@
 import pg8000.native
 import urllib.parse
 import os
+import contextlib
+import contextvars
+import functools
+import logging
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from flask import g, has_request_context
 from config import Config
+from services.name_index import index_student_name
 
-def get_db_connection():
-    db_url = Config.DATABASE_URL
+def _connect(db_url):
     if db_url:
-        return pg8000.native.Connection(user=urllib.parse.urlparse(db_url).username, 
-                                      password=urllib.parse.urlparse(db_url).password,
-                                      host=urllib.parse.urlparse(db_url).hostname,
-                                      port=urllib.parse.urlparse(db_url).port or 5432,
-                                      database=urllib.parse.urlparse(db_url).path[1:])
+        url = urllib.parse.urlparse(db_url)
+        return pg8000.native.Connection(user=url.username,
+                                      password=url.password,
+                                      host=url.hostname,
+                                      port=url.port or 5432,
+                                      database=url.path[1:])
     return pg8000.native.Connection(user=Config.DB_USER, database=Config.DB_NAME)
 
+# ---- Connection pool with per-connection prepared-statement cache ----
+
+_statement_stats = {'hits': 0, 'misses': 0, 'prepared': 0, 'evicted': 0}
+_statement_stats_lock = threading.Lock()
+
+def _count_statement(key, n=1):
+    with _statement_stats_lock:
+        _statement_stats[key] += n
+
+def statement_cache_stats():
+    with _statement_stats_lock:
+        stats = dict(_statement_stats)
+    total = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = round(stats['hits'] / total, 3) if total else None
+    return stats
+
+def sqlstate(error):
+    """SQLSTATE code of a pg8000 database error, or None"""
+    if isinstance(error, pg8000.native.DatabaseError) and error.args and isinstance(error.args[0], dict):
+        return error.args[0].get('C')
+    return None
+
+# ---- Per-request SQL accounting (access log, profiler) ----
+
+class SQLUsage:
+    """Statement count and total time on pooled connections"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def record(self, sql, started, error=None):
+        self.count += 1
+        self.seconds += time.perf_counter() - started
+
+class SQLTimeline:
+    """Statements run on pooled connections while recording, with offsets and durations"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.entries = []
+
+    def record(self, sql, started, error=None):
+        finished = time.perf_counter()
+        self.entries.append({
+            'offset_ms': round((started - self.started) * 1000, 3),
+            'duration_ms': round((finished - started) * 1000, 3),
+            'sql': ' '.join(sql.split()),
+            'error': error
+        })
+
+# Recorders notified of every statement this context runs; empty costs nothing
+_sql_recorders = contextvars.ContextVar('sql_recorders', default=())
+
+def add_sql_recorder(recorder):
+    _sql_recorders.set(_sql_recorders.get() + (recorder,))
+    return recorder
+
+def remove_sql_recorder(recorder):
+    _sql_recorders.set(tuple(r for r in _sql_recorders.get() if r is not recorder))
+
+# SQLSTATEs meaning a cached statement no longer matches the schema or session
+_STALE_STATEMENT_CODES = {'0A000', '26000'}
+
+class PooledConnection:
+    """pg8000 connection that returns to its pool on close() and prepares hot SQL.
+
+    Parameterised statements are parsed and planned normally the first time a
+    connection sees them and prepared as named statements on the next use.
+    Prepared statements live as long as the connection, so they are reused by
+    every request that borrows it, and the least recently used one is dropped
+    once STATEMENT_CACHE_SIZE is reached.
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._statements = OrderedDict()
+        self._seen = OrderedDict()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def run(self, sql, **params):
+        recorders = _sql_recorders.get()
+        if not recorders:
+            return self._run(sql, params)
+        started = time.perf_counter()
+        error = None
+        try:
+            return self._run(sql, params)
+        except Exception as e:
+            error = sqlstate(e) or type(e).__name__
+            raise
+        finally:
+            for recorder in recorders:
+                recorder.record(sql, started, error)
+
+    def _run(self, sql, params):
+        if not params or Config.STATEMENT_CACHE_SIZE <= 0:
+            return self._raw.run(sql, **params)
+
+        statement = self._statement(sql)
+        if statement is None:
+            return self._raw.run(sql, **params)
+        try:
+            return statement.run(**params)
+        except pg8000.native.DatabaseError as e:
+            if sqlstate(e) in _STALE_STATEMENT_CODES:
+                self._evict(sql)
+            raise
+
+    def _statement(self, sql):
+        statement = self._statements.get(sql)
+        if statement is not None:
+            self._statements.move_to_end(sql)
+            _count_statement('hits')
+            return statement
+
+        _count_statement('misses')
+        uses = self._seen.pop(sql, 0) + 1
+        if uses < Config.STATEMENT_PREPARE_THRESHOLD:
+            self._seen[sql] = uses
+            while len(self._seen) > Config.STATEMENT_CACHE_SIZE * 4:
+                self._seen.popitem(last=False)
+            return None
+
+        statement = self._raw.prepare(sql)
+        _count_statement('prepared')
+        self._statements[sql] = statement
+        while len(self._statements) > Config.STATEMENT_CACHE_SIZE:
+            _, old = self._statements.popitem(last=False)
+            self._close_statement(old)
+        return statement
+
+    def _evict(self, sql):
+        statement = self._statements.pop(sql, None)
+        if statement is not None:
+            self._close_statement(statement)
+
+    def _close_statement(self, statement):
+        _count_statement('evicted')
+        try:
+            statement.close()
+        except Exception:
+            pass
+
+    def close(self):
+        self._pool.release(self)
+
+    def discard(self):
+        try:
+            self._raw.close()
+        except Exception:
+            pass
+
+class PoolTimeout(Exception):
+    """No connection came free within DB_POOL_TIMEOUT seconds"""
+
+class ConnectionPool:
+    """At most DB_POOL_MAX connections per database URL, DB_POOL_SIZE of them kept idle"""
+
+    def __init__(self, db_url):
+        self.db_url = db_url
+        self._idle = deque()
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+        self.max_size = Config.DB_POOL_MAX
+        self.in_use = 0
+        self.waiting = 0
+        self.created = 0
+        self.timeouts = 0
+
+    def acquire(self):
+        with self._cond:
+            if self._pid != os.getpid():
+                # Connections inherited across fork() belong to the parent
+                self._idle.clear()
+                self._pid = os.getpid()
+                self.in_use = 0
+                self.waiting = 0
+            if self.in_use >= self.max_size:
+                deadline = time.monotonic() + Config.DB_POOL_TIMEOUT
+                self.waiting += 1
+                try:
+                    while self.in_use >= self.max_size:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.timeouts += 1
+                            raise PoolTimeout(f'all {self.max_size} database connections are in use')
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            conn = self._idle.pop() if self._idle else None
+            self.in_use += 1
+        if conn is None:
+            try:
+                conn = PooledConnection(self, _connect(self.db_url))
+            except Exception:
+                with self._cond:
+                    self.in_use -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self.created += 1
+        return conn
+
+    def release(self, conn):
+        reusable = True
+        try:
+            # Never hand out a connection with an open or failed transaction
+            if conn._raw._transaction_status != b'I':
+                conn._raw.run("ROLLBACK")
+        except Exception:
+            reusable = False
+
+        with self._cond:
+            self.in_use -= 1
+            self._cond.notify()
+            if reusable and len(self._idle) < Config.DB_POOL_SIZE:
+                self._idle.append(conn)
+                return
+        conn.discard()
+
+    def stats(self):
+        with self._cond:
+            return {'in_use': self.in_use, 'max': self.max_size, 'waiting': self.waiting,
+                    'idle': len(self._idle), 'created': self.created, 'timeouts': self.timeouts}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _get_pool(db_url):
+    with _pools_lock:
+        pool = _pools.get(db_url)
+        if pool is None:
+            pool = _pools[db_url] = ConnectionPool(db_url)
+        return pool
+
+def pool_stats():
+    with _pools_lock:
+        pools = dict(_pools)
+    return {
+        ('replica' if url and url == Config.DATABASE_REPLICA_URL else 'primary'): pool.stats()
+        for url, pool in pools.items()
+    }
+
+def get_db_connection(read_only=False):
+    """Connection to the primary, or to the replica for read-only work when it is usable"""
+    if read_only and Config.DATABASE_REPLICA_URL and not prefers_primary() and replica_is_fresh():
+        try:
+            return _get_pool(Config.DATABASE_REPLICA_URL).acquire()
+        except Exception as e:
+            _replica_state['healthy'] = False
+            logger.warning("Replica connection failed, using primary: %s", e)
+    return _get_pool(Config.DATABASE_URL).acquire()
+
+# ---- Read-replica routing ----
+
+_replica_state = {'checked_at': 0.0, 'healthy': False, 'lag': None}
+_replica_check_lock = threading.Lock()
+
+def replica_lag_seconds():
+    """Replay lag of the replica in seconds; 0 when it has replayed everything it received"""
+    conn = _connect(Config.DATABASE_REPLICA_URL)
+    try:
+        result = conn.run("""
+            SELECT CASE
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+            END
+        """)
+        return float(result[0][0])
+    finally:
+        conn.close()
+
+def replica_is_fresh():
+    now = time.monotonic()
+    if now - _replica_state['checked_at'] >= Config.REPLICA_LAG_CHECK_INTERVAL:
+        # One thread refreshes the lag; the others keep using the last known state
+        if _replica_check_lock.acquire(blocking=False):
+            try:
+                lag = replica_lag_seconds()
+                _replica_state.update(healthy=lag <= Config.REPLICA_MAX_LAG_SECONDS, lag=lag)
+            except Exception as e:
+                _replica_state.update(healthy=False, lag=None)
+                logger.warning("Replica lag check failed: %s", e)
+            finally:
+                _replica_state['checked_at'] = now
+                _replica_check_lock.release()
+    return _replica_state['healthy']
+
+def replica_status():
+    return {
+        'configured': bool(Config.DATABASE_REPLICA_URL),
+        'healthy': _replica_state['healthy'],
+        'lag_seconds': _replica_state['lag']
+    }
+
+# Read-your-writes: a client that just wrote carries a token (cookie or header)
+# holding a deadline; until then its reads go to the primary.
+READ_YOUR_WRITES_COOKIE = 'rw_until'
+READ_YOUR_WRITES_HEADER = 'X-Read-Your-Writes'
+
+logger = logging.getLogger(__name__)
+
+_force_primary = contextvars.ContextVar('force_primary', default=False)
+
+def prefers_primary():
+    if _force_primary.get():
+        return True
+    return has_request_context() and g.get('prefer_primary', False)
+
+@contextlib.contextmanager
+def use_primary():
+    """Send read-only queries to the primary inside this block (background jobs, drainers)"""
+    token = _force_primary.set(True)
+    try:
+        yield
+    finally:
+        _force_primary.reset(token)
+
+def load_read_your_writes_token(request):
+    token = request.headers.get(READ_YOUR_WRITES_HEADER) or request.cookies.get(READ_YOUR_WRITES_COOKIE)
+    try:
+        g.prefer_primary = token is not None and float(token) > time.time()
+    except ValueError:
+        g.prefer_primary = False
+
+def issue_read_your_writes_token(request, response):
+    if request.method in ('GET', 'HEAD', 'OPTIONS') or response.status_code >= 400:
+        return response
+    until = f"{time.time() + Config.READ_YOUR_WRITES_SECONDS:.3f}"
+    response.set_cookie(READ_YOUR_WRITES_COOKIE, until,
+                        max_age=Config.READ_YOUR_WRITES_SECONDS, httponly=True, samesite='Lax')
+    response.headers[READ_YOUR_WRITES_HEADER] = until
+    return response
+
+# ---- Retrying transactions that lost a deadlock or serialization race ----
+
+# deadlock_detected and serialization_failure: the server rolled the
+# transaction back, and running it again from the start can succeed
+RETRYABLE_SQLSTATES = {'40P01', '40001'}
+
+_retry_stats = {'transactions': 0, 'retries': 0, 'recovered': 0, 'exhausted': 0, 'by_sqlstate': {}}
+_retry_stats_lock = threading.Lock()
+
+def retry_stats():
+    with _retry_stats_lock:
+        stats = dict(_retry_stats)
+        stats['by_sqlstate'] = dict(_retry_stats['by_sqlstate'])
+    return stats
+
+def retry_transaction(fn):
+    """Re-run a whole transaction when the database aborts it as a deadlock or serialization victim.
+
+    The wrapped function must open, commit and roll back its own transaction,
+    so each attempt starts clean. Attempts are bounded by
+    TRANSACTION_MAX_ATTEMPTS, with full-jitter exponential backoff between
+    them so the colliding transactions do not meet again in lockstep.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        attempt = 1
+        while True:
+            try:
+                result = fn(*args, **kwargs)
+            except pg8000.native.DatabaseError as e:
+                code = sqlstate(e)
+                if code not in RETRYABLE_SQLSTATES:
+                    raise
+                with _retry_stats_lock:
+                    _retry_stats['by_sqlstate'][code] = _retry_stats['by_sqlstate'].get(code, 0) + 1
+                    if attempt >= Config.TRANSACTION_MAX_ATTEMPTS:
+                        _retry_stats['transactions'] += 1
+                        _retry_stats['exhausted'] += 1
+                        raise
+                    _retry_stats['retries'] += 1
+                backoff = min(Config.TRANSACTION_RETRY_MAX_DELAY, Config.TRANSACTION_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+                time.sleep(random.uniform(0, backoff))
+                attempt += 1
+                continue
+
+            with _retry_stats_lock:
+                _retry_stats['transactions'] += 1
+                if attempt > 1:
+                    _retry_stats['recovered'] += 1
+            return result
+    return wrapper
+
 def init_db():
     """Initialize database with normalized schema"""
     try:
@@ -32,11 +433,33 @@ def init_db():
             conn.run("ALTER TABLE students ADD COLUMN IF NOT EXISTS birthday DATE")
         except Exception:
             pass
+
+        # Normalized-name search index: folded name for exact/prefix lookups,
+        # trigram table for fuzzy candidates
+        conn.run("ALTER TABLE students ADD COLUMN IF NOT EXISTS search_name TEXT")
+        conn.run("CREATE INDEX IF NOT EXISTS idx_students_search_name ON students (search_name text_pattern_ops)")
+        conn.run('''CREATE TABLE IF NOT EXISTS student_name_trigrams (
+                      trigram TEXT NOT NULL,
+                      student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+                      PRIMARY KEY (trigram, student_id)
+                    )''')
+        conn.run("CREATE INDEX IF NOT EXISTS idx_student_name_trigrams_student ON student_name_trigrams (student_id)")
+
+        # Backfill students created before the search index existed
+        for student_id, name in conn.run("SELECT id, name FROM students WHERE search_name IS NULL"):
+            index_student_name(conn, student_id, name)
         
-        # Courses table
+        # Settings table for registration time control and the active term
+        conn.run('''CREATE TABLE IF NOT EXISTS settings (
+                      key TEXT PRIMARY KEY,
+                      value TEXT NOT NULL
+                    )''')
+
+        # Courses table; course names are unique within a term
         conn.run('''CREATE TABLE IF NOT EXISTS courses (
                       id SERIAL PRIMARY KEY,
-                      name TEXT NOT NULL UNIQUE,
+                      term TEXT NOT NULL,
+                      name TEXT NOT NULL,
                       price INTEGER NOT NULL,
                       sessions INTEGER,
                       frequency TEXT,
@@ -54,6 +477,13 @@ def init_db():
             conn.run("ALTER TABLE courses ADD COLUMN IF NOT EXISTS video_url TEXT")
         except Exception:
             pass
+
+        # Migration: courses created before terms existed belong to the default term
+        term_partition_suffix(Config.DEFAULT_TERM)
+        conn.run(f"ALTER TABLE courses ADD COLUMN IF NOT EXISTS term TEXT NOT NULL DEFAULT '{Config.DEFAULT_TERM}'")
+        conn.run("ALTER TABLE courses ALTER COLUMN term DROP DEFAULT")
+        conn.run("ALTER TABLE courses DROP CONSTRAINT IF EXISTS courses_name_key")
+        conn.run("CREATE UNIQUE INDEX IF NOT EXISTS idx_courses_term_name ON courses (term, name)")
         
         # Supplies table
         conn.run('''CREATE TABLE IF NOT EXISTS supplies (
@@ -62,62 +492,46 @@ def init_db():
                       price INTEGER NOT NULL
                     )''')
         
-        # Registrations table
-        conn.run('''CREATE TABLE IF NOT EXISTS registrations (
-                      id SERIAL PRIMARY KEY,
-                      student_id INTEGER REFERENCES students(id) ON DELETE CASCADE,
-                      class_name TEXT,
-                      email TEXT,
-                      is_paid BOOLEAN DEFAULT FALSE,
+        # Registrations and their line items, partitioned by term
+        init_term_partitions(conn)
+        
+        # Durable background jobs (confirmation emails and other side effects)
+        conn.run('''CREATE TABLE IF NOT EXISTS jobs (
+                      id BIGSERIAL PRIMARY KEY,
+                      kind TEXT NOT NULL,
+                      payload JSONB NOT NULL DEFAULT '{}',
+                      status TEXT NOT NULL DEFAULT 'pending',
+                      attempts INTEGER NOT NULL DEFAULT 0,
+                      max_attempts INTEGER NOT NULL DEFAULT 5,
+                      run_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                      last_error TEXT,
                       created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                       updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )''')
-        
-        # Migration: Ensure email column exists for existing registrations table
-        try:
-            conn.run("ALTER TABLE registrations ADD COLUMN IF NOT EXISTS email TEXT")
-        except Exception:
-            pass
+        conn.run("CREATE INDEX IF NOT EXISTS idx_jobs_pending ON jobs (run_at, id) WHERE status = 'pending'")
+        # Migration: jobs are leased to a worker rather than locked while they run
+        conn.run("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS locked_until TIMESTAMP")
+        conn.run("CREATE INDEX IF NOT EXISTS idx_jobs_running ON jobs (locked_until) WHERE status = 'running'")
 
-        # Migration: Add is_paid column to registrations table
-        try:
-            conn.run("ALTER TABLE registrations ADD COLUMN is_paid BOOLEAN DEFAULT FALSE")
-        except pg8000.native.DatabaseError as e:
-            if '42701' not in str(e): 
-                pass
-        
-        # Registration-Courses junction table (many-to-many)
-        conn.run('''CREATE TABLE IF NOT EXISTS registration_courses (
-                      id SERIAL PRIMARY KEY,
-                      registration_id INTEGER REFERENCES registrations(id) ON DELETE CASCADE,
-                      course_id INTEGER REFERENCES courses(id) ON DELETE CASCADE,
-                      UNIQUE(registration_id, course_id)
-                    )''')
-        
-        # Registration-Supplies junction table (many-to-many)
-        conn.run('''CREATE TABLE IF NOT EXISTS registration_supplies (
-                      id SERIAL PRIMARY KEY,
-                      registration_id INTEGER REFERENCES registrations(id) ON DELETE CASCADE,
-                      supply_id INTEGER REFERENCES supplies(id) ON DELETE CASCADE,
-                      UNIQUE(registration_id, supply_id)
+        # Outcomes of journaled submissions, written in the registration's own
+        # transaction so a replayed intake entry is never applied twice
+        conn.run('''CREATE TABLE IF NOT EXISTS intake_receipts (
+                      receipt TEXT PRIMARY KEY,
+                      result JSONB NOT NULL,
+                      applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )''')
-        
+
+        # Running financial totals, maintained by triggers
+        init_finance_totals(conn)
+
+        # Change stamps and tombstones for the admin "changes since" feed
+        init_change_tracking(conn)
+
         # Insert initial course data
         insert_initial_data(conn)
         
-        # Settings table for registration time control
-        conn.run('''CREATE TABLE IF NOT EXISTS settings (
-                      key TEXT PRIMARY KEY,
-                      value TEXT NOT NULL
-                    )''')
-        
         # Insert default registration time settings
-        default_settings = [
-            ('registration_start', '2026-02-02T16:00'),
-            ('registration_end', '2026-02-20T23:59')
-        ]
-        
-        for setting in default_settings:
+        for setting in DEFAULT_SETTINGS:
             try:
                 conn.run(
                     "INSERT INTO settings (key, value) VALUES (:key, :value) ON CONFLICT (key) DO NOTHING",
@@ -126,41 +540,405 @@ def init_db():
             except:
                 pass
         
+        # Written last, so a partly failed migration never reports the new version
+        conn.run(
+            "INSERT INTO settings (key, value) VALUES ('schema_version', :version) ON CONFLICT (key) DO UPDATE SET value = :version",
+            version=str(SCHEMA_VERSION)
+        )
+
         conn.close()
-        print("Connected to PostgreSQL 'afterschool' database and tables ready.")
+        logger.info("Connected to PostgreSQL 'afterschool' database and tables ready.")
     except Exception as e:
-        print(f"Database Initialization Error: {e}")
+        logger.exception("Database Initialization Error: %s", e)
+
+# Lower-case letters, digits and dashes, e.g. '114-2'; the code is embedded in
+# partition names and DDL, so nothing else is accepted.
+TERM_CODE_PATTERN = re.compile(r'^[0-9a-z][0-9a-z-]{0,31}$')
+
+TERM_PARTITIONED_TABLES = ('registrations', 'registration_courses', 'registration_supplies')
+
+def term_partition_suffix(term):
+    if not isinstance(term, str) or not TERM_CODE_PATTERN.match(term):
+        raise ValueError('學期代碼只能包含小寫英文、數字與 - (例如 114-2)')
+    return term.replace('-', '_')
+
+def ensure_term_partitions(conn, term):
+    """Register a term and create its partition of every term-partitioned table"""
+    suffix = term_partition_suffix(term)
+    conn.run("INSERT INTO terms (code, name) VALUES (:code, :code) ON CONFLICT (code) DO NOTHING", code=term)
+    for table in TERM_PARTITIONED_TABLES:
+        conn.run(f"CREATE TABLE IF NOT EXISTS {table}_{suffix} PARTITION OF {table} FOR VALUES IN ('{term}')")
+
+def _create_registration_tables(conn):
+    # Sequences are shared by all partitions, so IDs stay unique across terms
+    # and routes can keep addressing a registration by ID alone.
+    for table in TERM_PARTITIONED_TABLES:
+        conn.run(f"CREATE SEQUENCE IF NOT EXISTS {table}_id_seq")
+
+    conn.run('''CREATE TABLE IF NOT EXISTS registrations (
+                  id INTEGER NOT NULL DEFAULT nextval('registrations_id_seq'),
+                  term TEXT NOT NULL,
+                  student_id INTEGER REFERENCES students(id) ON DELETE CASCADE,
+                  class_name TEXT,
+                  email TEXT,
+                  is_paid BOOLEAN DEFAULT FALSE,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  change_xid xid8,
+                  PRIMARY KEY (id, term)
+                ) PARTITION BY LIST (term)''')
+
+    # Registration-Courses junction table (many-to-many)
+    conn.run('''CREATE TABLE IF NOT EXISTS registration_courses (
+                  id INTEGER NOT NULL DEFAULT nextval('registration_courses_id_seq'),
+                  term TEXT NOT NULL,
+                  registration_id INTEGER NOT NULL,
+                  course_id INTEGER REFERENCES courses(id) ON DELETE CASCADE,
+                  PRIMARY KEY (id, term),
+                  UNIQUE (registration_id, course_id, term),
+                  FOREIGN KEY (registration_id, term) REFERENCES registrations (id, term) ON DELETE CASCADE
+                ) PARTITION BY LIST (term)''')
+
+    # Registration-Supplies junction table (many-to-many)
+    conn.run('''CREATE TABLE IF NOT EXISTS registration_supplies (
+                  id INTEGER NOT NULL DEFAULT nextval('registration_supplies_id_seq'),
+                  term TEXT NOT NULL,
+                  registration_id INTEGER NOT NULL,
+                  supply_id INTEGER REFERENCES supplies(id) ON DELETE CASCADE,
+                  PRIMARY KEY (id, term),
+                  UNIQUE (registration_id, supply_id, term),
+                  FOREIGN KEY (registration_id, term) REFERENCES registrations (id, term) ON DELETE CASCADE
+                ) PARTITION BY LIST (term)''')
+
+    for table in TERM_PARTITIONED_TABLES:
+        conn.run(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+
+    conn.run("CREATE INDEX IF NOT EXISTS idx_registrations_student_id ON registrations (student_id)")
+    conn.run("CREATE INDEX IF NOT EXISTS idx_registration_courses_course_id ON registration_courses (course_id)")
+
+def init_term_partitions(conn):
+    """Terms, plus registrations and junction tables list-partitioned by term.
+
+    Each term's rows live in their own partitions, so queries scoped to the
+    active term only touch that term's tables and indexes, and a finished
+    term can be detached without rewriting anything.
+    """
+    conn.run('''CREATE TABLE IF NOT EXISTS terms (
+                  code TEXT PRIMARY KEY,
+                  name TEXT NOT NULL,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  archived_at TIMESTAMP
+                )''')
+    conn.run("INSERT INTO settings (key, value) VALUES ('active_term', :term) ON CONFLICT (key) DO NOTHING",
+             term=Config.DEFAULT_TERM)
+
+    conn.run("INSERT INTO terms (code, name) VALUES (:code, :code) ON CONFLICT (code) DO NOTHING",
+             code=Config.DEFAULT_TERM)
+
+    relkind = conn.run("SELECT relkind FROM pg_class WHERE oid = to_regclass('registrations')")
+    if not relkind or relkind[0][0] == 'p':
+        _create_registration_tables(conn)
+        # Archived terms have had their partitions moved away; leave them be
+        for (term,) in conn.run("SELECT code FROM terms WHERE archived_at IS NULL"):
+            ensure_term_partitions(conn, term)
+        return
+
+    # Migration: rebuild unpartitioned tables from before terms existed; all
+    # their rows belong to the default term and keep their IDs.
+    conn.run("BEGIN")
+    try:
+        conn.run("LOCK TABLE registrations, registration_courses, registration_supplies IN ACCESS EXCLUSIVE MODE")
+        conn.run("ALTER TABLE registrations ADD COLUMN IF NOT EXISTS email TEXT")
+        conn.run("ALTER TABLE registrations ADD COLUMN IF NOT EXISTS is_paid BOOLEAN DEFAULT FALSE")
+        conn.run("ALTER TABLE registrations ADD COLUMN IF NOT EXISTS change_xid xid8")
+        for table in TERM_PARTITIONED_TABLES:
+            conn.run(f"CREATE TEMP TABLE legacy_{table} ON COMMIT DROP AS SELECT * FROM {table}")
+            conn.run(f"ALTER SEQUENCE {table}_id_seq OWNED BY NONE")
+        conn.run("DROP TABLE registration_courses, registration_supplies, registrations")
+
+        _create_registration_tables(conn)
+        ensure_term_partitions(conn, Config.DEFAULT_TERM)
+        conn.run('''INSERT INTO registrations (id, term, student_id, class_name, email, is_paid, created_at, updated_at, change_xid)
+                    SELECT id, :term, student_id, class_name, email, is_paid, created_at, updated_at, change_xid
+                    FROM legacy_registrations''', term=Config.DEFAULT_TERM)
+        conn.run('''INSERT INTO registration_courses (id, term, registration_id, course_id)
+                    SELECT id, :term, registration_id, course_id FROM legacy_registration_courses
+                    WHERE registration_id IS NOT NULL''',
+                 term=Config.DEFAULT_TERM)
+        conn.run('''INSERT INTO registration_supplies (id, term, registration_id, supply_id)
+                    SELECT id, :term, registration_id, supply_id FROM legacy_registration_supplies
+                    WHERE registration_id IS NOT NULL''',
+                 term=Config.DEFAULT_TERM)
+        conn.run("COMMIT")
+    except Exception:
+        conn.run("ROLLBACK")
+        raise
+
+def init_finance_totals(conn):
+    """Per-item enrolment and payment counters kept current by triggers.
+
+    Every write to registrations or the junction tables appends a delta row
+    inside the writer's own transaction. Appending takes no row lock, so the
+    counters never serialize registrations or join the course locks in a
+    deadlock. fold_finance_deltas() adds the deltas into finance_item_totals
+    from time to time, and the finance summary reads both, so it costs a
+    handful of rows instead of an aggregate over every registration.
+    """
+    # Migration: counters from before terms existed are rebuilt per term below
+    if not conn.run("""SELECT 1 FROM information_schema.columns
+                       WHERE table_name = 'finance_item_totals' AND column_name = 'term'"""):
+        conn.run("DROP TABLE IF EXISTS finance_item_totals")
+        conn.run("DROP FUNCTION IF EXISTS finance_bump(TEXT, INTEGER, INTEGER, INTEGER)")
+
+    conn.run('''CREATE TABLE IF NOT EXISTS finance_item_totals (
+                  term TEXT NOT NULL,
+                  item_type TEXT NOT NULL,
+                  item_id INTEGER NOT NULL,
+                  enrolled INTEGER NOT NULL DEFAULT 0,
+                  paid INTEGER NOT NULL DEFAULT 0,
+                  PRIMARY KEY (term, item_type, item_id)
+                )''')
+    conn.run('''CREATE TABLE IF NOT EXISTS finance_item_deltas (
+                  term TEXT NOT NULL,
+                  item_type TEXT NOT NULL,
+                  item_id INTEGER NOT NULL,
+                  enrolled INTEGER NOT NULL,
+                  paid INTEGER NOT NULL
+                )''')
+    conn.run("CREATE INDEX IF NOT EXISTS idx_finance_item_deltas_term ON finance_item_deltas (term)")
+
+    # item_type is 'course', 'supply', or 'registration' (item_id 0) for the
+    # registration count itself
+    conn.run('''CREATE OR REPLACE FUNCTION finance_bump(p_term TEXT, p_type TEXT, p_id INTEGER, p_enrolled INTEGER, p_paid INTEGER)
+                RETURNS void LANGUAGE sql AS $$
+                    INSERT INTO finance_item_deltas (term, item_type, item_id, enrolled, paid)
+                    VALUES (p_term, p_type, p_id, p_enrolled, p_paid)
+                $$''')
+
+    conn.run('''CREATE OR REPLACE FUNCTION finance_registration_item_changed() RETURNS trigger
+                LANGUAGE plpgsql AS $$
+                DECLARE
+                    v_type TEXT := TG_ARGV[0];
+                    v_item INTEGER;
+                    v_paid INTEGER;
+                BEGIN
+                    IF TG_OP = 'INSERT' THEN
+                        IF v_type = 'course' THEN v_item := NEW.course_id; ELSE v_item := NEW.supply_id; END IF;
+                        SELECT COALESCE(is_paid, FALSE)::int INTO v_paid FROM registrations
+                        WHERE id = NEW.registration_id AND term = NEW.term;
+                        PERFORM finance_bump(NEW.term, v_type, v_item, 1, COALESCE(v_paid, 0));
+                    ELSE
+                        -- When the registration itself is being deleted it is no longer
+                        -- visible here; its paid share was already removed by the
+                        -- BEFORE DELETE trigger on registrations.
+                        IF v_type = 'course' THEN v_item := OLD.course_id; ELSE v_item := OLD.supply_id; END IF;
+                        SELECT COALESCE(is_paid, FALSE)::int INTO v_paid FROM registrations
+                        WHERE id = OLD.registration_id AND term = OLD.term;
+                        PERFORM finance_bump(OLD.term, v_type, v_item, -1, -COALESCE(v_paid, 0));
+                    END IF;
+                    RETURN NULL;
+                END
+                $$''')
+
+    conn.run('''CREATE OR REPLACE FUNCTION finance_registration_changed() RETURNS trigger
+                LANGUAGE plpgsql AS $$
+                DECLARE
+                    delta INTEGER;
+                BEGIN
+                    IF TG_OP = 'INSERT' THEN
+                        PERFORM finance_bump(NEW.term, 'registration', 0, 1, COALESCE(NEW.is_paid, FALSE)::int);
+                        RETURN NULL;
+                    ELSIF TG_OP = 'DELETE' THEN
+                        -- Runs BEFORE the delete, while the line items still exist
+                        IF COALESCE(OLD.is_paid, FALSE) THEN
+                            PERFORM finance_bump(OLD.term, 'course', course_id, 0, -1)
+                            FROM registration_courses WHERE registration_id = OLD.id AND term = OLD.term;
+                            PERFORM finance_bump(OLD.term, 'supply', supply_id, 0, -1)
+                            FROM registration_supplies WHERE registration_id = OLD.id AND term = OLD.term;
+                        END IF;
+                        PERFORM finance_bump(OLD.term, 'registration', 0, -1, -COALESCE(OLD.is_paid, FALSE)::int);
+                        RETURN OLD;
+                    END IF;
+
+                    delta := COALESCE(NEW.is_paid, FALSE)::int - COALESCE(OLD.is_paid, FALSE)::int;
+                    IF delta <> 0 THEN
+                        PERFORM finance_bump(NEW.term, 'course', course_id, 0, delta)
+                        FROM registration_courses WHERE registration_id = NEW.id AND term = NEW.term;
+                        PERFORM finance_bump(NEW.term, 'supply', supply_id, 0, delta)
+                        FROM registration_supplies WHERE registration_id = NEW.id AND term = NEW.term;
+                        PERFORM finance_bump(NEW.term, 'registration', 0, 0, delta);
+                    END IF;
+                    RETURN NULL;
+                END
+                $$''')
+
+    # Triggers and the initial fill happen under one lock so no write can slip
+    # between counting the existing rows and the triggers taking over.
+    conn.run("BEGIN")
+    try:
+        conn.run("LOCK TABLE registrations, registration_courses, registration_supplies IN SHARE ROW EXCLUSIVE MODE")
+
+        conn.run("DROP TRIGGER IF EXISTS finance_registration_courses ON registration_courses")
+        conn.run('''CREATE TRIGGER finance_registration_courses
+                    AFTER INSERT OR DELETE ON registration_courses
+                    FOR EACH ROW EXECUTE FUNCTION finance_registration_item_changed('course')''')
+        conn.run("DROP TRIGGER IF EXISTS finance_registration_supplies ON registration_supplies")
+        conn.run('''CREATE TRIGGER finance_registration_supplies
+                    AFTER INSERT OR DELETE ON registration_supplies
+                    FOR EACH ROW EXECUTE FUNCTION finance_registration_item_changed('supply')''')
+        conn.run("DROP TRIGGER IF EXISTS finance_registrations_write ON registrations")
+        conn.run('''CREATE TRIGGER finance_registrations_write
+                    AFTER INSERT OR UPDATE OF is_paid ON registrations
+                    FOR EACH ROW EXECUTE FUNCTION finance_registration_changed()''')
+        conn.run("DROP TRIGGER IF EXISTS finance_registrations_delete ON registrations")
+        conn.run('''CREATE TRIGGER finance_registrations_delete
+                    BEFORE DELETE ON registrations
+                    FOR EACH ROW EXECUTE FUNCTION finance_registration_changed()''')
+
+        # Deltas count only what the triggers saw, so fill just once, before any
+        if not conn.run("SELECT 1 FROM finance_item_totals UNION ALL SELECT 1 FROM finance_item_deltas LIMIT 1"):
+            conn.run("""
+                INSERT INTO finance_item_totals (term, item_type, item_id, enrolled, paid)
+                SELECT rc.term, 'course', rc.course_id, COUNT(*), COUNT(*) FILTER (WHERE r.is_paid)
+                FROM registration_courses rc JOIN registrations r ON r.id = rc.registration_id AND r.term = rc.term
+                GROUP BY rc.term, rc.course_id
+                UNION ALL
+                SELECT rs.term, 'supply', rs.supply_id, COUNT(*), COUNT(*) FILTER (WHERE r.is_paid)
+                FROM registration_supplies rs JOIN registrations r ON r.id = rs.registration_id AND r.term = rs.term
+                GROUP BY rs.term, rs.supply_id
+                UNION ALL
+                SELECT term, 'registration', 0, COUNT(*), COUNT(*) FILTER (WHERE is_paid)
+                FROM registrations
+                GROUP BY term
+            """)
+        conn.run("COMMIT")
+    except Exception:
+        conn.run("ROLLBACK")
+        raise
+
+def fold_finance_deltas(conn):
+    """Add the pending finance deltas into finance_item_totals; returns how many were folded.
+
+    Only maintenance calls this, so the counter rows it locks are never
+    wanted by a registration.
+    """
+    rows = conn.run("""
+        WITH folded AS (
+            DELETE FROM finance_item_deltas
+            RETURNING term, item_type, item_id, enrolled, paid
+        ), summed AS (
+            INSERT INTO finance_item_totals (term, item_type, item_id, enrolled, paid)
+            SELECT term, item_type, item_id, SUM(enrolled), SUM(paid)
+            FROM folded
+            GROUP BY term, item_type, item_id
+            ORDER BY term, item_type, item_id
+            ON CONFLICT (term, item_type, item_id) DO UPDATE
+            SET enrolled = finance_item_totals.enrolled + EXCLUDED.enrolled,
+                paid = finance_item_totals.paid + EXCLUDED.paid
+        )
+        SELECT COUNT(*) FROM folded
+    """)
+    return rows[0][0]
+
+def init_change_tracking(conn):
+    """Stamp every registration write with its transaction ID and keep tombstones for deletes.
+
+    Clients page through changes with a cursor equal to the oldest transaction
+    still running when they last synced, so a write that commits late is
+    never skipped; at worst a row is sent twice.
+    """
+    conn.run("ALTER TABLE registrations ADD COLUMN IF NOT EXISTS change_xid xid8")
+    conn.run("CREATE INDEX IF NOT EXISTS idx_registrations_change_xid ON registrations (change_xid)")
+    conn.run('''CREATE TABLE IF NOT EXISTS registration_tombstones (
+                  registration_id INTEGER PRIMARY KEY,
+                  term TEXT,
+                  change_xid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+                  deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                )''')
+    # Migration: tombstones are per term like the registrations they stand for.
+    # Rows from before this have no term and are sent to every term's clients.
+    conn.run("ALTER TABLE registration_tombstones ADD COLUMN IF NOT EXISTS term TEXT")
+    conn.run("DROP INDEX IF EXISTS idx_registration_tombstones_change_xid")
+    conn.run("CREATE INDEX IF NOT EXISTS idx_registration_tombstones_term_change_xid ON registration_tombstones (term, change_xid)")
+    conn.run("CREATE INDEX IF NOT EXISTS idx_registration_tombstones_deleted_at ON registration_tombstones (deleted_at)")
+
+    conn.run('''CREATE OR REPLACE FUNCTION registration_stamp_change() RETURNS trigger
+                LANGUAGE plpgsql AS $$
+                BEGIN
+                    NEW.change_xid := pg_current_xact_id();
+                    RETURN NEW;
+                END
+                $$''')
+    # Tombstones older than the retention window are pruned as new ones arrive;
+    # cursors that old are answered with a full reload instead.
+    conn.run('''CREATE OR REPLACE FUNCTION registration_tombstone() RETURNS trigger
+                LANGUAGE plpgsql AS $$
+                BEGIN
+                    DELETE FROM registration_tombstones
+                    WHERE deleted_at < CURRENT_TIMESTAMP - CAST(TG_ARGV[0] AS INTERVAL);
+                    INSERT INTO registration_tombstones (registration_id, term) VALUES (OLD.id, OLD.term)
+                    ON CONFLICT (registration_id) DO UPDATE
+                    SET term = EXCLUDED.term, change_xid = EXCLUDED.change_xid, deleted_at = EXCLUDED.deleted_at;
+                    RETURN NULL;
+                END
+                $$''')
+
+    conn.run("BEGIN")
+    try:
+        conn.run("DROP TRIGGER IF EXISTS registrations_stamp_change ON registrations")
+        conn.run('''CREATE TRIGGER registrations_stamp_change
+                    BEFORE INSERT OR UPDATE ON registrations
+                    FOR EACH ROW EXECUTE FUNCTION registration_stamp_change()''')
+        conn.run("DROP TRIGGER IF EXISTS registrations_tombstone ON registrations")
+        conn.run(f'''CREATE TRIGGER registrations_tombstone
+                    AFTER DELETE ON registrations
+                    FOR EACH ROW EXECUTE FUNCTION registration_tombstone('{int(Config.TOMBSTONE_RETENTION_DAYS)} days')''')
+        conn.run("COMMIT")
+    except Exception:
+        conn.run("ROLLBACK")
+        raise
+
+# Default catalog: (name, price, sessions, frequency, description)
+DEFAULT_COURSES = [
+    ('幼兒感統 (限小幼班)', 8000, 20, '每週1次，1次1小時', None),
+    ('兒童舞蹈 (大中小幼班)', 4400, 20, '每週1次，1次1小時', None),
+    ('足球 (中大班)', 5000, 20, '每週1次，1次1小時', None),
+    ('足球 (中小班)', 5000, 20, '每週1次，1次1小時', None),
+    ('3C3Q積木與桌遊 (大中小)', 5200, 20, '每週1次，1次1小時', None),
+    ('幼兒美術 (大中小幼)', 4400, 20, '每週1次，1次1小時', None),
+    ('菁英美語 (限大班)', 7000, 40, '每週2次', '教材費另計$1500'),
+    ('菁英美語教材費', 1500, None, None, '選修菁英美語者必選')
+]
+
+DEFAULT_SUPPLIES = [
+    ('全套舞蹈服裝', 1400),
+    ('舞衣', 700),
+    ('舞鞋', 250),
+    ('舞襪', 150),
+    ('舞袋', 300)
+]
+
+# Bump when init_db gains a migration; /readyz compares it with the database
+SCHEMA_VERSION = 4
+
+DEFAULT_SETTINGS = [
+    ('registration_start', '2026-02-02T16:00'),
+    ('registration_end', '2026-02-20T23:59')
+]
 
 def insert_initial_data(conn):
-    courses_data = [
-        ('幼兒感統 (限小幼班)', 8000, 20, '每週1次，1次1小時', None),
-        ('兒童舞蹈 (大中小幼班)', 4400, 20, '每週1次，1次1小時', None),
-        ('足球 (中大班)', 5000, 20, '每週1次，1次1小時', None),
-        ('足球 (中小班)', 5000, 20, '每週1次，1次1小時', None),
-        ('3C3Q積木與桌遊 (大中小)', 5200, 20, '每週1次，1次1小時', None),
-        ('幼兒美術 (大中小幼)', 4400, 20, '每週1次，1次1小時', None),
-        ('菁英美語 (限大班)', 7000, 40, '每週2次', '教材費另計$1500'),
-        ('菁英美語教材費', 1500, None, None, '選修菁英美語者必選')
-    ]
-    
-    for course in courses_data:
+    # The default catalog belongs to the default term; later terms copy theirs
+    # when they are created
+    for course in DEFAULT_COURSES:
         try:
             conn.run(
-                "INSERT INTO courses (name, price, sessions, frequency, description) VALUES (:name, :price, :sessions, :frequency, :description) ON CONFLICT (name) DO NOTHING",
-                name=course[0], price=course[1], sessions=course[2], frequency=course[3], description=course[4]
+                "INSERT INTO courses (term, name, price, sessions, frequency, description) VALUES (:term, :name, :price, :sessions, :frequency, :description) ON CONFLICT (term, name) DO NOTHING",
+                term=Config.DEFAULT_TERM, name=course[0], price=course[1], sessions=course[2], frequency=course[3], description=course[4]
             )
         except:
             pass
     
-    supplies_data = [
-        ('全套舞蹈服裝', 1400),
-        ('舞衣', 700),
-        ('舞鞋', 250),
-        ('舞襪', 150),
-        ('舞袋', 300)
-    ]
-    
-    for supply in supplies_data:
+    for supply in DEFAULT_SUPPLIES:
         try:
             conn.run(
                 "INSERT INTO supplies (name, price) VALUES (:name, :price) ON CONFLICT (name) DO NOTHING",
@@ -0,0 +1,56 @@
+import logging
+import re
+import time
+import uuid
+from flask import request, g
+from database import SQLUsage, add_sql_recorder, remove_sql_recorder
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+# A caller-supplied ID is kept only if it is short and plain enough to log as-is
+_REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+logger = logging.getLogger('access')
+
+def start_request():
+    """before_request hook, registered first so throttled requests are logged too"""
+    incoming = request.headers.get(REQUEST_ID_HEADER, '')
+    g.request_id = incoming if _REQUEST_ID_PATTERN.match(incoming) else uuid.uuid4().hex
+    g.request_started = time.perf_counter()
+    g.sql_usage = add_sql_recorder(SQLUsage())
+
+def log_request(response):
+    """after_request hook, registered before the others so it runs last.
+
+    A streamed body is produced after this hook, so its line is written when
+    the response closes and its timing and SQL usage cover the whole body.
+    """
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    usage = g.pop('sql_usage')
+    response.headers[REQUEST_ID_HEADER] = g.request_id
+    # The request context is gone by the time a streamed response closes
+    fields = {
+        'method': request.method,
+        'route': request.url_rule.rule if request.url_rule else None,
+        'path': request.path,
+        'status': response.status_code,
+        'queue_ms': g.get('load_shed_wait_ms'),
+        # Header only: computing the length would buffer a streamed body
+        'bytes': response.content_length
+    }
+
+    def finish():
+        remove_sql_recorder(usage)
+        logger.info('%s %s %s', fields['method'], fields['path'], fields['status'], extra=dict(
+            fields,
+            latency_ms=round((time.perf_counter() - started) * 1000, 3),
+            db_ms=round(usage.seconds * 1000, 3),
+            db_queries=usage.count
+        ))
+
+    if response.is_streamed:
+        response.call_on_close(finish)
+    else:
+        finish()
+    return response
@@ -0,0 +1,132 @@
+import zlib
+from flask import request
+from werkzeug.wsgi import ClosingIterator
+from config import Config
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/javascript',
+    'text/javascript',
+    'text/html',
+    'text/css',
+    'text/csv',
+    'text/plain',
+    'image/svg+xml',
+}
+
+def parse_accept_encoding(header):
+    """Map each coding in an Accept-Encoding header to its q-value"""
+    codings = {}
+    for part in header.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        coding, _, params = part.partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding.strip().lower()] = q
+    return codings
+
+def choose_encoding(header):
+    codings = parse_accept_encoding(header or '')
+    wildcard = codings.get('*', 0.0)
+    candidates = []
+    if brotli is not None:
+        candidates.append(('br', codings.get('br', wildcard)))
+    candidates.append(('gzip', codings.get('gzip', wildcard)))
+    # Highest q wins; on ties the earlier (smaller output) coding is kept
+    best, best_q = None, 0.0
+    for coding, q in candidates:
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+class _Compressor:
+    """Incremental gzip/brotli encoder with a common process/flush/finish interface"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._obj = brotli.Compressor(quality=Config.BROTLI_QUALITY)
+        else:
+            self._obj = zlib.compressobj(Config.COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def process(self, data):
+        if self.encoding == 'br':
+            return self._obj.process(data)
+        return self._obj.compress(data)
+
+    def flush(self):
+        if self.encoding == 'br':
+            return self._obj.flush()
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._obj.finish()
+        return self._obj.flush(zlib.Z_FINISH)
+
+def _compress_stream(chunks, encoding):
+    compressor = _Compressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if not chunk:
+                continue
+            # Flush after each upstream chunk so streamed responses keep a low
+            # time-to-first-byte instead of waiting for the encoder's buffer.
+            out = compressor.process(chunk) + compressor.flush()
+            if out:
+                yield out
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def compress_response(response):
+    if not Config.COMPRESSION_ENABLED or request.method == 'HEAD':
+        return response
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return response
+    if 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+
+    if response.is_streamed or response.direct_passthrough:
+        response.direct_passthrough = False
+        upstream = response.response
+        # A generator closed before its first chunk never reaches its finally,
+        # so the upstream close (e.g. a DB cursor's release) is chained here too
+        response.response = ClosingIterator(_compress_stream(upstream, encoding),
+                                            getattr(upstream, 'close', None))
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < Config.COMPRESSION_MIN_SIZE:
+            return response
+        compressor = _Compressor(encoding)
+        response.set_data(compressor.process(data) + compressor.finish())
+
+    response.headers['Content-Encoding'] = encoding
+    # The encoded body differs from the identity one, so a strong validator
+    # computed before compression may only be offered as a weak one.
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
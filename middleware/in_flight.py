@@ -0,0 +1,43 @@
+import threading
+from flask import request, g
+
+_counts = {}
+_lock = threading.Lock()
+
+def track_request():
+    """before_request hook: count the request until its response is closed"""
+    endpoint = request.endpoint or 'unknown'
+    g.in_flight_endpoint = endpoint
+    with _lock:
+        _counts[endpoint] = _counts.get(endpoint, 0) + 1
+
+def _untrack(endpoint):
+    with _lock:
+        _counts[endpoint] -= 1
+        if not _counts[endpoint]:
+            del _counts[endpoint]
+
+def untrack_on_close(response):
+    """after_request hook: a streamed body is still in flight until it has been sent"""
+    if 'in_flight_endpoint' in g:
+        endpoint = g.pop('in_flight_endpoint')
+        untracked = []
+
+        def untrack():
+            if not untracked:
+                untracked.append(True)
+                _untrack(endpoint)
+
+        response.call_on_close(untrack)
+    return response
+
+def untrack_request(error=None):
+    # Reached without untrack_on_close when the view raised past the error handlers
+    endpoint = g.pop('in_flight_endpoint', None)
+    if endpoint is not None:
+        _untrack(endpoint)
+
+def in_flight_stats():
+    with _lock:
+        by_endpoint = dict(_counts)
+    return {'total': sum(by_endpoint.values()), 'by_endpoint': by_endpoint}
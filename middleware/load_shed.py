@@ -0,0 +1,147 @@
+import logging
+import math
+import threading
+import time
+from flask import request, jsonify, g
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class ConcurrencyLimiter:
+    """At most max_in_flight requests of one class at a time, plus a short FIFO-ish queue.
+
+    A request that finds the queue full, or waits longer than max_wait
+    seconds for a slot, is refused at once instead of piling up on the
+    connection pool behind everyone else.
+    """
+
+    def __init__(self, name, max_in_flight, max_queue, max_wait, retry_after):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seen = 0.0
+
+    def acquire(self):
+        """Seconds spent queueing, or None when the request is shed"""
+        started = time.monotonic()
+        with self._cond:
+            # Nobody jumps ahead of requests that are already waiting
+            if self.in_flight < self.max_in_flight and not self.waiting:
+                self.in_flight += 1
+                self.admitted += 1
+                return 0.0
+            if self.waiting >= self.max_queue:
+                self.shed += 1
+                return None
+
+            self.waiting += 1
+            try:
+                deadline = started + self.max_wait
+                while self.in_flight >= self.max_in_flight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.shed += 1
+                        return None
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+                self.admitted += 1
+                self.queued += 1
+                waited = time.monotonic() - started
+                self.wait_seconds += waited
+                self.max_wait_seen = max(self.max_wait_seen, waited)
+                return waited
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'limit': self.max_in_flight,
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'shed': self.shed,
+                'avg_wait_ms': round(self.wait_seconds / self.queued * 1000, 3) if self.queued else 0.0,
+                'max_wait_ms': round(self.max_wait_seen * 1000, 3)
+            }
+
+_limiters = {
+    name: ConcurrencyLimiter(name, *limits)
+    for name, limits in Config.LOAD_SHED_LIMITS.items()
+}
+
+def _priority_class(endpoint):
+    if endpoint is None:
+        return None
+    if endpoint in Config.LOAD_SHED_CLASSES:
+        return Config.LOAD_SHED_CLASSES[endpoint]
+    return Config.LOAD_SHED_CLASSES.get(endpoint.split('.', 1)[0])
+
+def load_shed():
+    """before_request hook: admit the request into its class or answer 503 immediately"""
+    if not Config.LOAD_SHED_ENABLED or request.method == 'OPTIONS':
+        return None
+    limiter = _limiters.get(_priority_class(request.endpoint))
+    if limiter is None:
+        return None
+    if request.blueprint == 'admin':
+        # Imported here: the admin routes import this module for their stats
+        from routes.admin import check_auth
+        if not check_auth():
+            # require_auth answers 401 without touching the database; a bad
+            # token must not take one of the few admin slots from real admins
+            return None
+
+    waited = limiter.acquire()
+    if waited is None:
+        logger.warning('Shedding %s request to %s', limiter.name, request.endpoint,
+                       extra={'priority_class': limiter.name})
+        response = jsonify({'message': '系統忙碌中，請稍後再試 Service busy, please retry later.'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(max(1, math.ceil(limiter.retry_after)))
+        return response
+
+    g.load_shed_limiter = limiter
+    g.load_shed_wait_ms = round(waited * 1000, 3)
+    return None
+
+def _release():
+    limiter = g.pop('load_shed_limiter', None)
+    if limiter is not None:
+        limiter.release()
+
+def hold_until_closed(response):
+    """after_request hook: keep the slot until a streamed body has been sent"""
+    if 'load_shed_limiter' in g:
+        limiter = g.pop('load_shed_limiter')
+        released = []
+
+        def release():
+            if not released:
+                released.append(True)
+                limiter.release()
+
+        response.call_on_close(release)
+    return response
+
+def release_on_teardown(error=None):
+    # Reached without hold_until_closed when the view raised past the error handlers
+    _release()
+
+def load_shed_stats():
+    return {name: limiter.stats() for name, limiter in _limiters.items()}
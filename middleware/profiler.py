@@ -0,0 +1,183 @@
+import cProfile
+import json
+import logging
+import os
+import pstats
+import re
+import secrets
+import time
+from collections import Counter
+from datetime import datetime
+from flask import request, g
+from config import Config
+from database import SQLTimeline, add_sql_recorder, remove_sql_recorder
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+CAPTURE_ID_PATTERN = re.compile(r'^[0-9]{8}-[0-9]{6}-[0-9a-f]{8}$')
+# Deeper call paths are cut off in the folded output
+MAX_STACK_DEPTH = 200
+
+def _requested():
+    return request.headers.get(PROFILE_HEADER) == '1' or request.args.get('profile') == '1'
+
+def start_profile():
+    """before_request hook: profile this request when a signed-in admin asks for it"""
+    if not _requested():
+        return
+    # Imported here: the admin routes import this module for the capture listing
+    from routes.admin import check_auth
+    if not check_auth():
+        return
+    g.profile_started = time.perf_counter()
+    g.profile_timeline = add_sql_recorder(SQLTimeline())
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+def finish_profile(response):
+    """after_request hook, registered right after the access log so it runs just before it.
+
+    A streamed body is produced after this hook, so the profiler keeps running
+    until the response closes and the capture is saved then, under the ID
+    already sent in the X-Profile-Id header.
+    """
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    timeline = g.pop('profile_timeline')
+    started = g.pop('profile_started')
+    capture_id = f"{datetime.now():%Y%m%d-%H%M%S}-{secrets.token_hex(4)}"
+    # The request context is gone by the time a streamed response closes
+    request_info = {
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint,
+        'status': response.status_code
+    }
+
+    def finish():
+        profiler.disable()
+        remove_sql_recorder(timeline)
+        duration_ms = round((time.perf_counter() - started) * 1000, 3)
+        try:
+            _save_capture(capture_id, profiler, timeline, request_info, duration_ms)
+        except Exception as e:
+            logger.exception("Saving profile failed: %s", e)
+
+    response.headers['X-Profile-Id'] = capture_id
+    if response.is_streamed:
+        response.call_on_close(finish)
+    else:
+        finish()
+    return response
+
+def _frame_label(func):
+    filename, lineno, name = func
+    if filename == '~':
+        label = name  # built-in, e.g. <method 'execute' ...>
+    else:
+        filename = os.path.relpath(filename) if filename.startswith(os.getcwd()) else os.path.basename(filename)
+        label = f"{name} ({filename}:{lineno})"
+    # ';' separates frames in the folded format
+    return label.replace(';', ',')
+
+def folded_stacks(stats):
+    """Collapsed stacks ('a;b;c <microseconds>') as read by flamegraph.pl and speedscope.
+
+    cProfile keeps caller/callee pairs rather than whole stacks, so each path's
+    time is the callee's time under that caller, scaled by the share of the
+    caller's own time that reached it along the path.
+    """
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller in callers:
+            callees.setdefault(caller, []).append(func)
+
+    lines = Counter()
+
+    def walk(func, path, cumulative):
+        _, _, own, total, _ = stats[func]
+        share = cumulative / total if total else 0
+        stack = path + [_frame_label(func)]
+        lines[';'.join(stack)] += own * share
+        if len(stack) >= MAX_STACK_DEPTH:
+            return
+        for callee in callees.get(func, ()):
+            if _frame_label(callee) in stack:
+                continue  # recursion: already attributed on the way down
+            edge = stats[callee][4][func][3] * share
+            if edge >= 1e-6:
+                walk(callee, stack, edge)
+
+    for func, (_, _, _, total, callers) in stats.items():
+        if not callers:
+            walk(func, [], total)
+
+    return '\n'.join(f"{stack} {round(seconds * 1e6)}" for stack, seconds in lines.items()
+                     if round(seconds * 1e6) > 0) + '\n'
+
+def _save_capture(capture_id, profiler, timeline, request_info, duration_ms):
+    os.makedirs(Config.PROFILE_DIR, exist_ok=True)
+    base = os.path.join(Config.PROFILE_DIR, capture_id)
+
+    profiler.dump_stats(base + '.pstats')
+    stats = pstats.Stats(profiler)
+    with open(base + '.folded', 'w', encoding='utf-8') as f:
+        f.write(folded_stacks(stats.stats))
+
+    hottest = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:20]
+    with open(base + '.json', 'w', encoding='utf-8') as f:
+        json.dump({
+            'id': capture_id,
+            'created_at': datetime.now().isoformat(),
+            **request_info,
+            'duration_ms': duration_ms,
+            'sql_count': len(timeline.entries),
+            'sql_ms': round(sum(e['duration_ms'] for e in timeline.entries), 3),
+            'sql_timeline': timeline.entries,
+            'hottest': [{
+                'function': _frame_label(func),
+                'calls': calls,
+                'own_ms': round(own * 1000, 3),
+                'cumulative_ms': round(total * 1000, 3)
+            } for func, (_, calls, own, total, _) in hottest]
+        }, f, ensure_ascii=False)
+
+    _prune_captures()
+
+def _prune_captures():
+    ids = sorted(name[:-5] for name in os.listdir(Config.PROFILE_DIR) if name.endswith('.json'))
+    for capture_id in ids[:-Config.PROFILE_KEEP] if Config.PROFILE_KEEP else []:
+        for suffix in ('.json', '.pstats', '.folded'):
+            try:
+                os.remove(os.path.join(Config.PROFILE_DIR, capture_id + suffix))
+            except FileNotFoundError:
+                pass
+
+def list_captures():
+    """Summaries of the kept captures, newest first"""
+    if not os.path.isdir(Config.PROFILE_DIR):
+        return []
+    captures = []
+    for name in sorted(os.listdir(Config.PROFILE_DIR), reverse=True):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(Config.PROFILE_DIR, name), encoding='utf-8') as f:
+                capture = json.load(f)
+        except (OSError, ValueError):
+            continue  # pruned or still being written
+        capture.pop('sql_timeline', None)
+        capture.pop('hottest', None)
+        captures.append(capture)
+    return captures
+
+def load_capture(capture_id):
+    if not CAPTURE_ID_PATTERN.match(capture_id):
+        return None
+    try:
+        with open(os.path.join(Config.PROFILE_DIR, capture_id + '.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
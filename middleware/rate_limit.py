@@ -0,0 +1,163 @@
+import math
+import threading
+import time
+from flask import request, jsonify
+from config import Config
+from services.name_index import normalize_name
+
+try:
+    import redis
+except ImportError:  # only needed when RATE_LIMIT_STORAGE_URL points at Redis
+    redis = None
+
+class MemoryBucketStore:
+    """Token buckets in this process; fine for a single worker"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def consume(self, buckets):
+        """Take a token from every (key, capacity, rate) bucket, or from none.
+
+        Returns (allowed, retry_after). A request refused by one bucket must
+        not drain the others, or a client blocked per name would also burn
+        its per-IP allowance on every retry.
+        """
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            retry_after = 0.0
+            for key, capacity, rate in buckets:
+                tokens, updated = self._buckets.get(key, (capacity, now))
+                tokens = min(capacity, tokens + (now - updated) * rate)
+                levels.append((key, tokens))
+                if tokens < 1:
+                    retry_after = max(retry_after, (1 - tokens) / rate)
+            allowed = retry_after == 0.0
+            for key, tokens in levels:
+                self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+
+            self._calls += 1
+            if self._calls % 1000 == 0:
+                self._prune(now)
+        return allowed, retry_after
+
+    def _prune(self, now):
+        # A bucket idle long enough to refill completely carries no state
+        longest_refill = max((c / r for c, r in _all_limits()), default=0)
+        stale = [k for k, (_, updated) in self._buckets.items() if now - updated > longest_refill]
+        for key in stale:
+            del self._buckets[key]
+
+class RedisBucketStore:
+    """Token buckets shared by every worker through Redis, checked and taken in one Lua call"""
+
+    SCRIPT = """
+        local t = redis.call('TIME')
+        local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+        local levels = {}
+        local retry_after = 0
+        for i, key in ipairs(KEYS) do
+            local capacity = tonumber(ARGV[2 * i - 1])
+            local rate = tonumber(ARGV[2 * i])
+            local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+            local tokens = tonumber(bucket[1]) or capacity
+            local updated = tonumber(bucket[2]) or now
+            tokens = math.min(capacity, tokens + (now - updated) * rate)
+            levels[i] = tokens
+            if tokens < 1 then
+                retry_after = math.max(retry_after, (1 - tokens) / rate)
+            end
+        end
+        local allowed = 0
+        if retry_after == 0 then
+            allowed = 1
+        end
+        for i, key in ipairs(KEYS) do
+            local capacity = tonumber(ARGV[2 * i - 1])
+            local rate = tonumber(ARGV[2 * i])
+            redis.call('HSET', key, 'tokens', tostring(levels[i] - allowed), 'updated', tostring(now))
+            redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+        end
+        return {allowed, tostring(retry_after)}
+    """
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError('RATE_LIMIT_STORAGE_URL uses Redis but the redis package is not installed')
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    def consume(self, buckets):
+        keys = [f'ratelimit:{key}' for key, _, _ in buckets]
+        args = [value for _, capacity, rate in buckets for value in (capacity, rate)]
+        allowed, retry_after = self._script(keys=keys, args=args)
+        return bool(allowed), float(retry_after)
+
+def _all_limits():
+    for limits in Config.RATE_LIMITS.values():
+        for _, requests, period in limits:
+            yield requests, requests / period
+
+def _create_store():
+    url = Config.RATE_LIMIT_STORAGE_URL
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBucketStore(url)
+    return MemoryBucketStore()
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _create_store()
+    return _store
+
+def client_ip():
+    """Client address, trusting only as many X-Forwarded-For hops as we have proxies"""
+    hops = Config.TRUSTED_PROXY_COUNT
+    if hops > 0:
+        forwarded = [part.strip() for part in request.headers.get('X-Forwarded-For', '').split(',') if part.strip()]
+        if len(forwarded) >= hops:
+            return forwarded[-hops]
+    return request.remote_addr or 'unknown'
+
+def student_name():
+    if request.method == 'GET':
+        name = request.args.get('name')
+    else:
+        name = (request.get_json(silent=True) or {}).get('name')
+    return normalize_name(name) if isinstance(name, str) else ''
+
+def rate_limit():
+    """before_request hook: answer 429 before the view (and the database) is reached"""
+    if not Config.RATE_LIMIT_ENABLED or request.method == 'OPTIONS':
+        return None
+    limits = Config.RATE_LIMITS.get(request.endpoint)
+    if not limits:
+        return None
+
+    buckets = []
+    for scope, requests, period in limits:
+        if scope == 'ip':
+            subject = client_ip()
+        else:
+            subject = student_name()
+            if not subject:
+                continue
+        buckets.append((f'{request.endpoint}:{scope}:{subject}', requests, requests / period))
+    if not buckets:
+        return None
+
+    allowed, retry_after = get_store().consume(buckets)
+    if not allowed:
+        response = jsonify({'message': '請求過於頻繁，請稍後再試 Too many requests, please retry later.'})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
+    return None
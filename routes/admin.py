@@ -1,10 +1,20 @@
 
-from flask import Blueprint, request, jsonify, render_template, abort
-from services.admin_service import AdminService
+from flask import Blueprint, request, jsonify, render_template, abort, send_from_directory, Response
+from services.admin_service import AdminService, CourseBatchError
 from config import Config
+from database import pool_stats, statement_cache_stats, retry_stats
+from services.singleflight import flights
+from services.term_service import TermService
+from services.intake import intake_stats
+from middleware.profiler import list_captures, load_capture
+from services.structured_log import log_stats
+from middleware.load_shed import load_shed_stats
+import os
 import secrets
+import logging
 
 admin_bp = Blueprint('admin', __name__)
+logger = logging.getLogger(__name__)
 
 # Simple in-memory session store
 active_sessions = set()
@@ -70,28 +80,128 @@ def login():
 
 @admin_bp.route('/admin/registrations', methods=['GET'])
 def get_registrations():
+    since = request.args.get('since')
+    term = request.args.get('term')
     try:
-        data = AdminService.get_dashboard_stats()
-        return jsonify(data)
+        if since:
+            return jsonify(AdminService.get_dashboard_changes(since, term))
+        # Streamed: memory stays flat however many registrations the term has
+        return Response(AdminService.stream_dashboard(term), mimetype='application/json')
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        logger.exception('Request failed')
+        return jsonify({'message': str(e)}), 500
+
+@admin_bp.route('/admin/rosters', methods=['GET'])
+def export_rosters():
+    try:
+        filename, chunks = AdminService.export_rosters(request.args.get('term'))
+        response = Response(chunks, mimetype='application/zip')
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        logger.exception('Request failed')
+        return jsonify({'message': str(e)}), 500
+
+@admin_bp.route('/admin/db/stats', methods=['GET'])
+def get_db_stats():
+    return jsonify({
+        'pools': pool_stats(),
+        'statements': statement_cache_stats(),
+        'singleflight': flights.stats(),
+        'transactions': retry_stats(),
+        'intake': intake_stats(),
+        'logging': log_stats(),
+        'load_shedding': load_shed_stats()
+    })
+
+@admin_bp.route('/admin/profiles', methods=['GET'])
+def get_profiles():
+    return jsonify({'profiles': list_captures()})
+
+@admin_bp.route('/admin/profiles/<capture_id>', methods=['GET'])
+def get_profile(capture_id):
+    capture = load_capture(capture_id)
+    if capture is None:
+        return jsonify({'message': 'Profile not found'}), 404
+    return jsonify(capture)
+
+@admin_bp.route('/admin/profiles/<capture_id>/<kind>', methods=['GET'])
+def download_profile(capture_id, kind):
+    # 'folded' for flamegraph.pl / speedscope, 'pstats' for snakeviz or pstats
+    if kind not in ('folded', 'pstats') or load_capture(capture_id) is None:
+        return jsonify({'message': 'Profile not found'}), 404
+    return send_from_directory(os.path.abspath(Config.PROFILE_DIR), f'{capture_id}.{kind}',
+                               as_attachment=True, mimetype='text/plain' if kind == 'folded' else 'application/octet-stream')
+
+@admin_bp.route('/admin/finance/summary', methods=['GET'])
+def get_finance_summary():
+    try:
+        return jsonify(AdminService.get_finance_summary(request.args.get('term')))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
+        logger.exception('Request failed')
+        return jsonify({'message': str(e)}), 500
+
+@admin_bp.route('/admin/students/search', methods=['GET'])
+def search_students():
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    try:
+        results = AdminService.search_students(query, limit=limit)
+        return jsonify({'results': results})
+    except Exception as e:
+        logger.exception('Request failed')
         return jsonify({'message': str(e)}), 500
 
 @admin_bp.route('/admin/courses', methods=['GET'])
 def get_courses():
     try:
-        courses = AdminService.get_courses_stats()
+        courses = AdminService.get_courses_stats(request.args.get('term'))
         return jsonify({'courses': courses})
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
+        logger.exception('Request failed')
         return jsonify({'message': str(e)}), 500
 
 @admin_bp.route('/admin/registration/<int:reg_id>', methods=['GET'])
 def get_registration_detail(reg_id):
     try:
-        data = AdminService.get_registration_detail(reg_id)
+        data = AdminService.get_registration_detail(reg_id, request.args.get('term'))
         if data:
             return jsonify(data)
         return jsonify({'message': 'Registration not found'}), 404
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
+        logger.exception('Request failed')
+        return jsonify({'message': str(e)}), 500
+
+@admin_bp.route('/admin/registrations/details', methods=['POST'])
+def get_registration_details():
+    data = request.get_json() or {}
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+        return jsonify({'message': 'ids must be a list of registration IDs'}), 400
+    if len(ids) > 500:
+        return jsonify({'message': 'At most 500 IDs per request'}), 400
+
+    try:
+        details = AdminService.get_registration_details(ids, data.get('term'))
+        found = {d['id'] for d in details}
+        return jsonify({
+            'registrations': details,
+            'missing': [i for i in ids if i not in found]
+        })
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        logger.exception('Request failed')
         return jsonify({'message': str(e)}), 500
 
 @admin_bp.route('/admin/registration/<int:reg_id>', methods=['DELETE'])
@@ -100,6 +210,7 @@ def delete_registration(reg_id):
         AdminService.delete_registration(reg_id)
         return jsonify({'message': 'Deleted successfully'})
     except Exception as e:
+        logger.exception('Request failed')
         return jsonify({'message': str(e)}), 500
 
 @admin_bp.route('/admin/course', methods=['POST'])
@@ -111,6 +222,7 @@ def create_course():
     except ValueError as e:
         return jsonify({'message': str(e)}), 400
     except Exception as e:
+        logger.exception('Request failed')
         return jsonify({'message': str(e)}), 500
 
 @admin_bp.route('/admin/course/<int:course_id>', methods=['PUT'])
@@ -122,6 +234,7 @@ def update_course(course_id):
     except ValueError as e:
         return jsonify({'message': str(e)}), 400
     except Exception as e:
+        logger.exception('Request failed')
         return jsonify({'message': str(e)}), 500
 
 @admin_bp.route('/admin/course/<int:course_id>', methods=['DELETE'])
@@ -132,6 +245,27 @@ def delete_course(course_id):
     except ValueError as e:
         return jsonify({'message': str(e)}), 400
     except Exception as e:
+        logger.exception('Request failed')
+        return jsonify({'message': str(e)}), 500
+
+@admin_bp.route('/admin/courses/batch', methods=['POST'])
+def apply_course_batch():
+    data = request.get_json() or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'message': 'operations must be a non-empty list'}), 400
+    if len(operations) > 200:
+        return jsonify({'message': 'At most 200 operations per request'}), 400
+
+    try:
+        results = AdminService.apply_course_batch(operations, data.get('term'))
+        return jsonify({'message': f'已套用 {len(results)} 項課程變更', 'results': results})
+    except CourseBatchError as e:
+        return jsonify({'message': str(e), 'errors': e.errors}), 400
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        logger.exception('Request failed')
         return jsonify({'message': str(e)}), 500
 
 @admin_bp.route('/admin/settings/registration-time', methods=['POST'])
@@ -146,6 +280,7 @@ def update_settings():
         AdminService.update_settings(start, end)
         return jsonify({'message': 'Registration time updated successfully'})
     except Exception as e:
+        logger.exception('Request failed')
         return jsonify({'message': str(e)}), 500
 
 @admin_bp.route('/admin/registration/<int:reg_id>/payment', methods=['PUT'])
@@ -157,4 +292,104 @@ def toggle_payment(reg_id):
         status = '已繳費' if paid else '未繳費'
         return jsonify({'message': f'更新成功，狀態為：{status}'})
     except Exception as e:
+        logger.exception('Request failed')
+        return jsonify({'message': str(e)}), 500
+
+def _bulk_selection(data):
+    """IDs and/or filter from a bulk request body; raises ValueError when malformed"""
+    ids = data.get('ids')
+    filters = data.get('filter')
+    if ids is not None and (not isinstance(ids, list) or not all(isinstance(i, int) for i in ids)):
+        raise ValueError('ids must be a list of registration IDs')
+    if filters is not None and not isinstance(filters, dict):
+        raise ValueError('filter must be an object')
+    return ids, filters
+
+@admin_bp.route('/admin/registrations/payment', methods=['POST'])
+def bulk_set_payment():
+    try:
+        data = request.get_json() or {}
+        ids, filters = _bulk_selection(data)
+        paid = data.get('paid', False)
+        if not isinstance(paid, bool):
+            raise ValueError('paid must be true or false')
+        updated = AdminService.bulk_set_payment(paid, ids=ids, filters=filters)
+        status = '已繳費' if paid else '未繳費'
+        return jsonify({
+            'message': f'已更新 {len(updated)} 筆，狀態為：{status}',
+            'updated': updated
+        })
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        logger.exception('Request failed')
+        return jsonify({'message': str(e)}), 500
+
+@admin_bp.route('/admin/registrations/delete', methods=['POST'])
+def bulk_delete_registrations():
+    try:
+        data = request.get_json() or {}
+        ids, filters = _bulk_selection(data)
+        deleted = AdminService.bulk_delete_registrations(ids=ids, filters=filters)
+        return jsonify({
+            'message': f'已刪除 {len(deleted)} 筆報名資料',
+            'deleted': deleted
+        })
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        logger.exception('Request failed')
+        return jsonify({'message': str(e)}), 500
+
+@admin_bp.route('/admin/terms', methods=['GET'])
+def list_terms():
+    try:
+        return jsonify({'terms': TermService.list_terms(), 'active': TermService.active_term()})
+    except Exception as e:
+        logger.exception('Request failed')
+        return jsonify({'message': str(e)}), 500
+
+@admin_bp.route('/admin/terms', methods=['POST'])
+def create_term():
+    try:
+        data = request.get_json() or {}
+        code = data.get('code')
+        if not code:
+            raise ValueError('學期代碼為必填')
+        # Copy the catalog of the active term unless told otherwise
+        source = data.get('copy_courses_from', TermService.active_term())
+        term = TermService.create_term(code, data.get('name'), copy_courses_from=source)
+        if data.get('activate'):
+            TermService.set_active_term(code)
+        return jsonify({'message': '學期新增成功', 'term': term}), 201
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        logger.exception('Request failed')
+        return jsonify({'message': str(e)}), 500
+
+@admin_bp.route('/admin/terms/active', methods=['PUT'])
+def set_active_term():
+    try:
+        data = request.get_json() or {}
+        code = data.get('code')
+        if not code:
+            raise ValueError('學期代碼為必填')
+        TermService.set_active_term(code)
+        return jsonify({'message': f'目前學期已切換為 {code}', 'active': code})
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        logger.exception('Request failed')
+        return jsonify({'message': str(e)}), 500
+
+@admin_bp.route('/admin/terms/<code>/archive', methods=['POST'])
+def archive_term(code):
+    try:
+        result = TermService.archive_term(code)
+        return jsonify({'message': f'學期 {code} 已封存', **result})
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        logger.exception('Request failed')
         return jsonify({'message': str(e)}), 500
@@ -0,0 +1,23 @@
+from flask import Blueprint, jsonify
+from services.health_service import HealthService
+import logging
+
+health_bp = Blueprint('health', __name__)
+logger = logging.getLogger(__name__)
+
+@health_bp.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness only: the process answers. Dependencies are /readyz's job, so a
+    # database outage never gets every worker restarted at once.
+    return jsonify({'status': 'ok'})
+
+@health_bp.route('/readyz', methods=['GET'])
+def readyz():
+    try:
+        ready, report = HealthService.readiness()
+    except Exception as e:
+        logger.exception('Request failed')
+        return jsonify({'status': 'not ready', 'problems': [str(e)]}), 503
+    response = jsonify({'status': 'ready' if ready else 'not ready', **report})
+    response.headers['Cache-Control'] = 'no-store'
+    return response, 200 if ready else 503
@@ -1,8 +1,12 @@
 
-from flask import Blueprint, request, jsonify, render_template, send_from_directory
-from services.registration_service import RegistrationService
+from flask import Blueprint, request, jsonify, render_template, send_from_directory, url_for
+from services.registration_service import RegistrationService, AmbiguousNameError
+from services.intake import validate_submission, should_journal, get_journal, new_receipt, receipt_status
+from config import Config
+import logging
 
 main_bp = Blueprint('main', __name__)
+logger = logging.getLogger(__name__)
 
 @main_bp.route('/')
 def index():
@@ -23,7 +27,10 @@ def query_registration():
         if result:
             return jsonify(result)
         return jsonify({'message': 'Registration not found'}), 404
+    except AmbiguousNameError as e:
+        return jsonify({'message': str(e)}), 409
     except Exception as e:
+        logger.exception('Request failed')
         return jsonify({'message': str(e)}), 500
 
 @main_bp.route('/api/courses/availability', methods=['GET'])
@@ -32,6 +39,7 @@ def get_availability():
         availability = RegistrationService.get_course_availability()
         return jsonify(availability)
     except Exception as e:
+        logger.exception('Request failed')
         return jsonify({'message': str(e)}), 500
 
 @main_bp.route('/api/settings/registration-time', methods=['GET'])
@@ -40,6 +48,7 @@ def get_registration_time():
         settings = RegistrationService.get_registration_settings()
         return jsonify(settings)
     except Exception as e:
+        logger.exception('Request failed')
         return jsonify({'message': str(e)}), 500
 
 @main_bp.route('/api/course-videos', methods=['GET'])
@@ -48,26 +57,78 @@ def get_course_videos():
         videos = RegistrationService.get_course_videos()
         return jsonify(videos)
     except Exception as e:
+        logger.exception('Request failed')
         return jsonify({'message': str(e)}), 500
 
+@main_bp.route('/api/bootstrap', methods=['GET'])
+def get_bootstrap():
+    try:
+        data = RegistrationService.get_bootstrap()
+        response = jsonify(data)
+        response.set_etag(data['version'])
+        response.cache_control.public = True
+        response.cache_control.max_age = Config.BOOTSTRAP_MAX_AGE
+        return response.make_conditional(request)
+    except Exception as e:
+        logger.exception('Request failed')
+        return jsonify({'message': str(e)}), 500
+
+def _register(update):
+    data = request.get_json()
+    if Config.INTAKE_MODE == 'off':
+        return jsonify(RegistrationService.handle_registration(data, update=update)), 200
+
+    validate_submission(data, update=update)
+    receipt = None
+    if not should_journal():
+        # The receipt is recorded in the registration's own transaction, so if
+        # the commit went through but its acknowledgement was lost, the
+        # journaled copy is recognized instead of applied a second time
+        receipt = new_receipt()
+        try:
+            return jsonify(RegistrationService.handle_registration(data, update=update, receipt=receipt)), 200
+        except ValueError:
+            raise
+        except Exception as e:
+            logger.warning('Registration failed, journaling it instead: %s', e)
+    return _receipt_response(get_journal().submit(data, update=update, receipt=receipt))
+
+def _receipt_response(receipt):
+    return jsonify({
+        'message': '已收到報名，系統將依送出順序處理，請稍後查詢結果',
+        **receipt,
+        'statusUrl': url_for('main.get_intake_receipt', receipt=receipt['receipt'])
+    }), 202
+
 @main_bp.route('/submit-registration', methods=['POST'])
 def submit_registration():
     try:
-        data = request.get_json()
-        result = RegistrationService.handle_registration(data, update=False)
-        return jsonify(result), 200
+        return _register(update=False)
     except ValueError as e:
         return jsonify({'message': str(e)}), 400
     except Exception as e:
+        logger.exception('Request failed')
         return jsonify({'message': str(e)}), 500
 
 @main_bp.route('/update-registration', methods=['POST'])
 def update_registration():
     try:
-        data = request.get_json()
-        result = RegistrationService.handle_registration(data, update=True)
-        return jsonify(result), 200
+        return _register(update=True)
     except ValueError as e:
         return jsonify({'message': str(e)}), 400
     except Exception as e:
+        logger.exception('Request failed')
+        return jsonify({'message': str(e)}), 500
+
+@main_bp.route('/api/intake/<receipt>', methods=['GET'])
+def get_intake_receipt(receipt):
+    if Config.INTAKE_MODE == 'off':
+        return jsonify({'message': 'Receipt not found'}), 404
+    try:
+        status = receipt_status(receipt)
+        if status:
+            return jsonify(status)
+        return jsonify({'message': 'Receipt not found'}), 404
+    except Exception as e:
+        logger.exception('Request failed')
         return jsonify({'message': str(e)}), 500
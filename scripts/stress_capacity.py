@@ -0,0 +1,341 @@
+"""Capacity-contention stress test for RegistrationService.handle_registration.
+
+Creates a scratch database next to DATABASE_URL, adds a few small-capacity
+courses to the active term, and has several processes of several threads
+each submit and update registrations for them as fast as they can. While it
+runs, and again at the end, it checks that no course ever holds more
+registrations than its capacity and that no registration holds a course
+twice. Reports throughput, latency, time spent waiting on course row locks,
+and rejection counts. Exits 1 if the invariant was ever broken.
+
+    python3 scripts/stress_capacity.py --processes 4 --threads 16 --operations 4000
+
+The scratch database is dropped afterwards unless --keep is given. The
+test suite calls run() the same way, with a small workload
+(tests/test_stress_capacity.py, marked 'stress').
+"""
+import argparse
+import contextlib
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.parse
+
+# The app modules read their configuration at import, so nothing from the
+# repo is imported at module level: run() points DATABASE_URL at the
+# scratch database first and the spawned workers inherit it.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+COURSE_PREFIX = '壓力測試'
+
+def connect(db_url, database=None):
+    """Unpooled connection to the database in db_url, or to another one on the same server"""
+    import pg8000.native
+    url = urllib.parse.urlparse(db_url)
+    return pg8000.native.Connection(user=url.username, password=url.password, host=url.hostname,
+                                    port=url.port or 5432, database=database or url.path.lstrip('/'))
+
+def _scratch_url(db_url, name):
+    return urllib.parse.urlparse(db_url)._replace(path='/' + name).geturl()
+
+class _LockWaits:
+    """SQL recorder keeping the duration of every course row-lock statement"""
+
+    def __init__(self):
+        self.seconds = []
+
+    def record(self, sql, started, error=None):
+        if 'FOR UPDATE' in sql and 'FROM courses' in sql:
+            self.seconds.append(time.perf_counter() - started)
+
+def _basket(course_names, rng, size):
+    return [{'name': name, 'price': '1000'} for name in rng.sample(course_names, size)]
+
+def _client(worker, course_names, operations, update_ratio, seed, results):
+    from database import add_sql_recorder, sqlstate
+    from services.registration_service import RegistrationService
+
+    rng = random.Random(seed)
+    lock_waits = add_sql_recorder(_LockWaits())
+    counts = {'submitted': 0, 'updated': 0, 'full': 0, 'invalid': 0, 'errors': 0}
+    latencies = []
+    own = []  # (registration id, student name, course names)
+
+    for n in range(operations):
+        update = bool(own) and rng.random() < update_ratio
+        size = rng.randint(1, min(3, len(course_names)))
+        if update:
+            index = rng.randrange(len(own))
+            reg_id, name, _ = own[index]
+            data = {'id': reg_id, 'name': name, 'class': '大班', 'courses': _basket(course_names, rng, size)}
+        else:
+            name = f'stress-{worker}-{n}'
+            data = {'name': name, 'birthday': '2019-09-01', 'class': '大班',
+                    'courses': _basket(course_names, rng, size), 'supplies': []}
+
+        started = time.perf_counter()
+        try:
+            result = RegistrationService.handle_registration(data, update=update)
+        except ValueError as e:
+            counts['full' if '額滿' in str(e) else 'invalid'] += 1
+        except Exception as e:
+            counts['errors'] += 1
+            results.setdefault('error_samples', []).append(sqlstate(e) or f'{type(e).__name__}: {e}')
+        else:
+            names = [course['name'] for course in data['courses']]
+            if update:
+                counts['updated'] += 1
+                own[index] = (reg_id, name, names)
+            else:
+                counts['submitted'] += 1
+                own.append((result['id'], name, names))
+        latencies.append(time.perf_counter() - started)
+
+    with results['lock']:
+        for key, value in counts.items():
+            results['counts'][key] += value
+        results['latencies'].extend(latencies)
+        results['lock_waits'].extend(lock_waits.seconds)
+
+def _worker_process(index, threads, course_names, operations, update_ratio, seed, barrier, out):
+    from database import retry_stats
+    from services.structured_log import setup_logging
+
+    setup_logging()
+    results = {'lock': threading.Lock(), 'latencies': [], 'lock_waits': [],
+               'counts': {'submitted': 0, 'updated': 0, 'full': 0, 'invalid': 0, 'errors': 0}}
+    per_thread = [operations // threads + (1 if t < operations % threads else 0) for t in range(threads)]
+    clients = [
+        threading.Thread(target=_client, args=(f'{index}-{t}', course_names, per_thread[t], update_ratio,
+                                                seed * 1000 + index * 100 + t, results))
+        for t in range(threads)
+    ]
+    barrier.wait()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+
+    del results['lock']
+    results['retries'] = retry_stats()
+    out.put(results)
+
+def _violations(conn, term):
+    """Courses holding more registrations than their capacity, and duplicate enrolments"""
+    over = conn.run("""
+        SELECT c.name, c.capacity, COUNT(rc.id)
+        FROM courses c
+        JOIN registration_courses rc ON rc.course_id = c.id AND rc.term = c.term
+        WHERE c.term = :term AND c.name LIKE :prefix
+        GROUP BY c.id, c.name, c.capacity
+        HAVING COUNT(rc.id) > c.capacity
+    """, term=term, prefix=COURSE_PREFIX + '%')
+    duplicates = conn.run("""
+        SELECT registration_id, course_id, COUNT(*)
+        FROM registration_courses
+        WHERE term = :term
+        GROUP BY registration_id, course_id
+        HAVING COUNT(*) > 1
+    """, term=term)
+    return [f'{name}: {used} enrolled, capacity {capacity}' for name, capacity, used in over] + \
+           [f'registration {reg} holds course {course} {n} times' for reg, course, n in duplicates]
+
+def _monitor(term, interval, stop, seen):
+    from database import get_db_connection
+    while not stop.wait(interval):
+        conn = get_db_connection()
+        try:
+            for problem in _violations(conn, term):
+                if problem not in seen:
+                    seen.append(problem)
+        finally:
+            conn.close()
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def _ms(seconds):
+    return f'{seconds * 1000:.1f} ms'
+
+@contextlib.contextmanager
+def scratch_database(db_url, keep=False):
+    """URL of a new, empty database on the server behind db_url; dropped afterwards unless keep"""
+    name = f"{urllib.parse.urlparse(db_url).path.lstrip('/') or 'afterschool'}_stress_{os.getpid()}"
+    admin = connect(db_url, database='postgres')
+    admin.run(f'CREATE DATABASE "{name}"')
+    url = _scratch_url(db_url, name)
+    try:
+        yield url
+    finally:
+        if keep:
+            print(f'scratch database kept: {url}')
+        else:
+            admin.run(f'DROP DATABASE "{name}" WITH (FORCE)')
+        admin.close()
+
+@contextlib.contextmanager
+def _environment(db_url, threads):
+    """Point this process, and the workers it spawns, at the scratch database"""
+    from config import Config
+
+    overrides = {
+        'DATABASE_URL': db_url,
+        'DATABASE_REPLICA_URL': None,
+        'STORAGE_BACKEND': 'postgres',
+        'INTAKE_MODE': 'off',
+        'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'WARNING'),
+        'DB_POOL_SIZE': str(max(threads, 1))
+    }
+    saved_env = {key: os.environ.get(key) for key in overrides}
+    saved_config = (Config.DATABASE_URL, Config.DATABASE_REPLICA_URL)
+    for key, value in overrides.items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+    # Config has already read the environment when run from the test suite
+    Config.DATABASE_URL, Config.DATABASE_REPLICA_URL = db_url, None
+    try:
+        yield
+    finally:
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        Config.DATABASE_URL, Config.DATABASE_REPLICA_URL = saved_config
+
+def run(args, db_url):
+    """Run the workload against db_url, a scratch database, and return its report"""
+    with _environment(db_url, args.threads):
+        return _run(args)
+
+def _run(args):
+    from database import init_db, get_db_connection
+
+    init_db()
+    course_names = [f'{COURSE_PREFIX} {i + 1}' for i in range(args.courses)]
+    conn = get_db_connection()
+    try:
+        term = conn.run("SELECT value FROM settings WHERE key = 'active_term'")[0][0]
+        for name in course_names:
+            conn.run("INSERT INTO courses (term, name, price, capacity) VALUES (:term, :name, 1000, :capacity)",
+                     term=term, name=name, capacity=args.capacity)
+    finally:
+        conn.close()
+
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(args.processes + 1)
+    out = context.Queue()
+    per_process = [args.operations // args.processes + (1 if p < args.operations % args.processes else 0)
+                   for p in range(args.processes)]
+    workers = [
+        context.Process(target=_worker_process, args=(p, args.threads, course_names, per_process[p],
+                                                      args.update_ratio, args.seed, barrier, out))
+        for p in range(args.processes)
+    ]
+    for worker in workers:
+        worker.start()
+
+    seen = []
+    stop = threading.Event()
+    monitor = threading.Thread(target=_monitor, args=(term, args.check_interval, stop, seen), daemon=True)
+    barrier.wait()
+    started = time.perf_counter()
+    monitor.start()
+    reports = [out.get() for _ in workers]
+    elapsed = time.perf_counter() - started
+    for worker in workers:
+        worker.join()
+    stop.set()
+    monitor.join()
+
+    conn = get_db_connection()
+    try:
+        final = _violations(conn, term)
+        enrolled = dict(conn.run("""
+            SELECT c.name, COUNT(rc.id)
+            FROM courses c
+            LEFT JOIN registration_courses rc ON rc.course_id = c.id AND rc.term = c.term
+            WHERE c.term = :term AND c.name LIKE :prefix
+            GROUP BY c.name
+        """, term=term, prefix=COURSE_PREFIX + '%'))
+        deadlocks = conn.run("SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()")[0][0]
+    finally:
+        conn.close()
+
+    return {
+        'term': term,
+        'elapsed': elapsed,
+        'course_names': course_names,
+        'counts': {key: sum(r['counts'][key] for r in reports) for key in reports[0]['counts']},
+        'latencies': [s for r in reports for s in r['latencies']],
+        'lock_waits': [s for r in reports for s in r['lock_waits']],
+        'retries': {key: sum(r['retries'][key] for r in reports) for key in ('retries', 'recovered', 'exhausted')},
+        'enrolled': {name: enrolled.get(name, 0) for name in course_names},
+        'deadlocks': deadlocks,
+        'error_samples': sorted({s for r in reports for s in r.get('error_samples', [])}),
+        'violations': seen + [p for p in final if p not in seen]
+    }
+
+def print_report(args, report):
+    counts, latencies, lock_waits, retries = (report['counts'], report['latencies'],
+                                              report['lock_waits'], report['retries'])
+    total = sum(counts.values())
+    elapsed = report['elapsed']
+
+    print(f'{args.processes} processes x {args.threads} threads, {total} operations on '
+          f'{args.courses} courses of capacity {args.capacity} in {elapsed:.2f} s')
+    print(f'  throughput     {total / elapsed:.1f} ops/s')
+    print(f'  latency        p50 {_ms(_percentile(latencies, 0.5))}, p95 {_ms(_percentile(latencies, 0.95))}, '
+          f'p99 {_ms(_percentile(latencies, 0.99))}, max {_ms(max(latencies, default=0))}')
+    print(f'  lock wait      {len(lock_waits)} locks, total {lock_waits and sum(lock_waits) or 0:.2f} s, '
+          f'mean {_ms(statistics.fmean(lock_waits) if lock_waits else 0)}, '
+          f'p95 {_ms(_percentile(lock_waits, 0.95))}, max {_ms(max(lock_waits, default=0))}')
+    print(f"  accepted       {counts['submitted']} submissions, {counts['updated']} updates")
+    print(f"  rejected       {counts['full']} full, {counts['invalid']} invalid, {counts['errors']} errors")
+    print(f"  retries        {retries['retries']} ({retries['recovered']} recovered, {retries['exhausted']} exhausted)")
+    print('  enrolment      ' + ', '.join(f'{name.removeprefix(COURSE_PREFIX).strip()}: {used}/{args.capacity}'
+                                        for name, used in report['enrolled'].items()))
+    for sample in report['error_samples'][:5]:
+        print(f'  error          {sample}')
+
+    if report['violations']:
+        print('FAIL: capacity invariant broken')
+        for problem in report['violations']:
+            print(f'  {problem}')
+    else:
+        print('OK: no course ever exceeded its capacity')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', 'postgresql://postgres@127.0.0.1:5432/afterschool'),
+                        help='server to run on; a scratch database is created next to this one')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=16, help='client threads per process')
+    parser.add_argument('--operations', type=int, default=4000, help='submissions and updates in total')
+    parser.add_argument('--update-ratio', type=float, default=0.3,
+                        help='share of operations that change an earlier registration of the same client')
+    parser.add_argument('--courses', type=int, default=6)
+    parser.add_argument('--capacity', type=int, default=20)
+    parser.add_argument('--check-interval', type=float, default=0.2, help='seconds between invariant checks')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep', action='store_true', help='keep the scratch database afterwards')
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args()
+    with scratch_database(args.database_url, keep=args.keep) as url:
+        report = run(args, url)
+    print_report(args, report)
+    sys.exit(1 if report['violations'] else 0)
+
+if __name__ == '__main__':
+    main()
@@ -1,176 +1,255 @@
 
-from database import get_db_connection
+from database import retry_transaction, sqlstate
+from services.name_index import normalize_name, name_trigrams
+from services.term_service import TermService
+from storage.store import get_store
+from config import Config
 from datetime import datetime
+from werkzeug.wsgi import ClosingIterator
+import csv
+import io
+import itertools
+import json
+import re
+import time
+import zipfile
+
+# Operations accepted by AdminService.apply_course_batch
+COURSE_BATCH_OPERATIONS = ('create', 'update', 'capacity', 'delete')
+
+class CourseBatchError(ValueError):
+    """A course batch failed validation; errors lists {'index', 'error'} per bad operation"""
+
+    def __init__(self, errors):
+        super().__init__('批次驗證失敗，未套用任何變更')
+        self.errors = errors
+
+class _Spool:
+    """Write-only file that hands back whatever was written since the last drain"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def _roster_filename(course_name, taken):
+    # Course names may contain characters that are not allowed in file names
+    base = re.sub(r'[\\/:*?"<>|]', '_', course_name).strip() or 'course'
+    filename = f'{base}.csv'
+    n = 2
+    while filename in taken:
+        filename = f'{base} ({n}).csv'
+        n += 1
+    taken.add(filename)
+    return filename
 
 class AdminService:
     @staticmethod
-    def get_dashboard_stats():
-        conn = get_db_connection()
+    def _parse_sync_cursor(cursor):
         try:
-            # Get all registrations with counts
-            results = conn.run("""
-                SELECT 
-                    r.id,
-                    s.name as student_name,
-                    r.class_name,
-                    r.created_at,
-                    r.updated_at,
-                    COUNT(DISTINCT rc.course_id) as course_count,
-                    COUNT(DISTINCT rs.supply_id) as supply_count,
-                    r.is_paid,
-                    s.birthday
-                FROM registrations r
-                JOIN students s ON r.student_id = s.id
-                LEFT JOIN registration_courses rc ON r.id = rc.registration_id
-                LEFT JOIN registration_supplies rs ON r.id = rs.registration_id
-                GROUP BY r.id, s.name, s.birthday, r.class_name, r.created_at, r.updated_at, r.is_paid
-                ORDER BY r.created_at DESC
-            """)
-            
-            registrations = []
-            for row in results:
-                registrations.append({
-                    'id': row[0],
-                    'student_name': row[1],
-                    'class_name': row[2],
-                    'created_at': row[3].isoformat() if row[3] else None,
-                    'updated_at': row[4].isoformat() if row[4] else None,
-                    'course_count': row[5],
-                    'supply_count': row[6],
-                    'is_paid': row[7],
-                    'birthday': row[8].strftime('%Y-%m-%d') if row[8] else None
-                })
-            
-            # Get statistics
-            stats_result = conn.run("""
-                SELECT 
-                    COUNT(DISTINCT r.id) as total_registrations,
-                    COUNT(DISTINCT s.id) as total_students,
-                    COUNT(DISTINCT rc.id) as total_course_enrollments,
-                    COUNT(DISTINCT rs.id) as total_supply_orders
-                FROM registrations r
-                JOIN students s ON r.student_id = s.id
-                LEFT JOIN registration_courses rc ON r.id = rc.registration_id
-                LEFT JOIN registration_supplies rs ON r.id = rs.registration_id
-            """)
-            
-            stats = stats_result[0]
-            statistics = {
+            xmin, issued = cursor.split(':')
+            return int(xmin), int(issued)
+        except (AttributeError, ValueError):
+            raise ValueError('Invalid since cursor')
+
+    @staticmethod
+    def _registration_row(row):
+        return {
+            **row,
+            'created_at': row['created_at'].isoformat() if row['created_at'] else None,
+            'updated_at': row['updated_at'].isoformat() if row['updated_at'] else None,
+            'birthday': row['birthday'].strftime('%Y-%m-%d') if row['birthday'] else None
+        }
+
+    @staticmethod
+    def get_dashboard_stats(term=None):
+        term = TermService.resolve(term)
+        cursor, rows, stats = get_store().dashboard(term)
+        statistics = {
+            'totalRegistrations': stats[0],
+            'totalStudents': stats[1],
+            'totalCourseEnrollments': stats[2],
+            'totalSupplyOrders': stats[3]
+        }
+        return {
+            'term': term,
+            'registrations': [AdminService._registration_row(row) for row in rows],
+            'statistics': statistics,
+            'cursor': cursor
+        }
+
+    @staticmethod
+    def stream_dashboard(term=None):
+        """get_dashboard_stats as JSON chunks, encoding rows as they are fetched.
+
+        Term and database errors are raised here, before the first byte; the
+        returned iterator releases its connection when the response closes.
+        """
+        term = TermService.resolve(term)
+        cursor, stats, rows, release = get_store().dashboard_stream(term)
+        head = json.dumps({
+            'term': term,
+            'statistics': {
                 'totalRegistrations': stats[0],
                 'totalStudents': stats[1],
                 'totalCourseEnrollments': stats[2],
                 'totalSupplyOrders': stats[3]
-            }
-            
-            return {
-                'registrations': registrations,
-                'statistics': statistics
-            }
-        finally:
-            conn.close()
+            },
+            'cursor': cursor
+        }, ensure_ascii=False)
+
+        def chunks():
+            # The registrations array goes last so the small fields arrive first
+            yield (head[:-1] + ', "registrations": [').encode('utf-8')
+            batch = []
+            separator = ''
+            for row in rows:
+                batch.append(separator + json.dumps(AdminService._registration_row(row), ensure_ascii=False))
+                separator = ','
+                if len(batch) >= Config.STREAM_FETCH_SIZE:
+                    yield ''.join(batch).encode('utf-8')
+                    batch = []
+            batch.append(']}')
+            yield ''.join(batch).encode('utf-8')
+
+        return ClosingIterator(chunks(), release)
 
     @staticmethod
-    def get_courses_stats():
-        conn = get_db_connection()
-        try:
-            results = conn.run("""
-                SELECT c.id, c.name, c.price, c.sessions, c.frequency, c.capacity, c.description, c.video_url,
-                       COUNT(rc.registration_id) as used
-                FROM courses c
-                LEFT JOIN registration_courses rc ON c.id = rc.course_id
-                GROUP BY c.id, c.name, c.price, c.sessions, c.frequency, c.capacity, c.description, c.video_url
-                ORDER BY c.id
-            """)
-            
-            courses = []
-            for row in results:
-                capacity = row[5] if row[5] is not None else 30
-                used = row[8]
-                courses.append({
-                    'id': row[0],
-                    'name': row[1],
-                    'price': row[2],
-                    'sessions': row[3],
-                    'frequency': row[4],
-                    'capacity': capacity,
-                    'description': row[6] or '',
-                    'video_url': row[7] or '',
-                    'used': used,
-                    'remaining': max(0, capacity - used)
-                })
-            return courses
-        finally:
-            conn.close()
+    def export_rosters(term=None):
+        """(filename, ZIP chunks) with one roster CSV per course of the term.
+
+        Built in one pass over the course/registration join: each course's CSV
+        is compressed into the archive as its rows arrive and flushed to the
+        client before the next course starts.
+        """
+        term = TermService.resolve(term)
+        rows, release = get_store().roster_stream(term)
+
+        def chunks():
+            spool = _Spool()
+            with zipfile.ZipFile(spool, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                names = set()
+                for (_, course_name), students in itertools.groupby(rows, key=lambda r: (r['course_id'], r['course_name'])):
+                    filename = _roster_filename(course_name, names)
+                    with archive.open(filename, 'w') as entry, \
+                            io.TextIOWrapper(entry, encoding='utf-8-sig', newline='') as text:
+                        writer = csv.writer(text)
+                        writer.writerow(['學生姓名', '生日', '班級', '繳費狀態'])
+                        for row in students:
+                            if row['student_name'] is None:
+                                continue  # course with no registrations: header only
+                            writer.writerow([
+                                row['student_name'],
+                                row['birthday'].strftime('%Y-%m-%d') if row['birthday'] else '',
+                                row['class_name'] or '未指定',
+                                '已繳費' if row['is_paid'] else '未繳費'
+                            ])
+                    yield spool.drain()
+            yield spool.drain()
+
+        return f'rosters-{term}.zip', ClosingIterator(chunks(), release)
 
     @staticmethod
-    def get_registration_detail(reg_id):
-        conn = get_db_connection()
-        try:
-            reg_results = conn.run("""
-                SELECT r.id, s.name, r.class_name, r.created_at, r.updated_at, s.birthday
-                FROM registrations r
-                JOIN students s ON r.student_id = s.id
-                WHERE r.id = :id
-            """, id=reg_id)
-            
-            if not reg_results:
-                return None
-            
-            reg = reg_results[0]
-            
-            course_results = conn.run("""
-                SELECT c.name, c.price
-                FROM registration_courses rc
-                JOIN courses c ON rc.course_id = c.id
-                WHERE rc.registration_id = :reg_id
-            """, reg_id=reg_id)
-            
-            courses = [{'name': row[0], 'price': str(row[1])} for row in course_results]
-            
-            supply_results = conn.run("""
-                SELECT s.name, s.price
-                FROM registration_supplies rs
-                JOIN supplies s ON rs.supply_id = s.id
-                WHERE rs.registration_id = :reg_id
-            """, reg_id=reg_id)
-            
-            supplies = [{'name': row[0], 'price': str(row[1])} for row in supply_results]
-            
-            return {
-                'id': reg[0],
-                'student_name': reg[1],
-                'class_name': reg[2],
-                'created_at': reg[3].isoformat() if reg[3] else None,
-                'updated_at': reg[4].isoformat() if reg[4] else None,
-                'birthday': reg[5].strftime('%Y-%m-%d') if reg[5] else None,
-                'courses': courses,
-                'supplies': supplies
+    def get_dashboard_changes(since, term=None):
+        """Registrations created, updated or deleted since a cursor from a previous sync"""
+        since_xid, issued = AdminService._parse_sync_cursor(since)
+        term = TermService.resolve(term)
+        if time.time() - issued > Config.TOMBSTONE_RETENTION_DAYS * 86400:
+            # Tombstones this old may have been pruned, so start over
+            data = AdminService.get_dashboard_stats(term)
+            data['full'] = True
+            return data
+
+        cursor, rows, deleted = get_store().registration_changes(term, since_xid)
+        return {
+            'term': term,
+            'registrations': [AdminService._registration_row(row) for row in rows],
+            'deleted': deleted,
+            'cursor': cursor,
+            'full': False
+        }
+
+    @staticmethod
+    def get_courses_stats(term=None):
+        courses = []
+        for row in get_store().courses_stats(TermService.resolve(term)):
+            capacity = row['capacity'] if row['capacity'] is not None else 30
+            used = row['used']
+            courses.append({
+                'id': row['id'],
+                'name': row['name'],
+                'price': row['price'],
+                'sessions': row['sessions'],
+                'frequency': row['frequency'],
+                'capacity': capacity,
+                'description': row['description'] or '',
+                'video_url': row['video_url'] or '',
+                'used': used,
+                'remaining': max(0, capacity - used)
+            })
+        return courses
+
+    @staticmethod
+    def get_registration_detail(reg_id, term=None):
+        details = AdminService.get_registration_details([reg_id], term)
+        return details[0] if details else None
+
+    @staticmethod
+    def get_registration_details(reg_ids, term=None):
+        """Details for many registrations, with courses and supplies aggregated in the same query"""
+        if not reg_ids:
+            return []
+        term = TermService.resolve(term)
+
+        by_id = {}
+        for row in get_store().registration_details(reg_ids, term):
+            by_id[row['id']] = {
+                'id': row['id'],
+                'student_name': row['student_name'],
+                'class_name': row['class_name'],
+                'created_at': row['created_at'].isoformat() if row['created_at'] else None,
+                'updated_at': row['updated_at'].isoformat() if row['updated_at'] else None,
+                'birthday': row['birthday'].strftime('%Y-%m-%d') if row['birthday'] else None,
+                'is_paid': row['is_paid'],
+                'courses': [{'name': c['name'], 'price': str(c['price'])} for c in row['courses']],
+                'supplies': [{'name': sp['name'], 'price': str(sp['price'])} for sp in row['supplies']]
             }
-        finally:
-            conn.close()
+        # Keep the caller's order; unknown IDs are simply left out
+        return [by_id[reg_id] for reg_id in reg_ids if reg_id in by_id]
 
     @staticmethod
     def delete_registration(reg_id):
-        conn = get_db_connection()
-        try:
-            conn.run("DELETE FROM registrations WHERE id = :id", id=reg_id)
-        finally:
-            conn.close()
+        get_store().delete_registration(reg_id)
 
     @staticmethod
     def delete_course(course_id):
-        conn = get_db_connection()
-        try:
-            check_result = conn.run(
-                "SELECT COUNT(*) FROM registration_courses WHERE course_id = :id",
-                id=course_id
-            )
-            if check_result and check_result[0][0] > 0:
-                raise ValueError(f'無法刪除：此課程有 {check_result[0][0]} 筆報名記錄，請先刪除相關報名後再試。')
-            
-            conn.run("DELETE FROM courses WHERE id = :id", id=course_id)
-        finally:
-            conn.close()
+        store = get_store()
+        enrolled = store.course_enrolment(course_id)
+        if enrolled > 0:
+            raise ValueError(f'無法刪除：此課程有 {enrolled} 筆報名記錄，請先刪除相關報名後再試。')
+        store.delete_course(course_id)
+
+    @staticmethod
+    def _course_fields(data):
+        return {
+            'name': data.get('name'),
+            'price': int(data.get('price')),
+            'sessions': int(data.get('sessions')) if data.get('sessions') else None,
+            'frequency': data.get('frequency', ''),
+            'description': data.get('description', ''),
+            'capacity': int(data.get('capacity', 30)),
+            'video_url': data.get('video_url', '')
+        }
 
     @staticmethod
     def create_course(data):
@@ -178,95 +257,244 @@ class AdminService:
         price = data.get('price')
         if not name or price is None:
             raise ValueError('課程名稱和價格為必填')
+        term = TermService.resolve(data.get('term'))
 
-        conn = get_db_connection()
-        try:
-            existing = conn.run("SELECT id FROM courses WHERE name = :name", name=name)
-            if existing:
-                raise ValueError('課程名稱已存在')
-
-            result = conn.run(
-                """INSERT INTO courses (name, price, sessions, frequency, description, capacity, video_url) 
-                   VALUES (:name, :price, :sessions, :frequency, :description, :capacity, :video_url) 
-                   RETURNING id""",
-                name=name, price=int(price), 
-                sessions=int(data.get('sessions')) if data.get('sessions') else None,
-                frequency=data.get('frequency', ''), 
-                description=data.get('description', ''), 
-                capacity=int(data.get('capacity', 30)),
-                video_url=data.get('video_url', '')
-            )
-            return result[0][0]
-        finally:
-            conn.close()
+        store = get_store()
+        if store.course_name_taken(term, name):
+            raise ValueError('課程名稱已存在')
+        return store.insert_course(term, AdminService._course_fields(data))
 
     @staticmethod
     def update_course(course_id, data):
-        conn = get_db_connection()
+        store = get_store()
+        term = store.course_term(course_id)
+        if term is None:
+            raise ValueError('課程不存在')
+
+        if 'name' in data:
+            name = data.get('name')
+            price = data.get('price')
+            if not name or price is None:
+                raise ValueError('課程名稱和價格為必填')
+            if store.course_name_taken(term, name, exclude_id=course_id):
+                raise ValueError('課程名稱已被其他課程使用')
+            store.update_course(course_id, AdminService._course_fields(data))
+        else:
+            # Capacity only update
+            new_capacity = data.get('capacity')
+            if new_capacity is None:
+                raise ValueError('Missing capacity parameter')
+            store.set_course_capacity(course_id, int(new_capacity))
+
+    @staticmethod
+    def _parse_course_operation(op):
+        """Normalized operation dict; raises ValueError with the reason it is invalid"""
+        if not isinstance(op, dict):
+            raise ValueError('操作格式錯誤')
+        kind = op.get('op')
+        if kind not in COURSE_BATCH_OPERATIONS:
+            raise ValueError(f"未知的操作：{kind}")
+        parsed = {'op': kind}
+        if kind != 'create':
+            if not isinstance(op.get('id'), int):
+                raise ValueError('缺少課程 ID')
+            parsed['id'] = op['id']
+        if kind in ('create', 'update'):
+            if not op.get('name') or op.get('price') is None:
+                raise ValueError('課程名稱和價格為必填')
+            try:
+                parsed['fields'] = AdminService._course_fields(op)
+            except (TypeError, ValueError):
+                raise ValueError('價格、堂數與名額須為整數')
+        elif kind == 'capacity':
+            try:
+                parsed['capacity'] = int(op.get('capacity'))
+            except (TypeError, ValueError):
+                raise ValueError('Missing capacity parameter')
+            if parsed['capacity'] < 0:
+                raise ValueError('名額不可為負數')
+        return parsed
+
+    @staticmethod
+    @retry_transaction
+    def apply_course_batch(operations, term=None):
+        """Validate a list of catalog operations together, then apply all or none.
+
+        Deletes run first, then updates, capacity changes and creates, each
+        as one set-based statement. A name can be reused in the same batch
+        only when its course is deleted; renames never free a name, so two
+        courses cannot swap names in one batch.
+        """
+        term = TermService.resolve(term)
+        errors = []
+        parsed = []
+        for index, op in enumerate(operations):
+            try:
+                parsed.append((index, AdminService._parse_course_operation(op)))
+            except ValueError as e:
+                errors.append({'index': index, 'error': str(e)})
+
+        ids = [op['id'] for _, op in parsed if 'id' in op]
+        seen_ids = set()
+        for index, op in parsed:
+            if 'id' in op:
+                if op['id'] in seen_ids:
+                    errors.append({'index': index, 'error': '同一課程在批次中只能出現一次'})
+                seen_ids.add(op['id'])
+
         try:
-            check_result = conn.run("SELECT id FROM courses WHERE id = :id", id=course_id)
-            if not check_result:
-                raise ValueError('課程不存在')
-
-            if 'name' in data:
-                name = data.get('name')
-                price = data.get('price')
-                if not name or price is None:
-                    raise ValueError('課程名稱和價格為必填')
-                
-                existing = conn.run(
-                    "SELECT id FROM courses WHERE name = :name AND id != :id",
-                    name=name, id=course_id
-                )
-                if existing:
-                    raise ValueError('課程名稱已被其他課程使用')
-
-                conn.run(
-                    """UPDATE courses SET 
-                       name = :name, price = :price, sessions = :sessions,
-                       frequency = :frequency, description = :description, capacity = :capacity,
-                       video_url = :video_url
-                       WHERE id = :id""",
-                    name=name, price=int(price), 
-                    sessions=int(data.get('sessions')) if data.get('sessions') else None,
-                    frequency=data.get('frequency', ''), 
-                    description=data.get('description', ''), 
-                    capacity=int(data.get('capacity', 30)),
-                    video_url=data.get('video_url', ''),
-                    id=course_id
-                )
-            else:
-                # Capacity only update
-                new_capacity = data.get('capacity')
-                if new_capacity is None:
-                    raise ValueError('Missing capacity parameter')
-                conn.run(
-                    "UPDATE courses SET capacity = :capacity WHERE id = :id",
-                    capacity=int(new_capacity), id=course_id
-                )
-        finally:
-            conn.close()
+            with get_store().transaction() as tx:
+                locked, names = tx.lock_catalog(term, ids)
+                deleted = {op['id'] for _, op in parsed if op['op'] == 'delete'}
+                enrolments = tx.course_enrolments(deleted & set(locked))
+                batch_names = set()
+                for index, op in parsed:
+                    error = None
+                    if 'id' in op and op['id'] not in locked:
+                        error = '課程不存在'
+                    elif 'id' in op and locked[op['id']] != term:
+                        error = f'課程不屬於學期 {term}'
+                    elif op['op'] == 'delete' and enrolments.get(op['id']):
+                        error = f"無法刪除：此課程有 {enrolments[op['id']]} 筆報名記錄，請先刪除相關報名後再試。"
+                    elif 'fields' in op:
+                        name = op['fields']['name']
+                        holder = names.get(name)
+                        if name in batch_names:
+                            error = '批次中課程名稱重複'
+                        elif holder is not None and holder != op.get('id') and holder not in deleted:
+                            error = '課程名稱已被其他課程使用' if op['op'] == 'update' else '課程名稱已存在'
+                        batch_names.add(name)
+                    if error:
+                        errors.append({'index': index, 'error': error})
+
+                if errors:
+                    raise CourseBatchError(sorted(errors, key=lambda e: e['index']))
+
+                if deleted:
+                    tx.delete_courses(deleted)
+                updates = {op['id']: op['fields'] for _, op in parsed if op['op'] == 'update'}
+                if updates:
+                    tx.update_courses(updates)
+                capacities = {op['id']: op['capacity'] for _, op in parsed if op['op'] == 'capacity'}
+                if capacities:
+                    tx.set_capacities(capacities)
+                creates = [op['fields'] for _, op in parsed if op['op'] == 'create']
+                created = tx.insert_courses(term, creates) if creates else {}
+        except CourseBatchError:
+            raise
+        except Exception as e:
+            # A concurrent edit took one of the names after validation
+            if sqlstate(e) == '23505':
+                raise ValueError('課程名稱已存在') from e
+            raise
+
+        return [{
+            'index': index,
+            'op': op['op'],
+            'id': created[op['fields']['name']] if op['op'] == 'create' else op['id']
+        } for index, op in parsed]
 
     @staticmethod
     def update_settings(start, end):
-        conn = get_db_connection()
-        try:
-            conn.run(
-                "INSERT INTO settings (key, value) VALUES ('registration_start', :value) ON CONFLICT (key) DO UPDATE SET value = :value",
-                value=start
-            )
-            conn.run(
-                "INSERT INTO settings (key, value) VALUES ('registration_end', :value) ON CONFLICT (key) DO UPDATE SET value = :value",
-                value=end
-            )
-        finally:
-            conn.close()
+        get_store().save_settings({'registration_start': start, 'registration_end': end})
 
     @staticmethod
     def toggle_payment(reg_id, paid):
-        conn = get_db_connection()
-        try:
-            conn.run("UPDATE registrations SET is_paid = :paid, updated_at = :now WHERE id = :id",
-                     paid=paid, now=datetime.now(), id=reg_id)
-        finally:
-            conn.close()
+        get_store().set_paid(reg_id, paid, datetime.now())
+
+
+    @staticmethod
+    def search_students(query, limit=20):
+        search_name = normalize_name(query)
+        grams = name_trigrams(search_name)
+        if not grams:
+            return []
+        results = get_store().search_students(search_name, grams, TermService.active_term(),
+                                              Config.SEARCH_MIN_SIMILARITY, limit)
+        return [{
+            'student_id': row['student_id'],
+            'student_name': row['student_name'],
+            'birthday': row['birthday'].strftime('%Y-%m-%d') if row['birthday'] else None,
+            'registration_id': row['registration_id'],
+            'class_name': row['class_name'],
+            'match': ('exact', 'prefix', 'fuzzy')[row['tier']],
+            'score': round(row['similarity'], 3)
+        } for row in results]
+
+
+    @staticmethod
+    def _registration_filter(ids=None, filters=None):
+        """(term, criteria) selecting registrations by ID list and/or filter"""
+        criteria = {}
+        filters = filters or {}
+        if ids is not None:
+            criteria['ids'] = list(ids)
+        if 'class_name' in filters:
+            criteria['class_name'] = filters['class_name']
+        if 'is_paid' in filters:
+            # bool('false') is True; only a real JSON boolean is unambiguous
+            if not isinstance(filters['is_paid'], bool):
+                raise ValueError('filter.is_paid must be true or false')
+            criteria['is_paid'] = filters['is_paid']
+        if 'course_id' in filters:
+            criteria['course_id'] = int(filters['course_id'])
+        if not criteria:
+            raise ValueError('請指定報名 ID 或篩選條件')
+        return TermService.resolve(filters.get('term')), criteria
+
+    @staticmethod
+    def bulk_set_payment(paid, ids=None, filters=None):
+        term, criteria = AdminService._registration_filter(ids, filters)
+        results = get_store().bulk_set_paid(term, criteria, paid, datetime.now())
+        return [{
+            'id': row[0],
+            'is_paid': bool(row[1]),
+            'updated_at': row[2].isoformat() if row[2] else None
+        } for row in results]
+
+    @staticmethod
+    def bulk_delete_registrations(ids=None, filters=None):
+        term, criteria = AdminService._registration_filter(ids, filters)
+        return get_store().bulk_delete_registrations(term, criteria)
+
+
+    @staticmethod
+    def get_finance_summary(term=None):
+        term = TermService.resolve(term)
+        results = get_store().finance_totals(term)
+
+        summary = {
+            'term': term,
+            'registrations': 0,
+            'paidRegistrations': 0,
+            'expectedRevenue': 0,
+            'collected': 0,
+            'outstanding': 0,
+            'courses': [],
+            'supplies': []
+        }
+        for item_type, item_id, name, price, enrolled, paid in results:
+            if item_type == 'registration':
+                summary['registrations'] = enrolled
+                summary['paidRegistrations'] = paid
+                continue
+            if name is None or not enrolled:
+                # Counter left behind by a deleted course or supply, or one
+                # whose registrations have all been removed again
+                continue
+            expected = price * enrolled
+            collected = price * paid
+            summary['courses' if item_type == 'course' else 'supplies'].append({
+                'id': item_id,
+                'name': name,
+                'price': price,
+                'enrolled': enrolled,
+                'paid': paid,
+                'expected': expected,
+                'collected': collected,
+                'outstanding': expected - collected
+            })
+            summary['expectedRevenue'] += expected
+            summary['collected'] += collected
+        summary['outstanding'] = summary['expectedRevenue'] - summary['collected']
+        return summary
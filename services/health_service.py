@@ -0,0 +1,54 @@
+import time
+from config import Config
+from database import SCHEMA_VERSION, pool_stats, statement_cache_stats
+from middleware.in_flight import in_flight_stats
+from middleware.load_shed import load_shed_stats
+from services.term_service import TermService
+from storage.store import get_store
+
+class HealthService:
+    @staticmethod
+    def readiness():
+        """(ready, report): whether this worker should receive traffic, and why"""
+        store = get_store()
+        problems = []
+        report = {'storage': store.name}
+
+        started = time.perf_counter()
+        try:
+            store.ping()
+            latency_ms = round((time.perf_counter() - started) * 1000, 2)
+            report['database'] = {'reachable': True, 'latency_ms': latency_ms}
+            if latency_ms > Config.READY_MAX_DB_LATENCY_MS:
+                problems.append(f'database round trip {latency_ms} ms exceeds {Config.READY_MAX_DB_LATENCY_MS} ms')
+        except Exception as e:
+            report['database'] = {'reachable': False, 'error': str(e)}
+            problems.append('database unreachable')
+
+        if store.name == 'postgres':
+            pools = pool_stats()
+            report['pools'] = pools
+            primary = pools.get('primary')
+            if primary and Config.READY_MAX_POOL_FRACTION:
+                if primary['in_use'] >= Config.READY_MAX_POOL_FRACTION * primary['max']:
+                    problems.append(f"{primary['in_use']} of {primary['max']} primary connections in use")
+
+        if report['database']['reachable']:
+            try:
+                stored = store.settings(['schema_version']).get('schema_version')
+                report['schema'] = {'expected': SCHEMA_VERSION, 'database': int(stored) if stored else None}
+                if report['schema']['database'] != SCHEMA_VERSION:
+                    problems.append('schema version mismatch')
+            except Exception as e:
+                report['schema'] = {'expected': SCHEMA_VERSION, 'error': str(e)}
+                problems.append('schema version unreadable')
+
+        report['caches'] = {
+            'active_term': TermService.active_term_cached(),
+            'statements': statement_cache_stats()
+        }
+        report['in_flight'] = in_flight_stats()
+        report['load_shedding'] = load_shed_stats()
+
+        report['problems'] = problems
+        return not problems, report
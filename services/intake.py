@@ -0,0 +1,352 @@
+import collections
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from datetime import date, datetime
+from config import Config
+from database import sqlstate, use_primary
+from services.registration_service import RegistrationService
+from services.term_service import TermService
+from storage.store import get_store
+
+logger = logging.getLogger(__name__)
+
+# SQLSTATE classes that will fail the same way on every retry: bad data, constraints
+_PERMANENT_SQLSTATE_CLASSES = ('22', '23')
+
+# Seconds between sweeps of old intake receipts, done while the journal is idle
+_RECEIPT_PRUNE_INTERVAL = 3600
+
+def new_receipt():
+    return secrets.token_urlsafe(16)
+
+def validate_submission(data, update=False):
+    """Reject malformed bodies up front; a journaled entry must be applicable later"""
+    if not isinstance(data, dict):
+        raise ValueError('報名資料格式錯誤')
+    if update:
+        if not isinstance(data.get('id'), int):
+            raise ValueError('Missing ID for update')
+    elif not isinstance(data.get('name'), str) or not data['name'].strip():
+        raise ValueError('請填寫學生姓名')
+
+    birthday = data.get('birthday')
+    if birthday:
+        try:
+            date.fromisoformat(birthday)
+        except (TypeError, ValueError):
+            raise ValueError('生日格式錯誤，請使用 YYYY-MM-DD')
+    if data.get('email') is not None and not isinstance(data['email'], str):
+        raise ValueError('Email 格式錯誤')
+    for field in ('courses', 'supplies'):
+        items = data.get(field, [])
+        if not isinstance(items, list) or not all(isinstance(i, dict) and isinstance(i.get('name'), str) for i in items):
+            raise ValueError(f'{field} 格式錯誤')
+
+class IntakeJournal:
+    """Append-only, fsync'd JSONL journal of submissions and their outcomes.
+
+    Each line is either an arrival ({'receipt', 'received_at', 'update',
+    'data'}) or an outcome ({'receipt', 'status', ...}). File order is arrival
+    order, and outcomes are written in that same order by the single drainer,
+    so the unresolved arrivals are always a contiguous tail of the queue.
+    Every process keeps its own index and catches up by reading the lines
+    appended since its last look, so any worker can answer a receipt poll.
+    Only the newest INTAKE_INDEX_SIZE resolved entries stay in the index.
+
+    Once everything is resolved and the file has grown past
+    INTAKE_SEGMENT_BYTES, the drainer removes it and the next arrival starts
+    a new one, so a process starting up never reads more than one segment.
+    Processes still reading the old file finish it through their open handle
+    before moving on. Applied submissions stay answerable from
+    intake_receipts (see receipt_status).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None       # segment being indexed, read through this handle
+        self._offset = 0
+        self._arrivals = 0
+        self._entries = {}      # receipt -> arrival record plus its outcome, if any
+        self._pending = []      # receipts awaiting an outcome, in arrival order
+        self._pending_head = 0
+        self._resolved = collections.deque()  # resolved receipts, oldest first
+
+    def _open_append(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+            # Make the new directory entry itself durable
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        return open(self.path, 'ab')
+
+    @contextlib.contextmanager
+    def _locked_segment(self):
+        """The current segment opened for append, under its exclusive lock"""
+        while True:
+            f = self._open_append()
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                current = os.stat(self.path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current == os.fstat(f.fileno()).st_ino:
+                break
+            # Removed by rotate() while we waited for the lock
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+        try:
+            yield f
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'
+        with self._locked_segment() as f:
+            # A crash mid-write leaves a torn last line; end it so it is skipped
+            size = f.seek(0, os.SEEK_END)
+            if size:
+                with open(self.path, 'rb') as tail:
+                    tail.seek(size - 1)
+                    if tail.read(1) != b'\n':
+                        f.write(b'\n')
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.refresh()
+
+    def refresh(self):
+        """Index lines appended since the last call, by this or any other process"""
+        with self._lock:
+            while True:
+                if self._file is None:
+                    try:
+                        self._file = open(self.path, 'rb')
+                    except FileNotFoundError:
+                        return
+                    self._offset = 0
+                self._read_new_lines()
+                try:
+                    current = os.stat(self.path).st_ino
+                except FileNotFoundError:
+                    current = None
+                if current == os.fstat(self._file.fileno()).st_ino:
+                    return
+                # Rotated: nothing is written to the old segment once it is
+                # unlinked, so finish it and move on to the new one
+                self._read_new_lines()
+                self._file.close()
+                self._file = None
+
+    def _read_new_lines(self):
+        self._file.seek(self._offset)
+        chunk = self._file.read()
+        end = chunk.rfind(b'\n')
+        if end < 0:
+            return
+        self._offset += end + 1
+        for raw in chunk[:end].split(b'\n'):
+            try:
+                record = json.loads(raw)
+            except ValueError:
+                continue  # torn write from a crash
+            self._index(record)
+
+    def rotate(self):
+        """Remove the segment once it is fully resolved and past INTAKE_SEGMENT_BYTES"""
+        if not os.path.exists(self.path):
+            return False
+        with self._locked_segment() as f:
+            if f.seek(0, os.SEEK_END) < Config.INTAKE_SEGMENT_BYTES:
+                return False
+            # Under the segment lock nobody can append, so this count is final
+            if self.pending_count():
+                return False
+            os.remove(self.path)
+        self.refresh()
+        return True
+
+    def _index(self, record):
+        receipt = record.get('receipt')
+        if 'received_at' in record:
+            self._arrivals += 1
+            self._entries[receipt] = dict(record, seq=self._arrivals, status='queued')
+            self._pending.append(receipt)
+        elif receipt in self._entries:
+            entry = self._entries[receipt]
+            if entry['status'] == 'queued':
+                self._resolved.append(receipt)
+            entry.update({k: v for k, v in record.items() if k != 'receipt'})
+            entry.pop('data', None)  # no need to keep the submission once resolved
+            while self._pending_head < len(self._pending) and \
+                    self._entries.get(self._pending[self._pending_head], {}).get('status') != 'queued':
+                self._pending_head += 1
+            if self._pending_head > 1024:
+                del self._pending[:self._pending_head]
+                self._pending_head = 0
+            # Resolved entries are always behind the pending head, so evicting
+            # them never touches the queue
+            while len(self._resolved) > Config.INTAKE_INDEX_SIZE:
+                del self._entries[self._resolved.popleft()]
+
+    def submit(self, data, update=False, receipt=None):
+        receipt = receipt or new_receipt()
+        try:
+            term = TermService.active_term()
+        except Exception:
+            # Journaling is how a submission survives the database being down
+            term = TermService.last_active_term()
+        self.append({
+            'receipt': receipt,
+            'received_at': datetime.now().isoformat(),
+            'update': update,
+            'term': term,
+            'data': data
+        })
+        return self.status(receipt)
+
+    def resolve(self, receipt, status, **details):
+        self.append(dict(details, receipt=receipt, status=status, resolved_at=datetime.now().isoformat()))
+
+    def next_pending(self):
+        self.refresh()
+        with self._lock:
+            if self._pending_head >= len(self._pending):
+                return None
+            return dict(self._entries[self._pending[self._pending_head]])
+
+    def status(self, receipt):
+        self.refresh()
+        with self._lock:
+            entry = self._entries.get(receipt)
+            if entry is None:
+                return None
+            status = {'receipt': receipt, 'status': entry['status'], 'receivedAt': entry['received_at']}
+            if entry['status'] == 'queued':
+                head = self._entries[self._pending[self._pending_head]]['seq']
+                status['position'] = entry['seq'] - head + 1
+            else:
+                status['resolvedAt'] = entry.get('resolved_at')
+                if 'result' in entry:
+                    status['result'] = entry['result']
+                if 'message' in entry:
+                    status['message'] = entry['message']
+            return status
+
+    def pending_count(self):
+        self.refresh()
+        with self._lock:
+            return len(self._pending) - self._pending_head
+
+_journal = None
+_journal_lock = threading.Lock()
+
+def get_journal():
+    global _journal
+    if _journal is None:
+        with _journal_lock:
+            if _journal is None:
+                _journal = IntakeJournal(Config.INTAKE_JOURNAL_PATH)
+    return _journal
+
+def receipt_status(receipt):
+    """Status of a receipt from the journal, or from intake_receipts once rotated out of it"""
+    status = get_journal().status(receipt)
+    if status is not None:
+        return status
+    with get_store().transaction() as tx:
+        result = tx.intake_result(receipt)
+    if result is None:
+        return None
+    return {'receipt': receipt, 'status': 'done', 'result': result}
+
+def should_journal():
+    """Whether a new submission goes to the journal rather than straight to the database"""
+    if Config.INTAKE_MODE == 'always':
+        return True
+    # In fallback mode nothing may overtake submissions that are still queued
+    return Config.INTAKE_MODE == 'fallback' and get_journal().pending_count() > 0
+
+def drain_once():
+    """Apply the oldest queued submission. Returns False when nothing is queued.
+
+    Raises on transient failures (database down, pool exhausted) without
+    resolving the entry, so it is retried before anything that arrived later.
+    """
+    journal = get_journal()
+    entry = journal.next_pending()
+    if entry is None:
+        return False
+    # A lagging replica must not decide the outcome of a write
+    with use_primary():
+        return _apply(journal, entry)
+
+def _apply(journal, entry):
+    # Journaled after a direct attempt whose commit may have gone through anyway
+    with get_store().transaction() as tx:
+        applied = tx.intake_result(entry['receipt'])
+    if applied is not None:
+        journal.resolve(entry['receipt'], 'done', result=applied)
+        return True
+    try:
+        result = RegistrationService.handle_registration(entry['data'], update=entry['update'],
+                                                         receipt=entry['receipt'], term=entry.get('term'))
+    except ValueError as e:
+        # Same rules as a direct submission, e.g. the course filled up while queued
+        journal.resolve(entry['receipt'], 'rejected', message=str(e))
+    except Exception as e:
+        code = sqlstate(e)
+        if code is None or not code.startswith(_PERMANENT_SQLSTATE_CLASSES):
+            raise
+        journal.resolve(entry['receipt'], 'failed', message='報名資料無法處理，請聯絡承辦人員')
+    else:
+        journal.resolve(entry['receipt'], 'done', result=result)
+    return True
+
+def _drain_forever():
+    # Only one process drains; the others wait on the lock in case it exits
+    with open(Config.INTAKE_JOURNAL_PATH + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        journal = get_journal()
+        pruned = 0.0
+        while True:
+            try:
+                if not drain_once():
+                    journal.rotate()
+                    if time.monotonic() - pruned > _RECEIPT_PRUNE_INTERVAL:
+                        get_store().prune_intake_receipts(Config.INTAKE_RECEIPT_RETENTION_DAYS)
+                        pruned = time.monotonic()
+                    time.sleep(Config.INTAKE_POLL_INTERVAL)
+            except Exception as e:
+                logger.warning("Intake drain failed, retrying: %s", e)
+                time.sleep(Config.INTAKE_RETRY_DELAY)
+
+_drainer = None
+
+def start_drainer():
+    """Start the background drainer once per process when intake mode is on"""
+    global _drainer
+    if Config.INTAKE_MODE == 'off':
+        return
+    journal = get_journal()
+    with _journal_lock:
+        if _drainer is None:
+            journal._open_append().close()
+            _drainer = threading.Thread(target=_drain_forever, name='intake-drainer', daemon=True)
+            _drainer.start()
+
+def intake_stats():
+    if Config.INTAKE_MODE == 'off':
+        return {'mode': 'off'}
+    return {'mode': Config.INTAKE_MODE, 'pending': get_journal().pending_count()}
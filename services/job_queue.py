@@ -0,0 +1,154 @@
+import json
+import logging
+import random
+import traceback
+from datetime import datetime, timedelta
+from database import get_db_connection, use_primary
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# kind -> callable(payload); registered with @job_handler
+_handlers = {}
+
+def job_handler(kind):
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+def enqueue(conn, kind, payload, max_attempts=None):
+    """Queue a job on the caller's connection, so it commits or rolls back with their transaction"""
+    result = conn.run(
+        """INSERT INTO jobs (kind, payload, max_attempts)
+           VALUES (:kind, CAST(:payload AS JSONB), :max_attempts)
+           RETURNING id""",
+        kind=kind, payload=json.dumps(payload, ensure_ascii=False),
+        max_attempts=max_attempts or Config.JOB_MAX_ATTEMPTS
+    )
+    return result[0][0]
+
+def retry_delay(attempts):
+    """Exponential backoff with full jitter, capped at JOB_BACKOFF_MAX seconds"""
+    ceiling = min(Config.JOB_BACKOFF_MAX, Config.JOB_BACKOFF_BASE * (2 ** (attempts - 1)))
+    return random.uniform(ceiling / 2, ceiling)
+
+def _claim_job():
+    """Lease the next due job to this worker, counting the attempt up front"""
+    conn = get_db_connection()
+    try:
+        conn.run("BEGIN")
+        now = datetime.now()
+        # A job whose lease ran out with no attempts left keeps taking its
+        # worker down with it; stop handing it out
+        conn.run("""
+            UPDATE jobs
+            SET status = 'failed', last_error = 'Worker lost while running the job',
+                locked_until = NULL, updated_at = :now
+            WHERE status = 'running' AND locked_until < :now AND attempts >= max_attempts
+        """, now=now)
+        rows = conn.run("""
+            UPDATE jobs
+            SET status = 'running', attempts = attempts + 1, locked_until = :lease, updated_at = :now
+            WHERE id = (
+                SELECT id
+                FROM jobs
+                WHERE (status = 'pending' AND run_at <= :now)
+                   OR (status = 'running' AND locked_until < :now)
+                ORDER BY run_at, id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, kind, payload, attempts, max_attempts
+        """, now=now, lease=now + timedelta(seconds=Config.JOB_LEASE_SECONDS))
+        conn.run("COMMIT")
+        return rows[0] if rows else None
+    except Exception:
+        conn.run("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+def _finish_job(job_id, attempts, status, error=None, run_at=None):
+    conn = get_db_connection()
+    try:
+        # Matching the attempt keeps a worker that overran its lease from
+        # overwriting the outcome of the attempt that reclaimed the job
+        conn.run("""
+            UPDATE jobs
+            SET status = :status, last_error = COALESCE(:error, last_error),
+                run_at = COALESCE(CAST(:run_at AS TIMESTAMP), run_at),
+                locked_until = NULL, updated_at = :now
+            WHERE id = :id AND attempts = :attempts AND status = 'running'
+        """, status=status, error=error, run_at=run_at, now=datetime.now(), id=job_id, attempts=attempts)
+    finally:
+        conn.close()
+
+def run_next_job():
+    """Claim and run one due job. Returns False when nothing was due.
+
+    The claim commits before the handler runs, with the attempt already
+    counted and the job leased for JOB_LEASE_SECONDS, so concurrent workers
+    skip it. If the worker dies mid-job the row stays 'running' until the
+    lease runs out, and then another worker reclaims it.
+    """
+    job = _claim_job()
+    if job is None:
+        return False
+
+    job_id, kind, payload, attempts, max_attempts = job
+    try:
+        handler = _handlers.get(kind)
+        if handler is None:
+            raise LookupError(f"No handler registered for job kind '{kind}'")
+        handler(payload)
+    except Exception:
+        error = traceback.format_exc(limit=5)
+        _finish_job(job_id, attempts, 'failed' if attempts >= max_attempts else 'pending', error=error,
+                    run_at=datetime.now() + timedelta(seconds=retry_delay(attempts)))
+        logger.warning("Job %s (%s) failed on attempt %s/%s", job_id, kind, attempts, max_attempts,
+                       extra={'job_error': error})
+    else:
+        _finish_job(job_id, attempts, 'done')
+    return True
+
+def prune_jobs():
+    """Delete done and failed jobs last touched more than JOB_RETENTION_DAYS ago"""
+    conn = get_db_connection()
+    try:
+        rows = conn.run("""
+            DELETE FROM jobs
+            WHERE status IN ('done', 'failed') AND updated_at < :cutoff
+            RETURNING id
+        """, cutoff=datetime.now() - timedelta(days=Config.JOB_RETENTION_DAYS))
+        return len(rows)
+    finally:
+        conn.close()
+
+def queue_stats():
+    conn = get_db_connection(read_only=True)
+    try:
+        rows = conn.run("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+        return {status: count for status, count in rows}
+    finally:
+        conn.close()
+
+@job_handler('send_confirmation_email')
+def send_confirmation_email(payload):
+    # Imported here: the services import this module to enqueue jobs
+    from services.admin_service import AdminService
+    from services.mailer import send_mail
+
+    # The registration was committed with the job; a lagging replica may not have it yet
+    with use_primary():
+        detail = AdminService.get_registration_detail(payload['registration_id'], payload.get('term'))
+    if detail is None:
+        return  # registration deleted before the mail went out
+    lines = [f"{detail['student_name']} 家長您好：", '', '我們已收到您的才藝課報名，內容如下：', '']
+    for course in detail['courses']:
+        lines.append(f"  課程：{course['name']}  ${course['price']}")
+    for supply in detail['supplies']:
+        lines.append(f"  用品：{supply['name']}  ${supply['price']}")
+    total = sum(int(item['price']) for item in detail['courses'] + detail['supplies'])
+    lines += ['', f'總金額：${total:,}', '', '常春藤教育機構 Ivy Educational Institution']
+    send_mail(payload['email'], '報名確認 Registration Confirmation', '\n'.join(lines))
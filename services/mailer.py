@@ -0,0 +1,32 @@
+import os
+import smtplib
+import time
+import uuid
+from email.message import EmailMessage
+from config import Config
+
+def build_message(to, subject, body):
+    message = EmailMessage()
+    message['From'] = Config.MAIL_FROM
+    message['To'] = to
+    message['Subject'] = subject
+    message.set_content(body)
+    return message
+
+def send_mail(to, subject, body):
+    """Send through SMTP, or drop the message in the local outbox when no SMTP host is set"""
+    message = build_message(to, subject, body)
+    if Config.SMTP_HOST:
+        with smtplib.SMTP(Config.SMTP_HOST, Config.SMTP_PORT, timeout=Config.SMTP_TIMEOUT) as smtp:
+            if Config.SMTP_USE_TLS:
+                smtp.starttls()
+            if Config.SMTP_USER:
+                smtp.login(Config.SMTP_USER, Config.SMTP_PASSWORD)
+            smtp.send_message(message)
+        return
+
+    # Development/test stand-in for SMTP: one .eml file per message
+    os.makedirs(Config.MAIL_OUTBOX_DIR, exist_ok=True)
+    filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.eml"
+    with open(os.path.join(Config.MAIL_OUTBOX_DIR, filename), 'wb') as f:
+        f.write(message.as_bytes())
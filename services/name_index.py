@@ -0,0 +1,31 @@
+import unicodedata
+
+def normalize_name(name):
+    """Fold a student name into the form stored in students.search_name"""
+    if not name:
+        return ''
+    # NFKC turns full-width letters, digits and the ideographic space into their
+    # half-width forms; whitespace anywhere in the name is then dropped.
+    folded = unicodedata.normalize('NFKC', name).casefold()
+    return ''.join(ch for ch in folded if not ch.isspace())
+
+def name_trigrams(normalized):
+    """Padded trigrams in the same shape as pg_trgm, so prefixes share the leading grams"""
+    if not normalized:
+        return []
+    padded = '  ' + normalized + ' '
+    return sorted({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+def index_student_name(conn, student_id, name):
+    """Store the normalized name and its trigrams for one student"""
+    search_name = normalize_name(name)
+    conn.run("UPDATE students SET search_name = :search_name WHERE id = :id",
+             search_name=search_name, id=student_id)
+    conn.run("DELETE FROM student_name_trigrams WHERE student_id = :id", id=student_id)
+    grams = name_trigrams(search_name)
+    if grams:
+        conn.run(
+            """INSERT INTO student_name_trigrams (trigram, student_id)
+               SELECT unnest(CAST(:grams AS TEXT[])), :id""",
+            grams=grams, id=student_id
+        )
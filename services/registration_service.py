@@ -1,68 +1,54 @@
 
-from database import get_db_connection
+from database import retry_transaction
+from services.name_index import normalize_name
+from services.singleflight import coalesced
+from services.term_service import TermService
+from storage.store import get_store
 from datetime import datetime
+import hashlib
 import json
 
+class AmbiguousNameError(ValueError):
+    """Several students share the normalized name and none has it exactly"""
+
+    def __init__(self):
+        super().__init__('有多位學生符合此姓名，請輸入與報名時完全相同的姓名')
+
 class RegistrationService:
     @staticmethod
     def get_registration_by_student(student_name):
-        conn = get_db_connection()
-        try:
-            # Get latest registration for student
-            results = conn.run("""
-                SELECT r.id, s.name, r.class_name, r.created_at, s.birthday
-                FROM registrations r
-                JOIN students s ON r.student_id = s.id
-                WHERE s.name = :name
-                ORDER BY r.created_at DESC
-                LIMIT 1
-            """, name=student_name)
-            
-            if not results:
-                return None
-            
-            reg = results[0]
-            reg_id = reg[0]
-            
-            # Get courses
-            course_results = conn.run("""
-                SELECT c.name, c.price
-                FROM registration_courses rc
-                JOIN courses c ON rc.course_id = c.id
-                WHERE rc.registration_id = :reg_id
-            """, reg_id=reg_id)
-            
-            courses = [{'name': row[0], 'price': str(row[1])} for row in course_results]
-            
-            # Get supplies
-            supply_results = conn.run("""
-                SELECT s.name, s.price
-                FROM registration_supplies rs
-                JOIN supplies s ON rs.supply_id = s.id
-                WHERE rs.registration_id = :reg_id
-            """, reg_id=reg_id)
-            
-            supplies = [{'name': row[0], 'price': str(row[1])} for row in supply_results]
-            
-            birthday = reg[4].strftime('%Y-%m-%d') if reg[4] else ''
-
-            return {
-                'id': reg_id,
-                'name': reg[1],
-                'birthday': birthday,
-                'class': reg[2] or 'Unspecified',
-                'courses': courses,
-                'supplies': supplies,
-                'totalItems': len(courses) + len(supplies)
-            }
-        finally:
-            conn.close()
+        regs = get_store().latest_registrations(student_name, normalize_name(student_name),
+                                                TermService.active_term())
+        if not regs:
+            return None
+        # The normalized name folds case, width and spacing, so two children
+        # can share it; it only stands in for the exact name when unique
+        if regs[0]['exact'] or len(regs) == 1:
+            reg = regs[0]
+        else:
+            raise AmbiguousNameError()
+
+        courses = [{'name': c['name'], 'price': str(c['price'])} for c in reg['courses']]
+        supplies = [{'name': sp['name'], 'price': str(sp['price'])} for sp in reg['supplies']]
+        birthday = reg['birthday'].strftime('%Y-%m-%d') if reg['birthday'] else ''
+
+        return {
+            'id': reg['id'],
+            'name': reg['name'],
+            'birthday': birthday,
+            'class': reg['class_name'] or 'Unspecified',
+            'courses': courses,
+            'supplies': supplies,
+            'totalItems': len(courses) + len(supplies)
+        }
 
     @staticmethod
-    def handle_registration(data, update=False):
+    @retry_transaction
+    def handle_registration(data, update=False, receipt=None, term=None):
         name = data.get('name')
         birthday = data.get('birthday')  # Format: YYYY-MM-DD
         class_name = data.get('class')
+        email = (data.get('email') or '').strip() or None
         courses = data.get('courses', [])
         supplies = data.get('supplies', [])
         
@@ -76,10 +62,19 @@ class RegistrationService:
                 'price': '1500'
             })
         
-        conn = get_db_connection()
-        try:
-            conn.run("BEGIN")
+        # A journaled submission keeps the term that was active when it arrived
+        term = term or TermService.active_term()
+        with get_store().transaction() as tx:
+            # A journaled submission replayed after a crash returns its first outcome
+            if receipt:
+                applied = tx.intake_result(receipt)
+                if applied is not None:
+                    return applied
+
             current_time = datetime.now()
+            # Basket already stored for this registration, by name; empty for new ones
+            stored_courses = {}
+            stored_supplies = {}
             
             if update:
                 reg_id = data.get('id')
@@ -87,137 +82,144 @@ class RegistrationService:
                     raise ValueError("Missing ID for update")
                 
                 # Fetch student_id
-                student_res = conn.run("SELECT student_id FROM registrations WHERE id=:id", id=reg_id)
-                if student_res:
-                    student_id = student_res[0][0]
-                    # Update student birthday if provided
-                    if birthday:
-                         conn.run("UPDATE students SET birthday=:birthday WHERE id=:id", birthday=birthday, id=student_id)
+                student_id = tx.registration_student(reg_id, term)
+                if student_id is None:
+                    raise ValueError('找不到本學期的報名資料')
+                # Update student birthday if provided
+                if birthday:
+                     tx.set_student_birthday(student_id, birthday)
 
-                conn.run(
-                    "UPDATE registrations SET class_name=:class_name, updated_at=:now WHERE id=:id",
-                    class_name=class_name, now=current_time, id=reg_id
-                )
-                
-                conn.run("DELETE FROM registration_courses WHERE registration_id=:id", id=reg_id)
-                conn.run("DELETE FROM registration_supplies WHERE registration_id=:id", id=reg_id)
+                tx.update_registration(reg_id, term, class_name, email, current_time)
+                stored_courses, stored_supplies = tx.registration_basket(reg_id, term)
                 new_id = reg_id
                 message = 'Update successful!'
             else:
                 # Insert or get student
-                student_result = conn.run("SELECT id FROM students WHERE name=:name", name=name)
-                if student_result:
-                    student_id = student_result[0][0]
+                student_id = tx.student_id_by_name(name)
+                if student_id is not None:
                     # Update birthday for existing student
                     if birthday:
-                         conn.run("UPDATE students SET birthday=:birthday WHERE id=:id", birthday=birthday, id=student_id)
+                         tx.set_student_birthday(student_id, birthday)
                 else:
-                    student_result = conn.run(
-                        "INSERT INTO students (name, birthday) VALUES (:name, :birthday) RETURNING id",
-                        name=name, birthday=birthday
-                    )
-                    student_id = student_result[0][0]
+                    student_id = tx.create_student(name, birthday)
                 
                 # Create registration
-                reg_result = conn.run(
-                    "INSERT INTO registrations (student_id, class_name, created_at, updated_at) VALUES (:student_id, :class_name, :now, :now) RETURNING id",
-                    student_id=student_id, class_name=class_name, now=current_time
-                )
-                new_id = reg_result[0][0]
+                new_id = tx.create_registration(term, student_id, class_name, email, current_time)
                 message = 'Registration successful!'
 
-            # Insert courses with capacity check
-            for course in courses:
-                course_result = conn.run("SELECT id, capacity FROM courses WHERE name=:name FOR UPDATE", name=course['name'])
-                
-                if course_result:
-                    course_id = course_result[0][0]
-                    capacity = course_result[0][1]
-                    
-                    if capacity is not None:
-                        count_result = conn.run(
-                            "SELECT COUNT(*) FROM registration_courses WHERE course_id=:cid", 
-                            cid=course_id
-                        )
-                        current_count = count_result[0][0]
-                        
-                        # For updates, we just deleted our own registration, so the count doesn't include us.
-                        # So simply checking count >= capacity is correct for both new and updates 
-                        # (for update, we were removed, so we are like a new addition).
-                        if current_count >= capacity:
-                            conn.run("ROLLBACK")
-                            raise ValueError(f'課程「{course["name"]}」已額滿')
-
-                    conn.run(
-                        "INSERT INTO registration_courses (registration_id, course_id) VALUES (:reg_id, :course_id)",
-                        reg_id=new_id, course_id=course_id
-                    )
-            
-            # Insert supplies
-            for supply in supplies:
-                supply_result = conn.run("SELECT id FROM supplies WHERE name=:name", name=supply['name'])
-                if supply_result:
-                    supply_id = supply_result[0][0]
-                    conn.run(
-                        "INSERT INTO registration_supplies (registration_id, supply_id) VALUES (:reg_id, :supply_id)",
-                        reg_id=new_id, supply_id=supply_id
-                    )
+            # Only the difference between the stored and submitted baskets is
+            # written; unchanged line items are neither locked nor re-counted.
+            course_names = list(dict.fromkeys(course['name'] for course in courses))
+            added_courses = [n for n in course_names if n not in stored_courses]
+            removed_courses = [cid for n, cid in stored_courses.items() if n not in course_names]
+            supply_names = list(dict.fromkeys(supply['name'] for supply in supplies))
+            added_supplies = [n for n in supply_names if n not in stored_supplies]
+            removed_supplies = [sid for n, sid in stored_supplies.items() if n not in supply_names]
+
+            if removed_courses:
+                tx.remove_courses(new_id, term, removed_courses)
+            if removed_supplies:
+                tx.remove_supplies(new_id, term, removed_supplies)
+
+            if added_courses:
+                # Locked in ID order, so concurrent registrations cannot deadlock on them
+                locked_courses = tx.lock_courses(term, added_courses)
+                used = tx.course_usage(term, [course_id for course_id, _ in locked_courses.values()])
+
+                # Capacity check for added courses only; a registration never
+                # counts against a course it already holds a seat in.
+                for course_name in added_courses:
+                    if course_name not in locked_courses:
+                        continue
+                    course_id, capacity = locked_courses[course_name]
+                    if capacity is not None and used.get(course_id, 0) >= capacity:
+                        raise ValueError(f'課程「{course_name}」已額滿')
+                    tx.add_course(term, new_id, course_id)
             
-            conn.run("COMMIT")
-            return {'message': message, 'id': new_id}
+            # Supplies in ID order too, like the courses
+            if added_supplies:
+                for supply_id in tx.supply_ids(added_supplies):
+                    tx.add_supply(term, new_id, supply_id)
             
-        except Exception as e:
-            conn.run("ROLLBACK")
-            raise e
-        finally:
-            conn.close()
+            # Queued in this transaction: the mail goes out only if the registration
+            # commits, and SMTP latency stays out of the request.
+            if email:
+                tx.enqueue('send_confirmation_email', {'registration_id': new_id, 'term': term, 'email': email})
+
+            result = {'message': message, 'id': new_id}
+            if receipt:
+                tx.record_intake(receipt, result)
+
+        return result
 
     @staticmethod
+    @coalesced
     def get_course_availability():
-        conn = get_db_connection()
-        try:
-            results = conn.run("""
-                SELECT c.name, c.capacity, COUNT(rc.registration_id) as used
-                FROM courses c
-                LEFT JOIN registration_courses rc ON c.id = rc.course_id
-                GROUP BY c.id, c.name, c.capacity
-            """)
-            
-            availability = {}
-            for row in results:
-                name = row[0]
-                capacity = row[1] if row[1] is not None else 30
-                used = row[2]
-                remaining = max(0, capacity - used)
-                availability[name] = remaining
-            return availability
-        finally:
-            conn.close()
+        results = get_store().course_availability(TermService.active_term())
+
+        availability = {}
+        for row in results:
+            name = row[0]
+            capacity = row[1] if row[1] is not None else 30
+            used = row[2]
+            remaining = max(0, capacity - used)
+            availability[name] = remaining
+        return availability
 
     @staticmethod
+    @coalesced
     def get_registration_settings():
-        conn = get_db_connection()
-        try:
-            results = conn.run("""
-                SELECT key, value FROM settings 
-                WHERE key IN ('registration_start', 'registration_end')
-            """)
-            
-            settings = {}
-            for row in results:
-                settings[row[0]] = row[1]
-            return {
-                'start': settings.get('registration_start', ''),
-                'end': settings.get('registration_end', '')
-            }
-        finally:
-            conn.close()
+        settings = get_store().settings(['registration_start', 'registration_end'])
+        return {
+            'start': settings.get('registration_start', ''),
+            'end': settings.get('registration_end', '')
+        }
 
     @staticmethod
+    @coalesced
     def get_course_videos():
-        conn = get_db_connection()
-        try:
-            results = conn.run("SELECT name, video_url FROM courses WHERE video_url IS NOT NULL AND video_url != ''")
-            return {row[0]: row[1] for row in results}
-        finally:
-            conn.close()
+        return get_store().course_videos(TermService.active_term())
+
+
+    @staticmethod
+    @coalesced
+    def get_bootstrap():
+        """Everything the registration page needs for first paint, read from one snapshot"""
+        term = TermService.active_term()
+        course_rows, supply_rows, settings = get_store().catalog(term)
+
+        courses = []
+        availability = {}
+        videos = {}
+        for row in course_rows:
+            capacity = row['capacity'] if row['capacity'] is not None else 30
+            remaining = max(0, capacity - row['used'])
+            courses.append({
+                'id': row['id'],
+                'name': row['name'],
+                'price': row['price'],
+                'sessions': row['sessions'],
+                'frequency': row['frequency'] or '',
+                'description': row['description'] or '',
+                'capacity': capacity,
+                'remaining': remaining
+            })
+            availability[row['name']] = remaining
+            if row['video_url']:
+                videos[row['name']] = row['video_url']
+
+        data = {
+            'term': term,
+            'courses': courses,
+            'supplies': [{'id': row['id'], 'name': row['name'], 'price': row['price']} for row in supply_rows],
+            'availability': availability,
+            'registration_time': {
+                'start': settings.get('registration_start', ''),
+                'end': settings.get('registration_end', '')
+            },
+            'videos': videos
+        }
+        # The version only changes when the content does, so it doubles as the ETag
+        digest = hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        data['version'] = digest.hexdigest()[:16]
+        return data
@@ -0,0 +1,68 @@
+import functools
+import threading
+from database import prefers_primary
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one execution.
+
+    The first caller (the leader) runs the function; callers arriving while it
+    is in flight wait for it and receive the same result or exception. Nothing
+    is cached afterwards, so the next caller after completion runs it again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.shared += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {'executed': self.executed, 'shared': self.shared, 'in_flight': len(self._calls)}
+
+flights = SingleFlight()
+
+def coalesced(fn):
+    """Share one in-flight execution of a read among concurrent callers.
+
+    Results are handed to every waiter as the same object, so decorated
+    functions must return data that callers only read. Clients pinned to the
+    primary by read-your-writes never share a flight with replica readers.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = (fn.__qualname__, args, tuple(sorted(kwargs.items())), prefers_primary())
+        return flights.do(key, lambda: fn(*args, **kwargs))
+    return wrapper
@@ -0,0 +1,129 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import traceback
+from datetime import datetime, timezone
+from flask import g, has_request_context
+from config import Config
+
+# Attributes every LogRecord has; anything else was passed in extra= and is logged as a field
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, extra fields, traceback"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['traceback'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class _RequestQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread without ever blocking the caller.
+
+    The request ID is attached and any traceback rendered here, on the
+    logging thread, because neither survives the hand-off.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = ''.join(traceback.format_exception(*record.exc_info))
+        record.exc_info = None
+        record.stack_info = None
+        if has_request_context() and 'request_id' in g and not hasattr(record, 'request_id'):
+            record.request_id = g.request_id
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Better to lose a log line than to stall a request on a slow disk
+            self.dropped += 1
+
+class _BatchWriter(threading.Thread):
+    """Drains the queue and writes whatever has accumulated as one batch"""
+
+    def __init__(self, log_queue, stream):
+        super().__init__(name='log-writer', daemon=True)
+        self.queue = log_queue
+        self.stream = stream
+        self.formatter = JSONFormatter()
+        self._stopping = threading.Event()
+
+    def run(self):
+        while not (self._stopping.is_set() and self.queue.empty()):
+            try:
+                batch = [self.queue.get(timeout=Config.LOG_FLUSH_INTERVAL)]
+            except queue.Empty:
+                continue
+            while len(batch) < Config.LOG_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for record in batch:
+                try:
+                    lines.append(self.formatter.format(record))
+                except Exception:
+                    lines.append(json.dumps({'level': 'ERROR', 'message': f'Unformattable log record: {record.msg!r}'}))
+            try:
+                self.stream.write('\n'.join(lines) + '\n')
+                self.stream.flush()
+            except Exception:
+                pass  # nowhere left to report it
+
+    def stop(self):
+        self._stopping.set()
+        self.join(timeout=5)
+
+_handler = None
+_writer = None
+_setup_lock = threading.Lock()
+
+def setup_logging():
+    """Route all logging through the queue to a background JSON writer; safe to call twice"""
+    global _handler, _writer
+    with _setup_lock:
+        if _handler is not None:
+            return
+        stream = open(Config.LOG_FILE, 'a', encoding='utf-8') if Config.LOG_FILE else sys.stderr
+        log_queue = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+        _writer = _BatchWriter(log_queue, stream)
+        _writer.start()
+        _handler = _RequestQueueHandler(log_queue)
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(_handler)
+        root.setLevel(Config.LOG_LEVEL)
+        # Werkzeug's own access lines would duplicate ours
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        atexit.register(_writer.stop)
+
+def log_stats():
+    if _handler is None:
+        return {'enabled': False}
+    return {'enabled': True, 'queued': _handler.queue.qsize(), 'dropped': _handler.dropped}
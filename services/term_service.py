@@ -0,0 +1,95 @@
+from database import term_partition_suffix
+from config import Config
+from storage.store import get_store
+import threading
+import time
+
+_active_term = {'code': None, 'expires': 0.0}
+_active_term_lock = threading.Lock()
+
+class TermService:
+    @staticmethod
+    def active_term():
+        """Code of the term new registrations go to and queries default to"""
+        with _active_term_lock:
+            if _active_term['code'] and time.monotonic() < _active_term['expires']:
+                return _active_term['code']
+
+        code = get_store().active_term() or Config.DEFAULT_TERM
+        TermService._remember_active(code)
+        return code
+
+    @staticmethod
+    def last_active_term():
+        """Active term as last read, even if stale; None before the first read"""
+        with _active_term_lock:
+            return _active_term['code']
+
+    @staticmethod
+    def active_term_cached():
+        with _active_term_lock:
+            return bool(_active_term['code']) and time.monotonic() < _active_term['expires']
+
+    @staticmethod
+    def _remember_active(code):
+        with _active_term_lock:
+            _active_term['code'] = code
+            _active_term['expires'] = time.monotonic() + Config.ACTIVE_TERM_CACHE_SECONDS
+
+    @staticmethod
+    def resolve(term=None):
+        """The requested term, or the active one when none is given"""
+        if term:
+            term_partition_suffix(term)
+            return term
+        return TermService.active_term()
+
+    @staticmethod
+    def list_terms():
+        return [{
+            'code': row[0],
+            'name': row[1],
+            'created_at': row[2].isoformat() if row[2] else None,
+            'archived_at': row[3].isoformat() if row[3] else None,
+            'active': bool(row[4])
+        } for row in get_store().list_terms()]
+
+    @staticmethod
+    def create_term(code, name=None, copy_courses_from=None):
+        term_partition_suffix(code)
+        with get_store().transaction() as tx:
+            # A typo would otherwise create an empty term and report success
+            if copy_courses_from and tx.term_status(copy_courses_from) is None:
+                raise ValueError('來源學期不存在')
+            if not tx.insert_term(code, name or code):
+                raise ValueError('學期已存在')
+            copied = tx.copy_courses(copy_courses_from, code) if copy_courses_from else 0
+        return {'code': code, 'name': name or code, 'copiedCourses': copied}
+
+    @staticmethod
+    def set_active_term(code):
+        term_partition_suffix(code)
+        with get_store().transaction() as tx:
+            # Row lock serializes activation against a concurrent archive
+            status = tx.term_status(code)
+            if status is None:
+                raise ValueError('學期不存在')
+            if status == 'archived':
+                raise ValueError('學期已封存，無法設為目前學期')
+            tx.activate_term(code)
+        TermService._remember_active(code)
+
+    @staticmethod
+    def archive_term(code):
+        """Take a finished term out of the live tables (see the store's archive_term)"""
+        term_partition_suffix(code)
+        with get_store().transaction() as tx:
+            status = tx.term_status(code)
+            if status is None:
+                raise ValueError('學期不存在')
+            if status == 'archived':
+                raise ValueError('學期已封存')
+            if tx.active_term() == code:
+                raise ValueError('無法封存目前學期，請先切換至其他學期')
+            archived, schema = tx.archive_term(code)
+        return {'code': code, 'archivedRegistrations': archived, 'schema': schema}
@@ -2,6 +2,10 @@
 let authToken = localStorage.getItem('adminToken') || '';
 let allRegistrations = [];
 let allCourses = [];
+let selectedIds = new Set();
+let syncCursor = null;
+let syncTimer = null;
+const SYNC_INTERVAL_MS = 30000;
 
 // Check if logged in on page load
 function checkAuth() {
@@ -70,14 +74,22 @@ document.addEventListener('DOMContentLoaded', () => {
 
 function loadAllData() {
     loadRegistrations();
+    clearInterval(syncTimer);
+    syncTimer = setInterval(syncRegistrations, SYNC_INTERVAL_MS);
     loadCourses();
     loadRegistrationTime();
 }
 
-// Search functionality
+// Search functionality (student names are matched server-side, debounced)
+let searchTimer = null;
 document.getElementById('searchInput').addEventListener('input', function (e) {
-    const searchTerm = e.target.value.toLowerCase();
-    filterRegistrations(searchTerm);
+    const searchTerm = e.target.value.trim();
+    clearTimeout(searchTimer);
+    if (!searchTerm) {
+        displayRegistrations(allRegistrations);
+        return;
+    }
+    searchTimer = setTimeout(() => filterRegistrations(searchTerm), 200);
 });
 
 // ============ Registration Time Functions ============
@@ -392,6 +404,7 @@ async function loadRegistrations() {
         if (response.ok) {
             const data = await response.json();
             allRegistrations = data.registrations;
+            syncCursor = data.cursor;
             updateStatistics(data.statistics);
             displayRegistrations(allRegistrations);
         } else {
@@ -403,6 +416,42 @@ async function loadRegistrations() {
     }
 }
 
+// Fetch only rows changed since the last sync and merge them into the table
+async function syncRegistrations() {
+    if (!syncCursor || !authToken) return;
+    try {
+        const response = await apiFetch(`/admin/registrations?since=${encodeURIComponent(syncCursor)}`);
+        if (response.status === 401) {
+            clearInterval(syncTimer);
+            showLoginModal();
+            return;
+        }
+        if (!response.ok) return;
+
+        const data = await response.json();
+        syncCursor = data.cursor;
+        if (data.full) {
+            allRegistrations = data.registrations;
+            const present = new Set(allRegistrations.map(reg => reg.id));
+            selectedIds.forEach(id => { if (!present.has(id)) selectedIds.delete(id); });
+            refreshTable();
+            return;
+        }
+        if (data.registrations.length === 0 && data.deleted.length === 0) return;
+
+        const changed = new Map(data.registrations.map(reg => [reg.id, reg]));
+        const removed = new Set(data.deleted);
+        allRegistrations = [
+            ...allRegistrations.filter(reg => !changed.has(reg.id) && !removed.has(reg.id)),
+            ...changed.values()
+        ].sort((a, b) => (b.created_at || '').localeCompare(a.created_at || ''));
+        removed.forEach(id => selectedIds.delete(id));
+        refreshTable();
+    } catch (error) {
+        console.error('Sync error:', error);
+    }
+}
+
 function updateStatistics(stats) {
     document.getElementById('totalRegistrations').textContent = stats.totalRegistrations || 0;
     document.getElementById('totalStudents').textContent = stats.totalStudents || 0;
@@ -416,7 +465,7 @@ function displayRegistrations(registrations) {
     if (!registrations || registrations.length === 0) {
         tbody.innerHTML = `
             <tr>
-                <td colspan="8" class="empty-state">
+                <td colspan="9" class="empty-state">
                     <div class="empty-state-icon">📭</div>
                     <div>目前沒有報名資料</div>
                 </td>
@@ -427,6 +476,7 @@ function displayRegistrations(registrations) {
 
     tbody.innerHTML = registrations.map(reg => `
         <tr>
+            <td><input type="checkbox" ${selectedIds.has(reg.id) ? 'checked' : ''} onclick="toggleSelected(${reg.id}, this.checked)"></td>
             <td><span class="badge badge-info">#${reg.id}</span></td>
             <td><strong>${reg.student_name}</strong></td>
             <td>${reg.class_name || '未指定'}</td>
@@ -451,12 +501,33 @@ function displayRegistrations(registrations) {
     `).join('');
 }
 
-function filterRegistrations(searchTerm) {
-    const filtered = allRegistrations.filter(reg =>
-        reg.student_name.toLowerCase().includes(searchTerm) ||
-        (reg.class_name && reg.class_name.toLowerCase().includes(searchTerm))
+async function filterRegistrations(searchTerm) {
+    const term = searchTerm.toLowerCase();
+    // Class names are few and already loaded, so they are still matched locally
+    const classMatches = allRegistrations.filter(reg =>
+        reg.class_name && reg.class_name.toLowerCase().includes(term)
     );
-    displayRegistrations(filtered);
+
+    let rankedNames = [];
+    try {
+        const response = await apiFetch(`/admin/students/search?q=${encodeURIComponent(searchTerm)}`);
+        if (response.ok) {
+            const data = await response.json();
+            rankedNames = data.results.map(r => r.student_name);
+        }
+    } catch (error) {
+        console.error('Search error:', error);
+    }
+
+    // Ignore responses for a term the user has already typed past
+    if (document.getElementById('searchInput').value.trim() !== searchTerm) return;
+
+    const rank = new Map(rankedNames.map((name, i) => [name, i]));
+    const nameMatches = allRegistrations
+        .filter(reg => rank.has(reg.student_name))
+        .sort((a, b) => rank.get(a.student_name) - rank.get(b.student_name));
+    const seen = new Set(nameMatches.map(reg => reg.id));
+    displayRegistrations([...nameMatches, ...classMatches.filter(reg => !seen.has(reg.id))]);
 }
 
 async function viewDetails(id) {
@@ -553,7 +624,7 @@ async function deleteRegistration(id, name) {
 
                 if (response.ok) {
                     showToast('刪除成功！', '報名資料已刪除', 'success');
-                    loadRegistrations();
+                    removeRegistrationsLocally([id]);
                 } else {
                     showToast('刪除失敗', '無法刪除此資料', 'error');
                 }
@@ -576,7 +647,7 @@ async function togglePayment(id, currentStatus) {
         if (response.ok) {
             const result = await response.json();
             showToast('更新成功', result.message, 'success');
-            loadRegistrations(); // Reload to update UI
+            patchRegistrationsLocally([{ id, is_paid: newStatus, updated_at: new Date().toISOString() }]);
         } else {
             showToast('更新失敗', '無法更新繳費狀態', 'error');
         }
@@ -586,6 +657,111 @@ async function togglePayment(id, currentStatus) {
     }
 }
 
+// ============ Local Table Updates & Bulk Actions ============
+function refreshTable() {
+    const searchTerm = document.getElementById('searchInput').value.trim();
+    if (searchTerm) {
+        filterRegistrations(searchTerm);
+    } else {
+        displayRegistrations(allRegistrations);
+    }
+    updateStatistics(computeStatistics(allRegistrations));
+    updateBulkActions();
+}
+
+function computeStatistics(registrations) {
+    return {
+        totalRegistrations: registrations.length,
+        totalStudents: new Set(registrations.map(reg => reg.student_name)).size,
+        totalCourseEnrollments: registrations.reduce((sum, reg) => sum + reg.course_count, 0),
+        totalSupplyOrders: registrations.reduce((sum, reg) => sum + reg.supply_count, 0)
+    };
+}
+
+function patchRegistrationsLocally(updates) {
+    const byId = new Map(updates.map(u => [u.id, u]));
+    allRegistrations = allRegistrations.map(reg => byId.has(reg.id) ? { ...reg, ...byId.get(reg.id) } : reg);
+    refreshTable();
+}
+
+function removeRegistrationsLocally(ids) {
+    const removed = new Set(ids);
+    allRegistrations = allRegistrations.filter(reg => !removed.has(reg.id));
+    ids.forEach(id => selectedIds.delete(id));
+    refreshTable();
+}
+
+function toggleSelected(id, checked) {
+    if (checked) {
+        selectedIds.add(id);
+    } else {
+        selectedIds.delete(id);
+    }
+    updateBulkActions();
+}
+
+function toggleSelectAll(checked) {
+    document.querySelectorAll('#tableBody input[type="checkbox"]').forEach(cb => {
+        if (cb.checked !== checked) cb.click();
+    });
+}
+
+function updateBulkActions() {
+    const bar = document.getElementById('bulkActions');
+    if (!bar) return;
+    bar.style.display = selectedIds.size > 0 ? 'flex' : 'none';
+    document.getElementById('selectedCount').textContent = `已選取 ${selectedIds.size} 筆`;
+    if (selectedIds.size === 0) {
+        document.getElementById('selectAll').checked = false;
+    }
+}
+
+async function bulkSetPayment(paid) {
+    if (selectedIds.size === 0) return;
+    try {
+        const response = await apiFetch('/admin/registrations/payment', {
+            method: 'POST',
+            body: JSON.stringify({ ids: [...selectedIds], paid })
+        });
+        const result = await response.json();
+        if (response.ok) {
+            showToast('更新成功', result.message, 'success');
+            patchRegistrationsLocally(result.updated);
+        } else {
+            showToast('更新失敗', result.message || '無法更新繳費狀態', 'error');
+        }
+    } catch (error) {
+        console.error('Error:', error);
+        showToast('連線錯誤', '伺服器連線錯誤', 'error');
+    }
+}
+
+function bulkDelete() {
+    if (selectedIds.size === 0) return;
+    showConfirm(
+        '確認刪除報名？',
+        `確定要刪除已選取的 ${selectedIds.size} 筆報名資料嗎？\n此操作無法復原！`,
+        async () => {
+            try {
+                const response = await apiFetch('/admin/registrations/delete', {
+                    method: 'POST',
+                    body: JSON.stringify({ ids: [...selectedIds] })
+                });
+                const result = await response.json();
+                if (response.ok) {
+                    showToast('刪除成功！', result.message, 'success');
+                    removeRegistrationsLocally(result.deleted);
+                } else {
+                    showToast('刪除失敗', result.message || '無法刪除資料', 'error');
+                }
+            } catch (error) {
+                console.error('Error:', error);
+                showToast('連線錯誤', '伺服器連線錯誤', 'error');
+            }
+        }
+    );
+}
+
 function exportDataExcel() {
     try {
         if (typeof XLSX === 'undefined') {
@@ -687,6 +863,30 @@ function exportDataCSV() {
     showToast('匯出成功', '報名資料已匯出為 CSV 檔案', 'success');
 }
 
+async function exportRosters() {
+    try {
+        const response = await apiFetch('/admin/rosters');
+        if (!response.ok) {
+            const data = await response.json();
+            throw new Error(data.message || '匯出失敗');
+        }
+        const blob = await response.blob();
+        const url = URL.createObjectURL(blob);
+        const link = document.createElement('a');
+        link.href = url;
+        link.download = `課程名單_${new Date().toISOString().split('T')[0]}.zip`;
+        document.body.appendChild(link);
+        link.click();
+        document.body.removeChild(link);
+        setTimeout(() => URL.revokeObjectURL(url), 0);
+
+        showToast('匯出成功', '各課程名單已匯出為 ZIP（每門課一個 CSV）', 'success');
+    } catch (error) {
+        console.error('Roster export error:', error);
+        showToast('匯出失敗', error.message, 'error');
+    }
+}
+
 function formatDate(dateString) {
     if (!dateString) return '-';
     const date = new Date(dateString);
@@ -703,7 +903,7 @@ function showError(message) {
     const tbody = document.getElementById('tableBody');
     tbody.innerHTML = `
         <tr>
-            <td colspan="8" class="empty-state">
+            <td colspan="9" class="empty-state">
                 <div class="empty-state-icon">❌</div>
                 <div>${message}</div>
             </td>
@@ -11,13 +11,7 @@ async function fetchRegistrationTime() {
 
         if (response.ok) {
             const data = await response.json();
-            if (data.start) {
-                REGISTRATION_START_DATE = new Date(data.start);
-            }
-            if (data.end) {
-                REGISTRATION_END_DATE = new Date(data.end);
-            }
-            checkRegistrationTime();
+            applyRegistrationTime(data);
         }
     } catch (error) {
         console.error('Failed to fetch registration time:', error);
@@ -28,6 +22,36 @@ async function fetchRegistrationTime() {
     }
 }
 
+function applyRegistrationTime(data) {
+    if (data.start) {
+        REGISTRATION_START_DATE = new Date(data.start);
+    }
+    if (data.end) {
+        REGISTRATION_END_DATE = new Date(data.end);
+    }
+    checkRegistrationTime();
+}
+
+// Load seats, registration window and videos in a single request
+async function loadBootstrap() {
+    try {
+        const response = await apiFetch('/api/bootstrap');
+        if (!response.ok) {
+            throw new Error(`Bootstrap failed with status ${response.status}`);
+        }
+        const data = await response.json();
+        applyRegistrationTime(data.registration_time);
+        updateCourseAvailabilityUI(data.availability);
+        courseVideos = data.videos;
+        renderVideoButtons();
+    } catch (error) {
+        console.error('Failed to load bootstrap data, falling back:', error);
+        loadCourseVideos();
+        fetchRegistrationTime();
+        fetchCourseAvailability();
+    }
+}
+
 function checkRegistrationTime() {
     const now = new Date();
     const notice = document.getElementById('registrationNotice');
@@ -136,6 +160,8 @@ document.addEventListener('DOMContentLoaded', () => {
 
             const name = document.getElementById('studentName').value;
             const birthday = document.getElementById('studentBirthday').value;
+            const emailInput = document.getElementById('parentEmail');
+            const email = emailInput ? emailInput.value.trim() : '';
             const classSelected = document.querySelector('input[name="class"]:checked');
 
             const selectedCourses = [];
@@ -168,6 +194,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 name: name,
                 birthday: birthday,
                 class: classSelected ? classSelected.value : 'Unspecified',
+                email: email,
                 courses: selectedCourses,
                 supplies: selectedSupplies,
                 totalItems: selectedCourses.length + selectedSupplies.length
@@ -196,10 +223,8 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
-    // Initialize video loading
-    loadCourseVideos();
-    fetchRegistrationTime();
-    fetchCourseAvailability();
+    // Initialize seats, registration time and videos
+    loadBootstrap();
 });
 
 // Video Modal Logic
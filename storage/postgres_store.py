@@ -0,0 +1,889 @@
+import contextlib
+import json
+import time
+from config import Config
+from database import fold_finance_deltas, get_db_connection, init_db, ensure_term_partitions, term_partition_suffix
+from services.name_index import index_student_name
+from services.job_queue import enqueue
+
+# Detached partitions of archived terms are kept, read-only by convention, here
+ARCHIVE_SCHEMA = 'archive'
+
+class PostgresTransaction:
+    """Write operations of one registration or catalog transaction on a pooled connection"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def student_id_by_name(self, name):
+        rows = self.conn.run("SELECT id FROM students WHERE name=:name", name=name)
+        return rows[0][0] if rows else None
+
+    def create_student(self, name, birthday):
+        student_id = self.conn.run(
+            "INSERT INTO students (name, birthday) VALUES (:name, :birthday) RETURNING id",
+            name=name, birthday=birthday
+        )[0][0]
+        index_student_name(self.conn, student_id, name)
+        return student_id
+
+    def set_student_birthday(self, student_id, birthday):
+        self.conn.run("UPDATE students SET birthday=:birthday WHERE id=:id", birthday=birthday, id=student_id)
+
+    def registration_student(self, reg_id, term):
+        rows = self.conn.run("SELECT student_id FROM registrations WHERE id=:id AND term=:term", id=reg_id, term=term)
+        return rows[0][0] if rows else None
+
+    def create_registration(self, term, student_id, class_name, email, now):
+        return self.conn.run(
+            "INSERT INTO registrations (term, student_id, class_name, email, created_at, updated_at) VALUES (:term, :student_id, :class_name, :email, :now, :now) RETURNING id",
+            term=term, student_id=student_id, class_name=class_name, email=email, now=now
+        )[0][0]
+
+    def update_registration(self, reg_id, term, class_name, email, now):
+        self.conn.run(
+            "UPDATE registrations SET class_name=:class_name, email=COALESCE(:email, email), updated_at=:now WHERE id=:id AND term=:term",
+            class_name=class_name, email=email, now=now, id=reg_id, term=term
+        )
+
+    def registration_basket(self, reg_id, term):
+        """Stored courses and supplies of a registration, each as {name: id}"""
+        courses = dict(self.conn.run("""
+            SELECT c.name, c.id FROM registration_courses rc JOIN courses c ON c.id = rc.course_id
+            WHERE rc.registration_id = :id AND rc.term = :term
+        """, id=reg_id, term=term))
+        supplies = dict(self.conn.run("""
+            SELECT sp.name, sp.id FROM registration_supplies rs JOIN supplies sp ON sp.id = rs.supply_id
+            WHERE rs.registration_id = :id AND rs.term = :term
+        """, id=reg_id, term=term))
+        return courses, supplies
+
+    def remove_courses(self, reg_id, term, course_ids):
+        self.conn.run(
+            "DELETE FROM registration_courses WHERE registration_id=:id AND term=:term AND course_id = ANY(CAST(:ids AS INTEGER[]))",
+            id=reg_id, term=term, ids=list(course_ids)
+        )
+
+    def remove_supplies(self, reg_id, term, supply_ids):
+        self.conn.run(
+            "DELETE FROM registration_supplies WHERE registration_id=:id AND term=:term AND supply_id = ANY(CAST(:ids AS INTEGER[]))",
+            id=reg_id, term=term, ids=list(supply_ids)
+        )
+
+    def lock_courses(self, term, names):
+        """Row-lock courses by name until commit; returns {name: (id, capacity)}.
+
+        One statement in ID order: two registrations sharing courses always
+        queue on the same first row instead of each holding a lock the other
+        one needs.
+        """
+        rows = self.conn.run("""
+            SELECT name, id, capacity FROM courses
+            WHERE term = :term AND name = ANY(CAST(:names AS TEXT[]))
+            ORDER BY id
+            FOR UPDATE
+        """, term=term, names=list(names))
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    def course_usage(self, term, course_ids):
+        return dict(self.conn.run("""
+            SELECT course_id, COUNT(*) FROM registration_courses
+            WHERE term = :term AND course_id = ANY(CAST(:ids AS INTEGER[]))
+            GROUP BY course_id
+        """, term=term, ids=list(course_ids)))
+
+    def add_course(self, term, reg_id, course_id):
+        self.conn.run(
+            "INSERT INTO registration_courses (term, registration_id, course_id) VALUES (:term, :reg_id, :course_id)",
+            term=term, reg_id=reg_id, course_id=course_id
+        )
+
+    def supply_ids(self, names):
+        """IDs of the named supplies in ID order, the order their counters must be locked in"""
+        rows = self.conn.run(
+            "SELECT id FROM supplies WHERE name = ANY(CAST(:names AS TEXT[])) ORDER BY id",
+            names=list(names)
+        )
+        return [row[0] for row in rows]
+
+    def add_supply(self, term, reg_id, supply_id):
+        self.conn.run(
+            "INSERT INTO registration_supplies (term, registration_id, supply_id) VALUES (:term, :reg_id, :supply_id)",
+            term=term, reg_id=reg_id, supply_id=supply_id
+        )
+
+    def enqueue(self, kind, payload):
+        enqueue(self.conn, kind, payload)
+
+    # ---- Catalog batches ----
+
+    def lock_catalog(self, term, course_ids):
+        """(locked {id: term} for course_ids, {name: id} of the term's catalog)
+
+        Rows are locked in ID order, the same order registrations lock them in.
+        """
+        locked = self.conn.run(
+            "SELECT id, term FROM courses WHERE id = ANY(CAST(:ids AS INTEGER[])) ORDER BY id FOR UPDATE",
+            ids=list(course_ids)
+        )
+        names = self.conn.run("SELECT name, id FROM courses WHERE term = :term", term=term)
+        return dict(locked), dict(names)
+
+    def course_enrolments(self, course_ids):
+        rows = self.conn.run("""
+            SELECT course_id, COUNT(*) FROM registration_courses
+            WHERE course_id = ANY(CAST(:ids AS INTEGER[]))
+            GROUP BY course_id
+        """, ids=list(course_ids))
+        return dict(rows)
+
+    def delete_courses(self, course_ids):
+        self.conn.run("DELETE FROM courses WHERE id = ANY(CAST(:ids AS INTEGER[]))", ids=list(course_ids))
+
+    def update_courses(self, courses):
+        """courses: {id: fields}, written with one UPDATE ... FROM unnest(...)"""
+        ids = list(courses)
+        self.conn.run("""
+            UPDATE courses c SET
+                name = v.name, price = v.price, sessions = v.sessions, frequency = v.frequency,
+                description = v.description, capacity = v.capacity, video_url = v.video_url
+            FROM unnest(CAST(:ids AS INTEGER[]), CAST(:names AS TEXT[]), CAST(:prices AS INTEGER[]),
+                        CAST(:sessions AS INTEGER[]), CAST(:frequencies AS TEXT[]), CAST(:descriptions AS TEXT[]),
+                        CAST(:capacities AS INTEGER[]), CAST(:video_urls AS TEXT[]))
+                AS v(id, name, price, sessions, frequency, description, capacity, video_url)
+            WHERE c.id = v.id
+        """, ids=ids, **self._course_columns([courses[i] for i in ids]))
+
+    def set_capacities(self, capacities):
+        """capacities: {id: capacity}"""
+        self.conn.run("""
+            UPDATE courses c SET capacity = v.capacity
+            FROM unnest(CAST(:ids AS INTEGER[]), CAST(:capacities AS INTEGER[])) AS v(id, capacity)
+            WHERE c.id = v.id
+        """, ids=list(capacities), capacities=list(capacities.values()))
+
+    def insert_courses(self, term, courses):
+        """Insert a list of course fields in order; returns {name: new id}"""
+        rows = self.conn.run("""
+            INSERT INTO courses (term, name, price, sessions, frequency, description, capacity, video_url)
+            SELECT :term, name, price, sessions, frequency, description, capacity, video_url
+            FROM unnest(CAST(:names AS TEXT[]), CAST(:prices AS INTEGER[]), CAST(:sessions AS INTEGER[]),
+                        CAST(:frequencies AS TEXT[]), CAST(:descriptions AS TEXT[]),
+                        CAST(:capacities AS INTEGER[]), CAST(:video_urls AS TEXT[]))
+                WITH ORDINALITY AS v(name, price, sessions, frequency, description, capacity, video_url, n)
+            ORDER BY n
+            RETURNING name, id
+        """, term=term, **self._course_columns(courses))
+        return dict(rows)
+
+    @staticmethod
+    def _course_columns(courses):
+        return {
+            'names': [c['name'] for c in courses],
+            'prices': [c['price'] for c in courses],
+            'sessions': [c['sessions'] for c in courses],
+            'frequencies': [c['frequency'] for c in courses],
+            'descriptions': [c['description'] for c in courses],
+            'capacities': [c['capacity'] for c in courses],
+            'video_urls': [c['video_url'] for c in courses]
+        }
+
+    # ---- Terms ----
+
+    def term_status(self, code):
+        """'open', 'archived' or None, row-locked until commit"""
+        rows = self.conn.run("SELECT archived_at FROM terms WHERE code = :code FOR UPDATE", code=code)
+        if not rows:
+            return None
+        return 'open' if rows[0][0] is None else 'archived'
+
+    def insert_term(self, code, name):
+        """Create the term and its partitions; False when the code is taken"""
+        created = self.conn.run(
+            "INSERT INTO terms (code, name) VALUES (:code, :name) ON CONFLICT (code) DO NOTHING RETURNING code",
+            code=code, name=name
+        )
+        if created:
+            ensure_term_partitions(self.conn, code)
+        return bool(created)
+
+    def copy_courses(self, source, code):
+        # Same catalog, fresh seats: enrolment is counted per term
+        return len(self.conn.run("""
+            INSERT INTO courses (term, name, price, sessions, frequency, description, capacity, video_url)
+            SELECT :code, name, price, sessions, frequency, description, capacity, video_url
+            FROM courses
+            WHERE term = :source
+            ORDER BY id
+            RETURNING id
+        """, code=code, source=source))
+
+    def active_term(self):
+        rows = self.conn.run("SELECT value FROM settings WHERE key = 'active_term'")
+        return rows[0][0] if rows else None
+
+    def activate_term(self, code):
+        ensure_term_partitions(self.conn, code)
+        self.conn.run(
+            "INSERT INTO settings (key, value) VALUES ('active_term', :code) ON CONFLICT (key) DO UPDATE SET value = :code",
+            code=code
+        )
+
+    def archive_term(self, code):
+        """(archived registrations, schema they now live in).
+
+        Live queries never see the term again and its rows stop costing
+        anything in the partitioned tables' plans. The tables themselves are
+        kept as-is under ARCHIVE_SCHEMA, minus their foreign keys. DETACH
+        briefly takes an exclusive lock on the parent tables, so run this
+        outside registration hours.
+        """
+        suffix = term_partition_suffix(code)
+        self.conn.run(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}")
+        # Line items go first: their foreign keys point at the registrations
+        # partition, which cannot be detached while anything references it.
+        for table in ('registration_courses', 'registration_supplies', 'registrations'):
+            partition = f"{table}_{suffix}"
+            self.conn.run(f"ALTER TABLE {table} DETACH PARTITION {partition}")
+            foreign_keys = self.conn.run(
+                "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:partition) AND contype = 'f'",
+                partition=partition
+            )
+            for (constraint,) in foreign_keys:
+                self.conn.run(f'ALTER TABLE {partition} DROP CONSTRAINT "{constraint}"')
+            self.conn.run(f"ALTER TABLE {partition} SET SCHEMA {ARCHIVE_SCHEMA}")
+
+        archived = self.conn.run(f"SELECT COUNT(*) FROM {ARCHIVE_SCHEMA}.registrations_{suffix}")[0][0]
+        self.conn.run("UPDATE terms SET archived_at = CURRENT_TIMESTAMP WHERE code = :code", code=code)
+        return archived, ARCHIVE_SCHEMA
+
+    def intake_result(self, receipt):
+        rows = self.conn.run("SELECT result FROM intake_receipts WHERE receipt = :receipt", receipt=receipt)
+        return rows[0][0] if rows else None
+
+    def record_intake(self, receipt, result):
+        self.conn.run(
+            "INSERT INTO intake_receipts (receipt, result) VALUES (:receipt, CAST(:result AS JSONB))",
+            receipt=receipt, result=json.dumps(result, ensure_ascii=False)
+        )
+
+class PostgresStore:
+    """Production storage: the pooled PostgreSQL connections from database.py"""
+
+    name = 'postgres'
+
+    def init_schema(self):
+        init_db()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        conn = get_db_connection()
+        try:
+            conn.run("BEGIN")
+            yield PostgresTransaction(conn)
+            conn.run("COMMIT")
+        except Exception:
+            conn.run("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def ping(self):
+        """One round trip to the primary on a pooled connection"""
+        conn = get_db_connection()
+        try:
+            conn.run("SELECT 1")
+        finally:
+            conn.close()
+
+    # ---- Reads ----
+
+    def active_term(self):
+        conn = get_db_connection(read_only=True)
+        try:
+            rows = conn.run("SELECT value FROM settings WHERE key = 'active_term'")
+            return rows[0][0] if rows else None
+        finally:
+            conn.close()
+
+    def settings(self, keys):
+        conn = get_db_connection(read_only=True)
+        try:
+            rows = conn.run("SELECT key, value FROM settings WHERE key = ANY(CAST(:keys AS TEXT[]))", keys=list(keys))
+            return dict(rows)
+        finally:
+            conn.close()
+
+    def latest_registrations(self, name, search_name, term):
+        """Latest registration of every student whose normalized name matches, exact name first"""
+        conn = get_db_connection(read_only=True)
+        try:
+            # Courses and supplies come back in the same round trip
+            results = conn.run("""
+                SELECT
+                    latest.id, latest.name, latest.class_name, latest.created_at, latest.birthday,
+                    COALESCE((
+                        SELECT json_agg(json_build_object('name', c.name, 'price', c.price) ORDER BY rc.id)
+                        FROM registration_courses rc
+                        JOIN courses c ON rc.course_id = c.id
+                        WHERE rc.registration_id = latest.id AND rc.term = :term
+                    ), '[]'::json),
+                    COALESCE((
+                        SELECT json_agg(json_build_object('name', sp.name, 'price', sp.price) ORDER BY rs.id)
+                        FROM registration_supplies rs
+                        JOIN supplies sp ON rs.supply_id = sp.id
+                        WHERE rs.registration_id = latest.id AND rs.term = :term
+                    ), '[]'::json),
+                    latest.exact
+                FROM (
+                    SELECT DISTINCT ON (s.id)
+                        r.id, s.name, r.class_name, r.created_at, s.birthday, s.name = :name AS exact
+                    FROM registrations r
+                    JOIN students s ON r.student_id = s.id
+                    WHERE s.search_name = :search_name AND r.term = :term
+                    ORDER BY s.id, r.created_at DESC
+                ) latest
+                ORDER BY latest.exact DESC, latest.created_at DESC
+            """, name=name, search_name=search_name, term=term)
+        finally:
+            conn.close()
+
+        return [{
+            'id': row[0],
+            'name': row[1],
+            'class_name': row[2],
+            'created_at': row[3],
+            'birthday': row[4],
+            'courses': row[5],
+            'supplies': row[6],
+            'exact': row[7]
+        } for row in results]
+
+    def course_availability(self, term):
+        """(name, capacity, used) for every course of the term"""
+        conn = get_db_connection(read_only=True)
+        try:
+            return conn.run("""
+                SELECT c.name, c.capacity, COUNT(rc.registration_id) as used
+                FROM courses c
+                LEFT JOIN registration_courses rc ON c.id = rc.course_id AND rc.term = c.term
+                WHERE c.term = :term
+                GROUP BY c.id, c.name, c.capacity
+            """, term=term)
+        finally:
+            conn.close()
+
+    def course_videos(self, term):
+        conn = get_db_connection(read_only=True)
+        try:
+            results = conn.run(
+                "SELECT name, video_url FROM courses WHERE term = :term AND video_url IS NOT NULL AND video_url != ''",
+                term=term
+            )
+            return {row[0]: row[1] for row in results}
+        finally:
+            conn.close()
+
+    def catalog(self, term):
+        """Courses with seat usage, supplies and registration times, from one snapshot"""
+        conn = get_db_connection(read_only=True)
+        try:
+            # A single statement sees a single snapshot, so seats, catalog and
+            # settings are always consistent with each other.
+            results = conn.run("""
+                SELECT
+                    (SELECT COALESCE(json_agg(json_build_object(
+                                'id', c.id,
+                                'name', c.name,
+                                'price', c.price,
+                                'sessions', c.sessions,
+                                'frequency', c.frequency,
+                                'description', c.description,
+                                'capacity', c.capacity,
+                                'video_url', c.video_url,
+                                'used', (SELECT COUNT(*) FROM registration_courses rc
+                                         WHERE rc.course_id = c.id AND rc.term = c.term)
+                            ) ORDER BY c.id), '[]'::json)
+                     FROM courses c
+                     WHERE c.term = :term),
+                    (SELECT COALESCE(json_agg(json_build_object(
+                                'id', s.id,
+                                'name', s.name,
+                                'price', s.price
+                            ) ORDER BY s.id), '[]'::json)
+                     FROM supplies s),
+                    (SELECT COALESCE(json_object_agg(key, value), '{}'::json)
+                     FROM settings
+                     WHERE key IN ('registration_start', 'registration_end'))
+            """, term=term)
+        finally:
+            conn.close()
+        course_rows, supply_rows, settings = results[0]
+        return course_rows, supply_rows, settings
+
+    @staticmethod
+    def _sync_cursor(conn):
+        """Oldest transaction still in flight; everything older is visible to the next query"""
+        xmin = conn.run("SELECT pg_snapshot_xmin(pg_current_snapshot())::text")[0][0]
+        return f"{xmin}:{int(time.time())}"
+
+    # One row per registration with its line-item counts; {where} is a trusted fragment
+    REGISTRATION_ROWS_SQL = """
+        SELECT
+            r.id,
+            s.name as student_name,
+            r.class_name,
+            r.created_at,
+            r.updated_at,
+            COUNT(DISTINCT rc.course_id) as course_count,
+            COUNT(DISTINCT rs.supply_id) as supply_count,
+            r.is_paid,
+            s.birthday
+        FROM registrations r
+        JOIN students s ON r.student_id = s.id
+        LEFT JOIN registration_courses rc ON r.id = rc.registration_id AND rc.term = r.term
+        LEFT JOIN registration_supplies rs ON r.id = rs.registration_id AND rs.term = r.term
+        WHERE r.term = :term AND {where}
+        GROUP BY r.id, s.name, s.birthday, r.class_name, r.created_at, r.updated_at, r.is_paid
+        ORDER BY r.created_at DESC
+    """
+
+    @staticmethod
+    def _registration_dict(row):
+        return {
+            'id': row[0],
+            'student_name': row[1],
+            'class_name': row[2],
+            'created_at': row[3],
+            'updated_at': row[4],
+            'course_count': row[5],
+            'supply_count': row[6],
+            'is_paid': row[7],
+            'birthday': row[8]
+        }
+
+    @staticmethod
+    def _registration_rows(conn, term, where='TRUE', **params):
+        results = conn.run(PostgresStore.REGISTRATION_ROWS_SQL.format(where=where), term=term, **params)
+        return [PostgresStore._registration_dict(row) for row in results]
+
+    @staticmethod
+    def _dashboard_statistics(conn, term):
+        return tuple(conn.run("""
+            SELECT
+                COUNT(DISTINCT r.id) as total_registrations,
+                COUNT(DISTINCT s.id) as total_students,
+                COUNT(DISTINCT rc.id) as total_course_enrollments,
+                COUNT(DISTINCT rs.id) as total_supply_orders
+            FROM registrations r
+            JOIN students s ON r.student_id = s.id
+            LEFT JOIN registration_courses rc ON r.id = rc.registration_id AND rc.term = r.term
+            LEFT JOIN registration_supplies rs ON r.id = rs.registration_id AND rs.term = r.term
+            WHERE r.term = :term
+        """, term=term)[0])
+
+    def dashboard(self, term):
+        """(sync cursor, registration rows, statistics) for the admin dashboard"""
+        conn = get_db_connection(read_only=True)
+        try:
+            # Taken before reading so nothing committed after it can be missed
+            cursor = self._sync_cursor(conn)
+            registrations = self._registration_rows(conn, term)
+            return cursor, registrations, self._dashboard_statistics(conn, term)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _cursor_rows(conn, sql, convert, **params):
+        """(row iterator, release) over a server-side cursor in conn's open transaction.
+
+        Rows are fetched STREAM_FETCH_SIZE at a time; the connection stays
+        checked out until release() is called.
+        """
+        conn.run("DECLARE stream_rows NO SCROLL CURSOR FOR " + sql, **params)
+
+        def rows():
+            while True:
+                batch = conn.run(f"FETCH {Config.STREAM_FETCH_SIZE} FROM stream_rows")
+                if not batch:
+                    return
+                for row in batch:
+                    yield convert(row)
+
+        released = []
+
+        def release():
+            # Response wrappers may close the stream more than once
+            if not released:
+                released.append(True)
+                # Returning the connection to the pool rolls the transaction back
+                conn.close()
+
+        return rows(), release
+
+    def dashboard_stream(self, term):
+        """(sync cursor, statistics, row iterator, release) without loading every row.
+
+        Statistics and rows are read in one REPEATABLE READ snapshot.
+        """
+        conn = get_db_connection(read_only=True)
+        try:
+            conn.run("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            cursor = self._sync_cursor(conn)
+            statistics = self._dashboard_statistics(conn, term)
+            rows, release = self._cursor_rows(conn, self.REGISTRATION_ROWS_SQL.format(where='TRUE'),
+                                              self._registration_dict, term=term)
+        except Exception:
+            conn.close()
+            raise
+        return cursor, statistics, rows, release
+
+    def roster_stream(self, term):
+        """(row iterator, release): every course of the term with its students, grouped by course.
+
+        Courses nobody registered for appear once with student fields None.
+        """
+        conn = get_db_connection(read_only=True)
+        try:
+            conn.run("BEGIN READ ONLY")
+            rows, release = self._cursor_rows(conn, """
+                SELECT c.id, c.name, s.name, s.birthday, r.class_name, r.is_paid
+                FROM courses c
+                LEFT JOIN registration_courses rc ON rc.course_id = c.id AND rc.term = c.term
+                LEFT JOIN registrations r ON r.id = rc.registration_id AND r.term = rc.term
+                LEFT JOIN students s ON s.id = r.student_id
+                WHERE c.term = :term
+                ORDER BY c.id, r.class_name, s.name
+            """, lambda row: {
+                'course_id': row[0],
+                'course_name': row[1],
+                'student_name': row[2],
+                'birthday': row[3],
+                'class_name': row[4],
+                'is_paid': row[5]
+            }, term=term)
+        except Exception:
+            conn.close()
+            raise
+        return rows, release
+
+    def registration_changes(self, term, since_xid):
+        """(cursor, changed rows, deleted IDs) since a transaction ID taken by an earlier sync"""
+        conn = get_db_connection(read_only=True)
+        try:
+            cursor = self._sync_cursor(conn)
+            registrations = self._registration_rows(
+                conn, term, "r.change_xid >= CAST(:since AS xid8)", since=str(since_xid))
+            deleted = conn.run("""
+                SELECT registration_id FROM registration_tombstones
+                WHERE (term = :term OR term IS NULL) AND change_xid >= CAST(:since AS xid8)
+            """, term=term, since=str(since_xid))
+            return cursor, registrations, [row[0] for row in deleted]
+        finally:
+            conn.close()
+
+    def courses_stats(self, term):
+        conn = get_db_connection(read_only=True)
+        try:
+            results = conn.run("""
+                SELECT c.id, c.name, c.price, c.sessions, c.frequency, c.capacity, c.description, c.video_url,
+                       COUNT(rc.registration_id) as used
+                FROM courses c
+                LEFT JOIN registration_courses rc ON c.id = rc.course_id AND rc.term = c.term
+                WHERE c.term = :term
+                GROUP BY c.id, c.name, c.price, c.sessions, c.frequency, c.capacity, c.description, c.video_url
+                ORDER BY c.id
+            """, term=term)
+            return [{
+                'id': row[0],
+                'name': row[1],
+                'price': row[2],
+                'sessions': row[3],
+                'frequency': row[4],
+                'capacity': row[5],
+                'description': row[6],
+                'video_url': row[7],
+                'used': row[8]
+            } for row in results]
+        finally:
+            conn.close()
+
+    def registration_details(self, reg_ids, term):
+        conn = get_db_connection(read_only=True)
+        try:
+            results = conn.run("""
+                SELECT
+                    r.id, s.name, r.class_name, r.created_at, r.updated_at, s.birthday, r.is_paid,
+                    COALESCE((
+                        SELECT json_agg(json_build_object('name', c.name, 'price', c.price) ORDER BY rc.id)
+                        FROM registration_courses rc
+                        JOIN courses c ON rc.course_id = c.id
+                        WHERE rc.registration_id = r.id AND rc.term = r.term
+                    ), '[]'::json),
+                    COALESCE((
+                        SELECT json_agg(json_build_object('name', sp.name, 'price', sp.price) ORDER BY rs.id)
+                        FROM registration_supplies rs
+                        JOIN supplies sp ON rs.supply_id = sp.id
+                        WHERE rs.registration_id = r.id AND rs.term = r.term
+                    ), '[]'::json)
+                FROM registrations r
+                JOIN students s ON r.student_id = s.id
+                WHERE r.term = :term AND r.id = ANY(CAST(:ids AS INTEGER[]))
+            """, term=term, ids=list(reg_ids))
+        finally:
+            conn.close()
+        return [{
+            'id': row[0],
+            'student_name': row[1],
+            'class_name': row[2],
+            'created_at': row[3],
+            'updated_at': row[4],
+            'birthday': row[5],
+            'is_paid': row[6],
+            'courses': row[7],
+            'supplies': row[8]
+        } for row in results]
+
+    def search_students(self, search_name, grams, term, min_similarity, limit):
+        """Students ranked exact, prefix, then fuzzy by trigram similarity, with their latest registration"""
+        # Escape LIKE wildcards so they match literally in the prefix test
+        prefix = search_name.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        conn = get_db_connection(read_only=True)
+        try:
+            # Candidates come from the trigram index; every exact or prefix match
+            # shares the leading padded trigram, so it is always among them.
+            results = conn.run("""
+                SELECT id, name, birthday, registration_id, class_name, tier, similarity
+                FROM (
+                    SELECT
+                        s.id, s.name, s.birthday, lr.id AS registration_id, lr.class_name,
+                        CASE
+                            WHEN s.search_name = :search_name THEN 0
+                            WHEN s.search_name LIKE :prefix THEN 1
+                            ELSE 2
+                        END AS tier,
+                        m.shared::float / (:gram_count + char_length(s.search_name) + 1 - m.shared) AS similarity
+                    FROM (
+                        SELECT student_id, COUNT(*) AS shared
+                        FROM student_name_trigrams
+                        WHERE trigram = ANY(CAST(:grams AS TEXT[]))
+                        GROUP BY student_id
+                    ) m
+                    JOIN students s ON s.id = m.student_id
+                    LEFT JOIN LATERAL (
+                        SELECT r.id, r.class_name
+                        FROM registrations r
+                        WHERE r.student_id = s.id AND r.term = :term
+                        ORDER BY r.created_at DESC
+                        LIMIT 1
+                    ) lr ON TRUE
+                ) candidates
+                WHERE tier < 2 OR similarity >= :min_similarity
+                ORDER BY tier, similarity DESC, name
+                LIMIT :limit
+            """, search_name=search_name,
+                 prefix=prefix,
+                 grams=grams, gram_count=len(grams),
+                 min_similarity=min_similarity, limit=limit,
+                 term=term)
+        finally:
+            conn.close()
+        columns = ('student_id', 'student_name', 'birthday', 'registration_id', 'class_name', 'tier', 'similarity')
+        return [dict(zip(columns, row)) for row in results]
+
+    def finance_totals(self, term):
+        """(item_type, item_id, name, price, enrolled, paid) per course, supply and the registrations themselves"""
+        conn = get_db_connection(read_only=True)
+        try:
+            # One counter row per course/supply plus the deltas not folded in yet,
+            # so this costs about the same however many registrations the term
+            # has. Revenue uses current catalog prices, matching the detail views.
+            return conn.run("""
+                SELECT t.item_type, t.item_id, COALESCE(c.name, sp.name), COALESCE(c.price, sp.price),
+                       t.enrolled, t.paid
+                FROM (
+                    SELECT item_type, item_id, SUM(enrolled)::int AS enrolled, SUM(paid)::int AS paid
+                    FROM (
+                        SELECT item_type, item_id, enrolled, paid FROM finance_item_totals WHERE term = :term
+                        UNION ALL
+                        SELECT item_type, item_id, enrolled, paid FROM finance_item_deltas WHERE term = :term
+                    ) counters
+                    GROUP BY item_type, item_id
+                ) t
+                LEFT JOIN courses c ON t.item_type = 'course' AND c.id = t.item_id
+                LEFT JOIN supplies sp ON t.item_type = 'supply' AND sp.id = t.item_id
+                ORDER BY t.item_type, t.item_id
+            """, term=term)
+        finally:
+            conn.close()
+
+    def list_terms(self):
+        """(code, name, created_at, archived_at, active) in creation order"""
+        conn = get_db_connection(read_only=True)
+        try:
+            return conn.run("""
+                SELECT t.code, t.name, t.created_at, t.archived_at, t.code = s.value
+                FROM terms t
+                LEFT JOIN settings s ON s.key = 'active_term'
+                ORDER BY t.created_at, t.code
+            """)
+        finally:
+            conn.close()
+
+    # ---- Single-statement writes ----
+
+    @staticmethod
+    def _registration_criteria(term, criteria):
+        """WHERE clause and parameters for AdminService's bulk selection criteria"""
+        conditions = ["r.term = :term"]
+        params = {'term': term}
+        if 'ids' in criteria:
+            conditions.append("r.id = ANY(CAST(:ids AS INTEGER[]))")
+            params['ids'] = criteria['ids']
+        if 'class_name' in criteria:
+            conditions.append("r.class_name = :class_name")
+            params['class_name'] = criteria['class_name']
+        if 'is_paid' in criteria:
+            conditions.append("r.is_paid = :filter_paid")
+            params['filter_paid'] = criteria['is_paid']
+        if 'course_id' in criteria:
+            conditions.append("""EXISTS (
+                SELECT 1 FROM registration_courses rc
+                WHERE rc.registration_id = r.id AND rc.term = r.term AND rc.course_id = :course_id
+            )""")
+            params['course_id'] = criteria['course_id']
+        return ' AND '.join(conditions), params
+
+    def bulk_set_paid(self, term, criteria, paid, now):
+        """(id, is_paid, updated_at) of the selected registrations that changed"""
+        where, params = self._registration_criteria(term, criteria)
+        conn = get_db_connection()
+        try:
+            # Rows already in the requested state are left alone, so updated_at
+            # only moves for registrations that actually changed.
+            return conn.run(f"""
+                UPDATE registrations r
+                SET is_paid = :paid, updated_at = :now
+                WHERE {where} AND r.is_paid IS DISTINCT FROM :paid
+                RETURNING r.id, r.is_paid, r.updated_at
+            """, paid=paid, now=now, **params)
+        finally:
+            conn.close()
+
+    def bulk_delete_registrations(self, term, criteria):
+        where, params = self._registration_criteria(term, criteria)
+        conn = get_db_connection()
+        try:
+            results = conn.run(f"DELETE FROM registrations r WHERE {where} RETURNING r.id", **params)
+            return [row[0] for row in results]
+        finally:
+            conn.close()
+
+    def delete_registration(self, reg_id):
+        conn = get_db_connection()
+        try:
+            conn.run("DELETE FROM registrations WHERE id = :id", id=reg_id)
+        finally:
+            conn.close()
+
+    def set_paid(self, reg_id, paid, now):
+        conn = get_db_connection()
+        try:
+            conn.run("UPDATE registrations SET is_paid = :paid, updated_at = :now WHERE id = :id",
+                     paid=paid, now=now, id=reg_id)
+        finally:
+            conn.close()
+
+    def fold_finance_deltas(self):
+        conn = get_db_connection()
+        try:
+            return fold_finance_deltas(conn)
+        finally:
+            conn.close()
+
+    def prune_intake_receipts(self, days):
+        conn = get_db_connection()
+        try:
+            conn.run("DELETE FROM intake_receipts WHERE applied_at < now() - make_interval(days => :days)",
+                     days=days)
+        finally:
+            conn.close()
+
+    def save_settings(self, values):
+        conn = get_db_connection()
+        try:
+            for key, value in values.items():
+                conn.run(
+                    "INSERT INTO settings (key, value) VALUES (:key, :value) ON CONFLICT (key) DO UPDATE SET value = :value",
+                    key=key, value=value
+                )
+        finally:
+            conn.close()
+
+    def course_term(self, course_id):
+        conn = get_db_connection()
+        try:
+            rows = conn.run("SELECT term FROM courses WHERE id = :id", id=course_id)
+            return rows[0][0] if rows else None
+        finally:
+            conn.close()
+
+    def course_name_taken(self, term, name, exclude_id=None):
+        conn = get_db_connection()
+        try:
+            return bool(conn.run(
+                "SELECT id FROM courses WHERE term = :term AND name = :name AND id IS DISTINCT FROM :exclude_id",
+                term=term, name=name, exclude_id=exclude_id
+            ))
+        finally:
+            conn.close()
+
+    def course_enrolment(self, course_id):
+        conn = get_db_connection()
+        try:
+            return conn.run(
+                "SELECT COUNT(*) FROM registration_courses WHERE course_id = :id",
+                id=course_id
+            )[0][0]
+        finally:
+            conn.close()
+
+    def insert_course(self, term, course):
+        conn = get_db_connection()
+        try:
+            return conn.run(
+                """INSERT INTO courses (term, name, price, sessions, frequency, description, capacity, video_url)
+                   VALUES (:term, :name, :price, :sessions, :frequency, :description, :capacity, :video_url)
+                   RETURNING id""",
+                term=term, **course
+            )[0][0]
+        finally:
+            conn.close()
+
+    def update_course(self, course_id, course):
+        conn = get_db_connection()
+        try:
+            conn.run(
+                """UPDATE courses SET
+                   name = :name, price = :price, sessions = :sessions,
+                   frequency = :frequency, description = :description, capacity = :capacity,
+                   video_url = :video_url
+                   WHERE id = :id""",
+                id=course_id, **course
+            )
+        finally:
+            conn.close()
+
+    def set_course_capacity(self, course_id, capacity):
+        conn = get_db_connection()
+        try:
+            conn.run("UPDATE courses SET capacity = :capacity WHERE id = :id", capacity=capacity, id=course_id)
+        finally:
+            conn.close()
+
+    def delete_course(self, course_id):
+        conn = get_db_connection()
+        try:
+            conn.run("DELETE FROM courses WHERE id = :id", id=course_id)
+        finally:
+            conn.close()
@@ -0,0 +1,750 @@
+import contextlib
+import json
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+from config import Config
+from database import DEFAULT_COURSES, DEFAULT_SUPPLIES, DEFAULT_SETTINGS, SCHEMA_VERSION
+from services.name_index import normalize_name, name_trigrams
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter('TIMESTAMP', lambda raw: datetime.fromisoformat(raw.decode()) if raw else None)
+sqlite3.register_converter('DATE', lambda raw: date.fromisoformat(raw.decode()[:10]) if raw else None)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS students (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE,
+    search_name TEXT,
+    birthday DATE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_students_search_name ON students (search_name);
+
+CREATE TABLE IF NOT EXISTS courses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    term TEXT NOT NULL,
+    name TEXT NOT NULL,
+    price INTEGER NOT NULL,
+    sessions INTEGER,
+    frequency TEXT,
+    description TEXT,
+    capacity INTEGER DEFAULT 30,
+    video_url TEXT,
+    UNIQUE (term, name)
+);
+
+CREATE TABLE IF NOT EXISTS supplies (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE,
+    price INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS registrations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    term TEXT NOT NULL,
+    student_id INTEGER REFERENCES students(id) ON DELETE CASCADE,
+    class_name TEXT,
+    email TEXT,
+    is_paid INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    change_seq INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_registrations_term_student ON registrations (term, student_id);
+
+CREATE TABLE IF NOT EXISTS registration_courses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    term TEXT NOT NULL,
+    registration_id INTEGER NOT NULL REFERENCES registrations(id) ON DELETE CASCADE,
+    course_id INTEGER REFERENCES courses(id) ON DELETE CASCADE,
+    UNIQUE (registration_id, course_id)
+);
+CREATE INDEX IF NOT EXISTS idx_registration_courses_course ON registration_courses (term, course_id);
+
+CREATE TABLE IF NOT EXISTS registration_supplies (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    term TEXT NOT NULL,
+    registration_id INTEGER NOT NULL REFERENCES registrations(id) ON DELETE CASCADE,
+    supply_id INTEGER REFERENCES supplies(id) ON DELETE CASCADE,
+    UNIQUE (registration_id, supply_id)
+);
+
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS terms (
+    code TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    archived_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Stands in for PostgreSQL transaction IDs in changes-since sync: every
+-- registration write takes the next number
+CREATE TABLE IF NOT EXISTS change_counter (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    seq INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO change_counter (id, seq) VALUES (1, 0);
+
+CREATE TABLE IF NOT EXISTS registration_tombstones (
+    registration_id INTEGER PRIMARY KEY,
+    term TEXT,
+    change_seq INTEGER NOT NULL,
+    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_registration_tombstones_term_seq ON registration_tombstones (term, change_seq);
+
+CREATE TABLE IF NOT EXISTS intake_receipts (
+    receipt TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+'''
+
+# Same stamping and tombstones as init_change_tracking; {retention} is an int
+CHANGE_TRACKING = '''
+DROP TRIGGER IF EXISTS registrations_stamp_insert;
+CREATE TRIGGER registrations_stamp_insert AFTER INSERT ON registrations
+BEGIN
+    UPDATE change_counter SET seq = seq + 1;
+    UPDATE registrations SET change_seq = (SELECT seq FROM change_counter) WHERE id = NEW.id;
+END;
+
+DROP TRIGGER IF EXISTS registrations_stamp_update;
+CREATE TRIGGER registrations_stamp_update
+AFTER UPDATE OF term, student_id, class_name, email, is_paid, created_at, updated_at ON registrations
+BEGIN
+    UPDATE change_counter SET seq = seq + 1;
+    UPDATE registrations SET change_seq = (SELECT seq FROM change_counter) WHERE id = NEW.id;
+END;
+
+DROP TRIGGER IF EXISTS registrations_tombstone;
+CREATE TRIGGER registrations_tombstone AFTER DELETE ON registrations
+BEGIN
+    UPDATE change_counter SET seq = seq + 1;
+    DELETE FROM registration_tombstones WHERE deleted_at < datetime('now', '-{retention} days');
+    INSERT OR REPLACE INTO registration_tombstones (registration_id, term, change_seq, deleted_at)
+    VALUES (OLD.id, OLD.term, (SELECT seq FROM change_counter), CURRENT_TIMESTAMP);
+END;
+'''
+
+# One row per registration with its line-item counts; {where} is a trusted fragment
+REGISTRATION_ROWS_SQL = '''
+    SELECT r.id, s.name, r.class_name, r.created_at, r.updated_at,
+           COUNT(DISTINCT rc.course_id), COUNT(DISTINCT rs.supply_id), r.is_paid, s.birthday
+    FROM registrations r
+    JOIN students s ON r.student_id = s.id
+    LEFT JOIN registration_courses rc ON r.id = rc.registration_id
+    LEFT JOIN registration_supplies rs ON r.id = rs.registration_id
+    WHERE r.term = ? AND {where}
+    GROUP BY r.id
+    ORDER BY r.created_at DESC
+'''
+
+def _registration_dict(row):
+    return {
+        'id': row[0],
+        'student_name': row[1],
+        'class_name': row[2],
+        'created_at': row[3],
+        'updated_at': row[4],
+        'course_count': row[5],
+        'supply_count': row[6],
+        'is_paid': bool(row[7]),
+        'birthday': row[8]
+    }
+
+def _placeholders(values):
+    return '(' + ', '.join('?' for _ in values) + ')'
+
+def _items(conn, table, item_table, reg_id):
+    item_column = 'course_id' if item_table == 'courses' else 'supply_id'
+    rows = conn.execute(f'''
+        SELECT i.name, i.price FROM {table} j JOIN {item_table} i ON i.id = j.{item_column}
+        WHERE j.registration_id = ? ORDER BY j.id
+    ''', (reg_id,)).fetchall()
+    return [{'name': name, 'price': price} for name, price in rows]
+
+class SQLiteTransaction:
+    """Same operations as PostgresTransaction; the store's write lock stands in for row locks"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def _one(self, sql, params):
+        row = self.conn.execute(sql, params).fetchone()
+        return row[0] if row else None
+
+    def student_id_by_name(self, name):
+        return self._one("SELECT id FROM students WHERE name = ?", (name,))
+
+    def create_student(self, name, birthday):
+        return self.conn.execute(
+            "INSERT INTO students (name, search_name, birthday) VALUES (?, ?, ?)",
+            (name, normalize_name(name), birthday or None)
+        ).lastrowid
+
+    def set_student_birthday(self, student_id, birthday):
+        self.conn.execute("UPDATE students SET birthday = ? WHERE id = ?", (birthday, student_id))
+
+    def registration_student(self, reg_id, term):
+        return self._one("SELECT student_id FROM registrations WHERE id = ? AND term = ?", (reg_id, term))
+
+    def create_registration(self, term, student_id, class_name, email, now):
+        return self.conn.execute(
+            "INSERT INTO registrations (term, student_id, class_name, email, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (term, student_id, class_name, email, now, now)
+        ).lastrowid
+
+    def update_registration(self, reg_id, term, class_name, email, now):
+        self.conn.execute(
+            "UPDATE registrations SET class_name = ?, email = COALESCE(?, email), updated_at = ? WHERE id = ? AND term = ?",
+            (class_name, email, now, reg_id, term)
+        )
+
+    def registration_basket(self, reg_id, term):
+        courses = dict(self.conn.execute('''
+            SELECT c.name, c.id FROM registration_courses rc JOIN courses c ON c.id = rc.course_id
+            WHERE rc.registration_id = ? AND rc.term = ?
+        ''', (reg_id, term)).fetchall())
+        supplies = dict(self.conn.execute('''
+            SELECT sp.name, sp.id FROM registration_supplies rs JOIN supplies sp ON sp.id = rs.supply_id
+            WHERE rs.registration_id = ? AND rs.term = ?
+        ''', (reg_id, term)).fetchall())
+        return courses, supplies
+
+    def remove_courses(self, reg_id, term, course_ids):
+        course_ids = list(course_ids)
+        self.conn.execute(
+            f"DELETE FROM registration_courses WHERE registration_id = ? AND term = ? AND course_id IN {_placeholders(course_ids)}",
+            (reg_id, term, *course_ids)
+        )
+
+    def remove_supplies(self, reg_id, term, supply_ids):
+        supply_ids = list(supply_ids)
+        self.conn.execute(
+            f"DELETE FROM registration_supplies WHERE registration_id = ? AND term = ? AND supply_id IN {_placeholders(supply_ids)}",
+            (reg_id, term, *supply_ids)
+        )
+
+    def lock_courses(self, term, names):
+        names = list(names)
+        rows = self.conn.execute(
+            f"SELECT name, id, capacity FROM courses WHERE term = ? AND name IN {_placeholders(names)} ORDER BY id",
+            (term, *names)
+        ).fetchall()
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    def course_usage(self, term, course_ids):
+        course_ids = list(course_ids)
+        return dict(self.conn.execute(
+            f"SELECT course_id, COUNT(*) FROM registration_courses WHERE term = ? AND course_id IN {_placeholders(course_ids)} GROUP BY course_id",
+            (term, *course_ids)
+        ).fetchall())
+
+    def add_course(self, term, reg_id, course_id):
+        self.conn.execute(
+            "INSERT INTO registration_courses (term, registration_id, course_id) VALUES (?, ?, ?)",
+            (term, reg_id, course_id)
+        )
+
+    def supply_ids(self, names):
+        names = list(names)
+        rows = self.conn.execute(
+            f"SELECT id FROM supplies WHERE name IN {_placeholders(names)} ORDER BY id", names
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def add_supply(self, term, reg_id, supply_id):
+        self.conn.execute(
+            "INSERT INTO registration_supplies (term, registration_id, supply_id) VALUES (?, ?, ?)",
+            (term, reg_id, supply_id)
+        )
+
+    def enqueue(self, kind, payload):
+        # Recorded only; the job worker runs against PostgreSQL
+        self.conn.execute("INSERT INTO jobs (kind, payload) VALUES (?, ?)", (kind, json.dumps(payload)))
+
+    # ---- Catalog batches ----
+
+    def lock_catalog(self, term, course_ids):
+        ids = list(course_ids)
+        locked = self.conn.execute(
+            f"SELECT id, term FROM courses WHERE id IN {_placeholders(ids)}", ids
+        ).fetchall() if ids else []
+        names = self.conn.execute("SELECT name, id FROM courses WHERE term = ?", (term,)).fetchall()
+        return dict(locked), dict(names)
+
+    def course_enrolments(self, course_ids):
+        ids = list(course_ids)
+        if not ids:
+            return {}
+        return dict(self.conn.execute(
+            f"SELECT course_id, COUNT(*) FROM registration_courses WHERE course_id IN {_placeholders(ids)} GROUP BY course_id",
+            ids
+        ).fetchall())
+
+    def delete_courses(self, course_ids):
+        self.conn.executemany("DELETE FROM courses WHERE id = ?", [(i,) for i in course_ids])
+
+    def update_courses(self, courses):
+        self.conn.executemany('''
+            UPDATE courses SET
+            name = :name, price = :price, sessions = :sessions,
+            frequency = :frequency, description = :description, capacity = :capacity,
+            video_url = :video_url
+            WHERE id = :id
+        ''', [{'id': course_id, **fields} for course_id, fields in courses.items()])
+
+    def set_capacities(self, capacities):
+        self.conn.executemany("UPDATE courses SET capacity = ? WHERE id = ?",
+                              [(capacity, course_id) for course_id, capacity in capacities.items()])
+
+    def insert_courses(self, term, courses):
+        created = {}
+        for course in courses:
+            created[course['name']] = self.conn.execute('''
+                INSERT INTO courses (term, name, price, sessions, frequency, description, capacity, video_url)
+                VALUES (:term, :name, :price, :sessions, :frequency, :description, :capacity, :video_url)
+            ''', {'term': term, **course}).lastrowid
+        return created
+
+    # ---- Terms ----
+
+    def term_status(self, code):
+        row = self.conn.execute("SELECT archived_at FROM terms WHERE code = ?", (code,)).fetchone()
+        if row is None:
+            return None
+        return 'open' if row[0] is None else 'archived'
+
+    def insert_term(self, code, name):
+        return self.conn.execute("INSERT OR IGNORE INTO terms (code, name) VALUES (?, ?)", (code, name)).rowcount > 0
+
+    def copy_courses(self, source, code):
+        return self.conn.execute('''
+            INSERT INTO courses (term, name, price, sessions, frequency, description, capacity, video_url)
+            SELECT ?, name, price, sessions, frequency, description, capacity, video_url
+            FROM courses WHERE term = ? ORDER BY id
+        ''', (code, source)).rowcount
+
+    def active_term(self):
+        return self._one("SELECT value FROM settings WHERE key = 'active_term'", ())
+
+    def activate_term(self, code):
+        self.conn.execute(
+            "INSERT INTO settings (key, value) VALUES ('active_term', ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (code,)
+        )
+
+    def archive_term(self, code):
+        # No partitions to detach: the rows stay where they are, and every
+        # query is scoped to a term, so marking it archived is enough
+        archived = self._one("SELECT COUNT(*) FROM registrations WHERE term = ?", (code,))
+        self.conn.execute("UPDATE terms SET archived_at = CURRENT_TIMESTAMP WHERE code = ?", (code,))
+        return archived, None
+
+    def intake_result(self, receipt):
+        result = self._one("SELECT result FROM intake_receipts WHERE receipt = ?", (receipt,))
+        return json.loads(result) if result is not None else None
+
+    def record_intake(self, receipt, result):
+        self.conn.execute("INSERT INTO intake_receipts (receipt, result) VALUES (?, ?)",
+                          (receipt, json.dumps(result, ensure_ascii=False)))
+
+class SQLiteStore:
+    """In-process storage for tests and benchmarks; ':memory:' or a file path.
+
+    Implements everything PostgresStore does, with plain queries where
+    PostgreSQL has something better: finance totals are aggregated on the
+    fly rather than kept by triggers, student search scores every name
+    rather than using a trigram index, and archiving a term only marks it,
+    since there are no partitions to detach. Confirmation mails are queued
+    but never sent; the job worker runs on PostgreSQL only.
+
+    One connection serves every thread, and a lock serializes access,
+    which is also how SQLite serializes writers.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path=':memory:'):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None,
+                                     detect_types=sqlite3.PARSE_DECLTYPES)
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        self._lock = threading.RLock()
+
+    def init_schema(self):
+        with self._lock:
+            # Migration: files created before changes-since sync; CREATE TABLE
+            # IF NOT EXISTS leaves their registrations table as it was
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(registrations)")]
+            if columns and 'change_seq' not in columns:
+                self._conn.execute("ALTER TABLE registrations ADD COLUMN change_seq INTEGER")
+            self._conn.executescript(SCHEMA)
+            self._conn.executescript(CHANGE_TRACKING.format(retention=int(Config.TOMBSTONE_RETENTION_DAYS)))
+            for name, price, sessions, frequency, description in DEFAULT_COURSES:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO courses (term, name, price, sessions, frequency, description) VALUES (?, ?, ?, ?, ?, ?)",
+                    (Config.DEFAULT_TERM, name, price, sessions, frequency, description)
+                )
+            self._conn.executemany("INSERT OR IGNORE INTO supplies (name, price) VALUES (?, ?)", DEFAULT_SUPPLIES)
+            self._conn.executemany("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)",
+                                   DEFAULT_SETTINGS + [('active_term', Config.DEFAULT_TERM)])
+            self._conn.execute("INSERT OR IGNORE INTO terms (code, name) VALUES (?, ?)",
+                               (Config.DEFAULT_TERM, Config.DEFAULT_TERM))
+            self._conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('schema_version', ?)",
+                               (str(SCHEMA_VERSION),))
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, like the row locks the
+            # PostgreSQL flow takes before checking capacity
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield SQLiteTransaction(self._conn)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _write(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def ping(self):
+        self._query("SELECT 1")
+
+    # ---- Reads ----
+
+    def active_term(self):
+        rows = self._query("SELECT value FROM settings WHERE key = 'active_term'")
+        return rows[0][0] if rows else None
+
+    def settings(self, keys):
+        keys = list(keys)
+        return dict(self._query(f"SELECT key, value FROM settings WHERE key IN {_placeholders(keys)}", keys))
+
+    def latest_registrations(self, name, search_name, term):
+        with self._lock:
+            rows = self._conn.execute('''
+                SELECT r.id, s.name, r.class_name, r.created_at, s.birthday, s.name = ?
+                FROM students s
+                JOIN registrations r ON r.id = (
+                    SELECT id FROM registrations
+                    WHERE student_id = s.id AND term = ?
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT 1
+                )
+                WHERE s.search_name = ?
+                ORDER BY 6 DESC, r.created_at DESC, r.id DESC
+            ''', (name, term, search_name)).fetchall()
+            return [{
+                'id': row[0],
+                'name': row[1],
+                'class_name': row[2],
+                'created_at': row[3],
+                'birthday': row[4],
+                'courses': _items(self._conn, 'registration_courses', 'courses', row[0]),
+                'supplies': _items(self._conn, 'registration_supplies', 'supplies', row[0]),
+                'exact': bool(row[5])
+            } for row in rows]
+
+    def course_availability(self, term):
+        return self._query('''
+            SELECT c.name, c.capacity, COUNT(rc.registration_id)
+            FROM courses c
+            LEFT JOIN registration_courses rc ON c.id = rc.course_id AND rc.term = c.term
+            WHERE c.term = ?
+            GROUP BY c.id, c.name, c.capacity
+        ''', (term,))
+
+    def course_videos(self, term):
+        return dict(self._query(
+            "SELECT name, video_url FROM courses WHERE term = ? AND video_url IS NOT NULL AND video_url != ''",
+            (term,)
+        ))
+
+    def catalog(self, term):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                courses = self._conn.execute('''
+                    SELECT c.id, c.name, c.price, c.sessions, c.frequency, c.description, c.capacity, c.video_url,
+                           (SELECT COUNT(*) FROM registration_courses rc WHERE rc.course_id = c.id AND rc.term = c.term)
+                    FROM courses c WHERE c.term = ? ORDER BY c.id
+                ''', (term,)).fetchall()
+                supplies = self._conn.execute("SELECT id, name, price FROM supplies ORDER BY id").fetchall()
+                settings = dict(self._conn.execute(
+                    "SELECT key, value FROM settings WHERE key IN ('registration_start', 'registration_end')"
+                ).fetchall())
+            finally:
+                self._conn.execute("COMMIT")
+        columns = ('id', 'name', 'price', 'sessions', 'frequency', 'description', 'capacity', 'video_url', 'used')
+        return ([dict(zip(columns, row)) for row in courses],
+                [{'id': row[0], 'name': row[1], 'price': row[2]} for row in supplies],
+                settings)
+
+    def _sync_cursor(self):
+        """Cursor for the next sync: writes are serialized, so every later one numbers above it"""
+        seq = self._conn.execute("SELECT seq FROM change_counter").fetchone()[0]
+        return f"{seq + 1}:{int(time.time())}"
+
+    def _registration_rows(self, term, where='1', params=()):
+        rows = self._conn.execute(REGISTRATION_ROWS_SQL.format(where=where), (term, *params)).fetchall()
+        return [_registration_dict(row) for row in rows]
+
+    def dashboard(self, term):
+        with self._lock:
+            cursor = self._sync_cursor()
+            registrations = self._registration_rows(term)
+            stats = self._conn.execute('''
+                SELECT COUNT(DISTINCT r.id), COUNT(DISTINCT s.id), COUNT(DISTINCT rc.id), COUNT(DISTINCT rs.id)
+                FROM registrations r
+                JOIN students s ON r.student_id = s.id
+                LEFT JOIN registration_courses rc ON r.id = rc.registration_id
+                LEFT JOIN registration_supplies rs ON r.id = rs.registration_id
+                WHERE r.term = ?
+            ''', (term,)).fetchone()
+        return cursor, registrations, tuple(stats)
+
+    def dashboard_stream(self, term):
+        # The whole result is in memory anyway; same shape as PostgresStore.dashboard_stream
+        cursor, registrations, statistics = self.dashboard(term)
+        return cursor, statistics, iter(registrations), lambda: None
+
+    def roster_stream(self, term):
+        rows = self._query('''
+            SELECT c.id, c.name, s.name, s.birthday, r.class_name, r.is_paid
+            FROM courses c
+            LEFT JOIN registration_courses rc ON rc.course_id = c.id
+            LEFT JOIN registrations r ON r.id = rc.registration_id
+            LEFT JOIN students s ON s.id = r.student_id
+            WHERE c.term = ?
+            ORDER BY c.id, r.class_name, s.name
+        ''', (term,))
+        return iter([{
+            'course_id': row[0],
+            'course_name': row[1],
+            'student_name': row[2],
+            'birthday': row[3],
+            'class_name': row[4],
+            'is_paid': None if row[5] is None else bool(row[5])
+        } for row in rows]), lambda: None
+
+    def registration_changes(self, term, since_seq):
+        with self._lock:
+            cursor = self._sync_cursor()
+            registrations = self._registration_rows(term, 'r.change_seq >= ?', (since_seq,))
+            deleted = self._conn.execute(
+                "SELECT registration_id FROM registration_tombstones WHERE (term = ? OR term IS NULL) AND change_seq >= ?",
+                (term, since_seq)
+            ).fetchall()
+        return cursor, registrations, [row[0] for row in deleted]
+
+    def courses_stats(self, term):
+        rows = self._query('''
+            SELECT c.id, c.name, c.price, c.sessions, c.frequency, c.capacity, c.description, c.video_url,
+                   COUNT(rc.registration_id)
+            FROM courses c
+            LEFT JOIN registration_courses rc ON c.id = rc.course_id AND rc.term = c.term
+            WHERE c.term = ?
+            GROUP BY c.id
+            ORDER BY c.id
+        ''', (term,))
+        columns = ('id', 'name', 'price', 'sessions', 'frequency', 'capacity', 'description', 'video_url', 'used')
+        return [dict(zip(columns, row)) for row in rows]
+
+    def registration_details(self, reg_ids, term):
+        reg_ids = list(reg_ids)
+        with self._lock:
+            rows = self._conn.execute(f'''
+                SELECT r.id, s.name, r.class_name, r.created_at, r.updated_at, s.birthday, r.is_paid
+                FROM registrations r JOIN students s ON r.student_id = s.id
+                WHERE r.term = ? AND r.id IN {_placeholders(reg_ids)}
+            ''', (term, *reg_ids)).fetchall()
+            return [{
+                'id': row[0],
+                'student_name': row[1],
+                'class_name': row[2],
+                'created_at': row[3],
+                'updated_at': row[4],
+                'birthday': row[5],
+                'is_paid': bool(row[6]),
+                'courses': _items(self._conn, 'registration_courses', 'courses', row[0]),
+                'supplies': _items(self._conn, 'registration_supplies', 'supplies', row[0])
+            } for row in rows]
+
+    def search_students(self, search_name, grams, term, min_similarity, limit):
+        # No trigram index: score every student the way the PostgreSQL query does
+        rows = self._query('''
+            SELECT s.id, s.name, s.birthday, s.search_name, r.id, r.class_name
+            FROM students s
+            LEFT JOIN registrations r ON r.id = (
+                SELECT id FROM registrations
+                WHERE student_id = s.id AND term = ?
+                ORDER BY created_at DESC, id DESC
+                LIMIT 1
+            )
+        ''', (term,))
+        wanted = set(grams)
+        results = []
+        for student_id, name, birthday, candidate, reg_id, class_name in rows:
+            candidate = candidate or ''
+            shared = len(wanted.intersection(name_trigrams(candidate)))
+            if not shared:
+                continue
+            if candidate == search_name:
+                tier = 0
+            elif candidate.startswith(search_name):
+                tier = 1
+            else:
+                tier = 2
+            similarity = shared / (len(grams) + len(candidate) + 1 - shared)
+            if tier < 2 or similarity >= min_similarity:
+                results.append({
+                    'student_id': student_id,
+                    'student_name': name,
+                    'birthday': birthday,
+                    'registration_id': reg_id,
+                    'class_name': class_name,
+                    'tier': tier,
+                    'similarity': similarity
+                })
+        results.sort(key=lambda row: (row['tier'], -row['similarity'], row['student_name']))
+        return results[:limit]
+
+    def finance_totals(self, term):
+        # Aggregated from the live tables; there are no counter triggers here
+        return self._query('''
+            SELECT 'course', c.id, c.name, c.price, COUNT(*), COALESCE(SUM(r.is_paid), 0)
+            FROM registration_courses rc
+            JOIN registrations r ON r.id = rc.registration_id
+            JOIN courses c ON c.id = rc.course_id
+            WHERE rc.term = ?
+            GROUP BY c.id
+            UNION ALL
+            SELECT 'supply', sp.id, sp.name, sp.price, COUNT(*), COALESCE(SUM(r.is_paid), 0)
+            FROM registration_supplies rs
+            JOIN registrations r ON r.id = rs.registration_id
+            JOIN supplies sp ON sp.id = rs.supply_id
+            WHERE rs.term = ?
+            GROUP BY sp.id
+            UNION ALL
+            SELECT 'registration', 0, NULL, NULL, COUNT(*), COALESCE(SUM(is_paid), 0)
+            FROM registrations
+            WHERE term = ?
+            ORDER BY 1, 2
+        ''', (term, term, term))
+
+    def list_terms(self):
+        return self._query('''
+            SELECT t.code, t.name, t.created_at, t.archived_at, t.code = s.value
+            FROM terms t
+            LEFT JOIN settings s ON s.key = 'active_term'
+            ORDER BY t.created_at, t.code
+        ''')
+
+    # ---- Single-statement writes ----
+
+    @staticmethod
+    def _registration_criteria(term, criteria):
+        conditions = ["term = ?"]
+        params = [term]
+        if 'ids' in criteria:
+            conditions.append(f"id IN {_placeholders(criteria['ids'])}")
+            params.extend(criteria['ids'])
+        if 'class_name' in criteria:
+            conditions.append("class_name = ?")
+            params.append(criteria['class_name'])
+        if 'is_paid' in criteria:
+            conditions.append("is_paid = ?")
+            params.append(criteria['is_paid'])
+        if 'course_id' in criteria:
+            conditions.append('''EXISTS (
+                SELECT 1 FROM registration_courses rc
+                WHERE rc.registration_id = registrations.id AND rc.course_id = ?
+            )''')
+            params.append(criteria['course_id'])
+        return ' AND '.join(conditions), params
+
+    def bulk_set_paid(self, term, criteria, paid, now):
+        where, params = self._registration_criteria(term, criteria)
+        return self._query(
+            f"UPDATE registrations SET is_paid = ?, updated_at = ? WHERE {where} AND is_paid IS NOT ? "
+            "RETURNING id, is_paid, updated_at",
+            (paid, now, *params, paid)
+        )
+
+    def bulk_delete_registrations(self, term, criteria):
+        where, params = self._registration_criteria(term, criteria)
+        return [row[0] for row in self._query(f"DELETE FROM registrations WHERE {where} RETURNING id", params)]
+
+
+    def delete_registration(self, reg_id):
+        self._write("DELETE FROM registrations WHERE id = ?", (reg_id,))
+
+    def set_paid(self, reg_id, paid, now):
+        self._write("UPDATE registrations SET is_paid = ?, updated_at = ? WHERE id = ?", (bool(paid), now, reg_id))
+
+    def prune_intake_receipts(self, days):
+        self._write("DELETE FROM intake_receipts WHERE applied_at < datetime('now', ?)", (f'-{int(days)} days',))
+
+    def save_settings(self, values):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                list(values.items())
+            )
+
+    def course_term(self, course_id):
+        rows = self._query("SELECT term FROM courses WHERE id = ?", (course_id,))
+        return rows[0][0] if rows else None
+
+    def course_name_taken(self, term, name, exclude_id=None):
+        return bool(self._query(
+            "SELECT id FROM courses WHERE term = ? AND name = ? AND id IS NOT ?",
+            (term, name, exclude_id)
+        ))
+
+    def course_enrolment(self, course_id):
+        return self._query("SELECT COUNT(*) FROM registration_courses WHERE course_id = ?", (course_id,))[0][0]
+
+    def insert_course(self, term, course):
+        return self._write('''
+            INSERT INTO courses (term, name, price, sessions, frequency, description, capacity, video_url)
+            VALUES (:term, :name, :price, :sessions, :frequency, :description, :capacity, :video_url)
+        ''', {'term': term, **course}).lastrowid
+
+    def update_course(self, course_id, course):
+        self._write('''
+            UPDATE courses SET
+            name = :name, price = :price, sessions = :sessions,
+            frequency = :frequency, description = :description, capacity = :capacity,
+            video_url = :video_url
+            WHERE id = :id
+        ''', {'id': course_id, **course})
+
+    def set_course_capacity(self, course_id, capacity):
+        self._write("UPDATE courses SET capacity = ? WHERE id = ?", (capacity, course_id))
+
+    def delete_course(self, course_id):
+        self._write("DELETE FROM courses WHERE id = ?", (course_id,))
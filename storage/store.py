@@ -0,0 +1,30 @@
+import threading
+from config import Config
+
+_store = None
+_store_lock = threading.Lock()
+
+def _create_store():
+    # Imported on demand so the SQLite backend never touches the PostgreSQL
+    # pool and vice versa
+    if Config.STORAGE_BACKEND == 'sqlite':
+        from storage.sqlite_store import SQLiteStore
+        return SQLiteStore(Config.SQLITE_PATH)
+    from storage.postgres_store import PostgresStore
+    return PostgresStore()
+
+def get_store():
+    """Storage backend behind RegistrationService and AdminService"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _create_store()
+    return _store
+
+def set_store(store):
+    """Swap the backend, e.g. for a fresh SQLiteStore(':memory:') in a test or benchmark"""
+    global _store
+    with _store_lock:
+        _store = store
+    return store
@@ -0,0 +1,74 @@
+import os
+import sys
+import urllib.parse
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from storage.store import set_store
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'stress: concurrent load against a real PostgreSQL server (needs DATABASE_URL)')
+
+def admin_connection(db_url):
+    """Connection to the maintenance database of the server behind db_url"""
+    import pg8000.native
+    url = urllib.parse.urlparse(db_url)
+    return pg8000.native.Connection(user=url.username, password=url.password, host=url.hostname,
+                                    port=url.port or 5432, database='postgres')
+
+def scratch_url(db_url, name):
+    return urllib.parse.urlparse(db_url)._replace(path='/' + name).geturl()
+
+@pytest.fixture(scope='session')
+def postgres_template():
+    """A database with the schema applied, copied for every test that needs PostgreSQL"""
+    server = os.environ.get('DATABASE_URL')
+    if not server:
+        pytest.skip('DATABASE_URL is not set')
+    from database import init_db
+
+    name = f'afterschool_test_{os.getpid()}'
+    admin = admin_connection(server)
+    admin.run(f'CREATE DATABASE "{name}"')
+    Config.DATABASE_URL = scratch_url(server, name)
+    Config.DATABASE_REPLICA_URL = None
+    try:
+        init_db()
+        # A template cannot be copied while anyone is connected to it
+        admin.run("SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = :name", name=name)
+        yield server, name
+    finally:
+        admin.run(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+        admin.close()
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def store(request, monkeypatch):
+    """A freshly initialized store per test; every service goes through it"""
+    # Re-read the active term from each new store
+    monkeypatch.setattr(Config, 'ACTIVE_TERM_CACHE_SECONDS', 0)
+    monkeypatch.setattr(Config, 'INTAKE_MODE', 'off')
+
+    if request.param == 'sqlite':
+        from storage.sqlite_store import SQLiteStore
+        store = set_store(SQLiteStore(':memory:'))
+        store.init_schema()
+        yield store
+        set_store(None)
+        return
+
+    from storage.postgres_store import PostgresStore
+    server, template = request.getfixturevalue('postgres_template')
+    name = f'{template}_{uuid.uuid4().hex[:8]}'
+    admin = admin_connection(server)
+    admin.run(f'CREATE DATABASE "{name}" TEMPLATE "{template}"')
+    monkeypatch.setattr(Config, 'DATABASE_URL', scratch_url(server, name))
+    try:
+        yield set_store(PostgresStore())
+    finally:
+        set_store(None)
+        admin.run(f'DROP DATABASE "{name}" WITH (FORCE)')
+        admin.close()
@@ -0,0 +1,63 @@
+import zlib
+
+import pytest
+
+from middleware import compression
+from middleware.compression import choose_encoding, _compress_stream
+
+@pytest.fixture
+def gzip_only(monkeypatch):
+    monkeypatch.setattr(compression, 'brotli', None)
+
+class Upstream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+def test_choose_encoding_follows_q_values(gzip_only):
+    assert choose_encoding('gzip, deflate') == 'gzip'
+    assert choose_encoding('GZIP;q=0.5') == 'gzip'
+    assert choose_encoding('*') == 'gzip'
+
+def test_choose_encoding_refuses_when_nothing_is_acceptable(gzip_only):
+    assert choose_encoding(None) is None
+    assert choose_encoding('') is None
+    assert choose_encoding('identity') is None
+    assert choose_encoding('gzip;q=0') is None
+    assert choose_encoding('*;q=0') is None
+    assert choose_encoding('gzip;q=0, *;q=1') is None
+    assert choose_encoding('gzip;q=oops') is None
+
+def test_choose_encoding_prefers_brotli_on_ties():
+    pytest.importorskip('brotli')
+
+    assert choose_encoding('gzip, br') == 'br'
+    assert choose_encoding('br;q=0.5, gzip') == 'gzip'
+
+def test_compress_stream_round_trips_and_flushes_each_chunk():
+    upstream = Upstream(['報名資料,', b'', b'roster\n' * 100])
+
+    parts = list(_compress_stream(upstream, 'gzip'))
+
+    # One flushed part per non-empty chunk, then the gzip trailer
+    assert len(parts) == 3
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    assert decoder.decompress(parts[0]) == '報名資料,'.encode('utf-8')
+    assert zlib.decompress(b''.join(parts), 16 + zlib.MAX_WBITS) == '報名資料,'.encode('utf-8') + b'roster\n' * 100
+    assert upstream.closed
+
+def test_compress_stream_closes_upstream_on_error():
+    def chunks():
+        yield b'first'
+        raise RuntimeError('cursor lost')
+    upstream = Upstream(chunks())
+
+    with pytest.raises(RuntimeError):
+        list(_compress_stream(upstream, 'gzip'))
+    assert upstream.closed
@@ -0,0 +1,97 @@
+import pytest
+
+from config import Config
+from services import intake
+from services.intake import IntakeJournal
+
+def arrive(journal, receipt, name=None):
+    journal.append({'receipt': receipt, 'received_at': '2026-08-01T09:00:00', 'update': False,
+                    'term': None, 'data': {'name': name or receipt, 'courses': [], 'supplies': []}})
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'intake' / 'journal.jsonl')
+
+def test_restart_replays_unresolved_entries_in_order(path):
+    journal = IntakeJournal(path)
+    for receipt in ('a', 'b', 'c'):
+        arrive(journal, receipt)
+    journal.resolve('a', 'done', result={'id': 1})
+
+    # A new process sees exactly what the crashed one had written
+    restarted = IntakeJournal(path)
+    assert restarted.pending_count() == 2
+    assert restarted.next_pending()['receipt'] == 'b'
+    assert restarted.status('a')['status'] == 'done'
+    assert restarted.status('c')['position'] == 2
+
+    restarted.resolve('b', 'rejected', message='已額滿')
+    assert journal.next_pending()['receipt'] == 'c'
+    status = journal.status('b')
+    assert (status['status'], status['message']) == ('rejected', '已額滿')
+
+def test_torn_trailing_line_is_skipped_and_ended(path):
+    journal = IntakeJournal(path)
+    arrive(journal, 'a')
+    with open(path, 'ab') as f:
+        f.write(b'{"receipt": "torn", "received_')
+
+    restarted = IntakeJournal(path)
+    assert restarted.pending_count() == 1
+    assert restarted.status('torn') is None
+
+    arrive(restarted, 'b')
+    assert restarted.pending_count() == 2
+    assert IntakeJournal(path).next_pending()['receipt'] == 'a'
+    assert restarted.status('b')['position'] == 2
+    with open(path, 'rb') as f:
+        lines = f.read().split(b'\n')
+    assert lines[1] == b'{"receipt": "torn", "received_'
+
+def test_only_recent_resolved_entries_stay_indexed(path, monkeypatch):
+    monkeypatch.setattr(Config, 'INTAKE_INDEX_SIZE', 2)
+    journal = IntakeJournal(path)
+    for receipt in ('a', 'b', 'c', 'd'):
+        arrive(journal, receipt)
+    for receipt in ('a', 'b', 'c'):
+        journal.resolve(receipt, 'done', result={})
+
+    assert journal.status('a') is None
+    assert [journal.status(r)['status'] for r in ('b', 'c', 'd')] == ['done', 'done', 'queued']
+    assert journal.status('d')['position'] == 1
+
+def test_rotation_starts_a_new_segment_once_resolved(path, monkeypatch):
+    monkeypatch.setattr(Config, 'INTAKE_SEGMENT_BYTES', 1)
+    journal = IntakeJournal(path)
+    reader = IntakeJournal(path)
+    arrive(journal, 'a')
+    assert reader.pending_count() == 1
+
+    assert not journal.rotate()
+    journal.resolve('a', 'done', result={})
+    assert journal.rotate()
+
+    arrive(journal, 'b')
+    assert reader.status('a')['status'] == 'done'
+    assert reader.next_pending()['receipt'] == 'b'
+    assert IntakeJournal(path).status('a') is None
+
+def test_drain_replays_the_journal_into_the_store(store, path, monkeypatch):
+    monkeypatch.setattr(intake, '_journal', IntakeJournal(path))
+    journal = intake.get_journal()
+    arrive(journal, 'a', name='王小明')
+    arrive(journal, 'b', name='王小明')
+
+    assert intake.drain_once() and intake.drain_once()
+    assert not intake.drain_once()
+    first, second = journal.status('a'), journal.status('b')
+    assert (first['status'], second['status']) == ('done', 'done')
+    assert first['result']['id'] != second['result']['id']
+
+    # Replaying an entry already applied (e.g. lost ack) does not apply it twice
+    monkeypatch.setattr(intake, '_journal', IntakeJournal(path + '.replay'))
+    replay = intake.get_journal()
+    arrive(replay, 'a', name='王小明')
+    assert intake.drain_once()
+    assert replay.status('a')['result'] == first['result']
+    assert intake.receipt_status('b')['status'] == 'done'
@@ -0,0 +1,53 @@
+import threading
+import time
+
+from middleware.load_shed import ConcurrencyLimiter
+
+def limiter(max_in_flight=2, max_queue=1, max_wait=5.0):
+    return ConcurrencyLimiter('test', max_in_flight, max_queue, max_wait, retry_after=1)
+
+def start_acquire(limiter, outcomes):
+    thread = threading.Thread(target=lambda: outcomes.append(limiter.acquire()))
+    thread.start()
+    while limiter.stats()['waiting'] == 0 and not outcomes:
+        time.sleep(0.001)
+    return thread
+
+def test_admits_up_to_the_limit_then_sheds_past_the_queue():
+    slots = limiter()
+    assert slots.acquire() == 0.0
+    assert slots.acquire() == 0.0
+
+    outcomes = []
+    queued = start_acquire(slots, outcomes)
+    # The one queue place is taken
+    assert slots.acquire() is None
+
+    slots.release()
+    queued.join(5)
+    assert len(outcomes) == 1 and outcomes[0] >= 0.0
+
+    stats = slots.stats()
+    assert (stats['in_flight'], stats['waiting']) == (2, 0)
+    assert (stats['admitted'], stats['queued'], stats['shed']) == (3, 1, 1)
+
+def test_waiter_is_shed_after_max_wait():
+    slots = limiter(max_in_flight=1, max_wait=0.05)
+    slots.acquire()
+
+    started = time.monotonic()
+    assert slots.acquire() is None
+    assert time.monotonic() - started >= 0.05
+
+    stats = slots.stats()
+    assert (stats['in_flight'], stats['waiting'], stats['shed']) == (1, 0, 1)
+
+def test_release_frees_slots_for_later_requests():
+    slots = limiter(max_in_flight=1, max_queue=0)
+    for _ in range(3):
+        assert slots.acquire() == 0.0
+        assert slots.acquire() is None
+        slots.release()
+
+    stats = slots.stats()
+    assert (stats['in_flight'], stats['admitted'], stats['shed']) == (0, 3, 3)
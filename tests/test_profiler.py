@@ -0,0 +1,49 @@
+from middleware.profiler import folded_stacks
+
+MAIN = ('/srv/app.py', 10, 'main')
+HANDLER = ('/srv/routes.py', 20, 'handler')
+EXPORT = ('/srv/admin.py', 30, 'export;csv')
+QUERY = ('~', 0, "<method 'run' of 'Connection' objects>")
+
+def entry(own, total, callers=None):
+    """A pstats row: (primitive calls, calls, own time, cumulative time, callers)"""
+    return (1, 1, own, total, callers or {})
+
+def edge(total):
+    return (1, 1, total, total)
+
+def parse(folded):
+    assert folded.endswith('\n')
+    return {stack: int(us) for stack, us in (line.rsplit(' ', 1) for line in folded.splitlines())}
+
+def test_shared_callee_is_split_by_caller():
+    stats = {
+        MAIN: entry(1.0, 12.0),
+        HANDLER: entry(4.0, 4.5, {MAIN: edge(4.5)}),
+        EXPORT: entry(5.0, 6.5, {MAIN: edge(6.5)}),
+        QUERY: entry(2.0, 2.0, {HANDLER: edge(0.5), EXPORT: edge(1.5)}),
+    }
+
+    stacks = parse(folded_stacks(stats))
+
+    query = "<method 'run' of 'Connection' objects>"
+    assert stacks == {
+        'main (app.py:10)': 1_000_000,
+        'main (app.py:10);handler (routes.py:20)': 4_000_000,
+        f'main (app.py:10);handler (routes.py:20);{query}': 500_000,
+        'main (app.py:10);export,csv (admin.py:30)': 5_000_000,
+        f'main (app.py:10);export,csv (admin.py:30);{query}': 1_500_000,
+    }
+    # Every second of the run is attributed exactly once
+    assert sum(stacks.values()) == 12_000_000
+
+def test_recursion_is_not_walked_twice():
+    stats = {
+        MAIN: entry(0.5, 3.5),
+        HANDLER: entry(3.0, 3.0, {MAIN: edge(3.0), HANDLER: edge(2.0)}),
+    }
+
+    assert parse(folded_stacks(stats)) == {
+        'main (app.py:10)': 500_000,
+        'main (app.py:10);handler (routes.py:20)': 3_000_000,
+    }
@@ -0,0 +1,64 @@
+import pytest
+
+from middleware import rate_limit
+from middleware.rate_limit import MemoryBucketStore
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, 'time', clock)
+    return clock
+
+def test_bucket_denies_when_empty_and_refills(clock):
+    store = MemoryBucketStore()
+    bucket = [('submit:ip:1.2.3.4', 2, 0.5)]
+
+    assert store.consume(bucket) == (True, 0.0)
+    assert store.consume(bucket) == (True, 0.0)
+    allowed, retry_after = store.consume(bucket)
+    assert not allowed
+    assert retry_after == pytest.approx(2.0)
+
+    clock.now += 1
+    allowed, retry_after = store.consume(bucket)
+    assert not allowed
+    assert retry_after == pytest.approx(1.0)
+
+    clock.now += 1
+    assert store.consume(bucket) == (True, 0.0)
+
+def test_refill_stops_at_capacity(clock):
+    store = MemoryBucketStore()
+    bucket = [('query:ip:1.2.3.4', 3, 1.0)]
+    store.consume(bucket)
+
+    clock.now += 3600
+    assert [store.consume(bucket)[0] for _ in range(4)] == [True, True, True, False]
+
+def test_denied_request_takes_no_token_from_other_buckets(clock):
+    store = MemoryBucketStore()
+    per_ip = ('query:ip:1.2.3.4', 5, 0.01)
+    per_name = ('query:name:王小明', 1, 0.01)
+
+    assert store.consume([per_ip, per_name])[0]
+    assert not any(store.consume([per_ip, per_name])[0] for _ in range(10))
+
+    # Only the first request came out of the per-IP allowance
+    assert [store.consume([per_ip])[0] for _ in range(5)] == [True, True, True, True, False]
+
+def test_retry_after_waits_for_the_slowest_bucket(clock):
+    store = MemoryBucketStore()
+    fast = ('submit:ip:1.2.3.4', 1, 1.0)
+    slow = ('submit:name:王小明', 1, 0.1)
+    store.consume([fast, slow])
+
+    allowed, retry_after = store.consume([fast, slow])
+    assert not allowed
+    assert retry_after == pytest.approx(10.0)
@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+from services.singleflight import SingleFlight
+
+def start_callers(flight, key, count, fn, outcomes):
+    """Threads calling flight.do(key, fn), each appending its result or error to outcomes"""
+    def call():
+        try:
+            outcomes.append(flight.do(key, fn))
+        except Exception as e:
+            outcomes.append(e)
+    threads = [threading.Thread(target=call) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+def wait_for_followers(flight, count):
+    # Followers count themselves as shared before they block on the leader
+    while flight.stats()['shared'] < count:
+        time.sleep(0.001)
+
+def test_concurrent_callers_share_one_execution():
+    flight = SingleFlight()
+    release = threading.Event()
+    started = threading.Event()
+    result = {'courses': 3}
+    def load():
+        started.set()
+        release.wait(5)
+        return result
+
+    outcomes = []
+    leader = start_callers(flight, 'stats', 1, load, outcomes)
+    started.wait(5)
+    followers = start_callers(flight, 'stats', 4, load, outcomes)
+    wait_for_followers(flight, 4)
+    release.set()
+    for thread in leader + followers:
+        thread.join(5)
+
+    assert len(outcomes) == 5
+    assert all(outcome is result for outcome in outcomes)
+    assert flight.stats() == {'executed': 1, 'shared': 4, 'in_flight': 0}
+
+def test_error_reaches_every_waiter():
+    flight = SingleFlight()
+    release = threading.Event()
+    started = threading.Event()
+    def load():
+        started.set()
+        release.wait(5)
+        raise ConnectionError('database unavailable')
+
+    outcomes = []
+    leader = start_callers(flight, 'stats', 1, load, outcomes)
+    started.wait(5)
+    followers = start_callers(flight, 'stats', 2, load, outcomes)
+    wait_for_followers(flight, 2)
+    release.set()
+    for thread in leader + followers:
+        thread.join(5)
+
+    assert len(outcomes) == 3
+    assert all(isinstance(outcome, ConnectionError) for outcome in outcomes)
+    assert flight.stats()['in_flight'] == 0
+
+def test_nothing_is_cached_after_completion():
+    flight = SingleFlight()
+    calls = []
+
+    assert flight.do('stats', lambda: calls.append(1) or len(calls)) == 1
+    assert flight.do('stats', lambda: calls.append(1) or len(calls)) == 2
+    with pytest.raises(KeyError):
+        flight.do('stats', lambda: {}['missing'])
+    assert flight.do('stats', lambda: 'recovered') == 'recovered'
+    assert flight.stats() == {'executed': 4, 'shared': 0, 'in_flight': 0}
+
+def test_different_keys_do_not_wait_for_each_other():
+    flight = SingleFlight()
+    release = threading.Event()
+    started = threading.Event()
+    def slow():
+        started.set()
+        release.wait(5)
+        return 'slow'
+
+    outcomes = []
+    threads = start_callers(flight, 'slow', 1, slow, outcomes)
+    started.wait(5)
+    assert flight.do('fast', lambda: 'fast') == 'fast'
+    release.set()
+    threads[0].join(5)
+
+    assert outcomes == ['slow']
+    assert flight.stats()['executed'] == 2
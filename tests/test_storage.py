@@ -0,0 +1,206 @@
+import csv
+import io
+import zipfile
+
+import pytest
+
+from services.admin_service import AdminService, CourseBatchError
+from services.registration_service import RegistrationService, AmbiguousNameError
+
+SOCCER = '足球 (中大班)'
+DANCE = '兒童舞蹈 (大中小幼班)'
+ART = '幼兒美術 (大中小幼)'
+
+def register(name, courses=(), **fields):
+    data = {'name': name, 'birthday': '2019-09-01', 'class': '大班',
+            'courses': [{'name': course, 'price': '0'} for course in courses], 'supplies': [],
+            **fields}
+    return RegistrationService.handle_registration(data)['id']
+
+def update(reg_id, name, courses=(), class_name='大班'):
+    data = {'id': reg_id, 'name': name, 'class': class_name,
+            'courses': [{'name': course, 'price': '0'} for course in courses], 'supplies': []}
+    return RegistrationService.handle_registration(data, update=True)
+
+def course_ids():
+    return {course['name']: course['id'] for course in AdminService.get_courses_stats()}
+
+def used():
+    return {course['name']: course['used'] for course in AdminService.get_courses_stats()}
+
+def test_submit_registration(store):
+    reg_id = register('王小明', [SOCCER, DANCE])
+
+    result = RegistrationService.get_registration_by_student('王小明')
+    assert result['id'] == reg_id
+    assert result['birthday'] == '2019-09-01'
+    assert [course['name'] for course in result['courses']] == [SOCCER, DANCE]
+    assert used()[SOCCER] == 1
+
+def test_elite_english_adds_material_fee(store):
+    register('林小華', ['菁英美語 (限大班)'])
+
+    courses = RegistrationService.get_registration_by_student('林小華')['courses']
+    assert [course['name'] for course in courses] == ['菁英美語 (限大班)', '菁英美語教材費']
+
+def test_update_changes_only_the_difference(store):
+    reg_id = register('王小明', [SOCCER, DANCE])
+    # Full now, but the registration already holds a seat in it
+    AdminService.update_course(course_ids()[SOCCER], {'capacity': 1})
+
+    update(reg_id, '王小明', [SOCCER, ART], class_name='中班')
+
+    result = RegistrationService.get_registration_by_student('王小明')
+    assert result['class'] == '中班'
+    assert [course['name'] for course in result['courses']] == [SOCCER, ART]
+    counts = used()
+    assert (counts[SOCCER], counts[DANCE], counts[ART]) == (1, 0, 1)
+
+def test_update_of_unknown_registration_is_rejected(store):
+    with pytest.raises(ValueError, match='找不到本學期的報名資料'):
+        update(999999, '王小明', [SOCCER])
+
+def test_full_course_rejects_and_rolls_back(store):
+    AdminService.update_course(course_ids()[SOCCER], {'capacity': 1})
+    register('王小明', [SOCCER])
+
+    with pytest.raises(ValueError, match='已額滿'):
+        register('陳小美', [DANCE, SOCCER])
+
+    assert RegistrationService.get_registration_by_student('陳小美') is None
+    counts = used()
+    assert (counts[SOCCER], counts[DANCE]) == (1, 0)
+    assert RegistrationService.get_course_availability()[SOCCER] == 0
+
+def test_query_matches_normalized_name(store):
+    reg_id = register('Amy Chen', [SOCCER])
+
+    assert RegistrationService.get_registration_by_student('amychen')['id'] == reg_id
+    assert RegistrationService.get_registration_by_student('ＡＭＹ　ＣＨＥＮ')['id'] == reg_id
+    assert RegistrationService.get_registration_by_student('Amy Lin') is None
+
+def test_query_prefers_exact_name_and_refuses_ambiguous(store):
+    first = register('Amy Chen', [SOCCER])
+    second = register('AMY CHEN', [DANCE])
+
+    assert RegistrationService.get_registration_by_student('Amy Chen')['id'] == first
+    assert RegistrationService.get_registration_by_student('AMY CHEN')['id'] == second
+    with pytest.raises(AmbiguousNameError):
+        RegistrationService.get_registration_by_student('amy chen')
+
+def test_query_returns_latest_registration(store):
+    register('王小明', [SOCCER])
+    latest = register('王小明', [DANCE])
+
+    result = RegistrationService.get_registration_by_student('王小明')
+    assert result['id'] == latest
+    assert [course['name'] for course in result['courses']] == [DANCE]
+
+def test_dashboard_and_changes_since(store):
+    kept = register('王小明', [SOCCER])
+    removed = register('陳小美', [DANCE])
+
+    dashboard = AdminService.get_dashboard_stats()
+    assert {row['id'] for row in dashboard['registrations']} == {kept, removed}
+    assert dashboard['statistics'] == {'totalRegistrations': 2, 'totalStudents': 2,
+                                       'totalCourseEnrollments': 2, 'totalSupplyOrders': 0}
+
+    changes = AdminService.get_dashboard_changes(dashboard['cursor'])
+    assert (changes['registrations'], changes['deleted'], changes['full']) == ([], [], False)
+
+    update(kept, '王小明', [SOCCER, ART])
+    AdminService.delete_registration(removed)
+    added = register('林小華')
+
+    changes = AdminService.get_dashboard_changes(dashboard['cursor'])
+    assert {row['id'] for row in changes['registrations']} == {kept, added}
+    assert changes['deleted'] == [removed]
+    assert AdminService.get_dashboard_changes(changes['cursor'])['registrations'] == []
+
+def test_changes_since_rejects_bad_cursor(store):
+    with pytest.raises(ValueError):
+        AdminService.get_dashboard_changes('not-a-cursor')
+
+def test_roster_export(store):
+    register('王小明', [SOCCER])
+    register('陳小美', [SOCCER, DANCE])
+    AdminService.toggle_payment(register('林小華', [DANCE]), True)
+
+    filename, chunks = AdminService.export_rosters()
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+
+    rosters = {}
+    for entry in archive.namelist():
+        with archive.open(entry) as f:
+            rosters[entry] = list(csv.reader(io.TextIOWrapper(f, encoding='utf-8-sig')))
+    assert filename.startswith('rosters-') and filename.endswith('.zip')
+    assert len(rosters) == len(course_ids())
+
+    soccer = next(rows for entry, rows in rosters.items() if entry.startswith('足球') and '中大班' in entry)
+    assert soccer[0] == ['學生姓名', '生日', '班級', '繳費狀態']
+    assert sorted(row[0] for row in soccer[1:]) == ['王小明', '陳小美']
+    dance = next(rows for entry, rows in rosters.items() if entry.startswith('兒童舞蹈'))
+    assert sorted((row[0], row[3]) for row in dance[1:]) == [('林小華', '已繳費'), ('陳小美', '未繳費')]
+
+def test_course_batch_applies_all(store):
+    ids = course_ids()
+
+    results = AdminService.apply_course_batch([
+        {'op': 'create', 'name': '圍棋', 'price': 3000, 'capacity': 10},
+        {'op': 'update', 'id': ids[ART], 'name': '幼兒美術', 'price': 4600},
+        {'op': 'capacity', 'id': ids[DANCE], 'capacity': 5},
+        {'op': 'delete', 'id': ids[SOCCER]},
+    ])
+
+    courses = {course['name']: course for course in AdminService.get_courses_stats()}
+    assert [r['op'] for r in results] == ['create', 'update', 'capacity', 'delete']
+    assert results[0]['id'] == courses['圍棋']['id']
+    assert courses['圍棋']['capacity'] == 10
+    assert courses['幼兒美術']['price'] == 4600 and ART not in courses
+    assert courses[DANCE]['capacity'] == 5
+    assert SOCCER not in courses
+
+def test_course_batch_applies_nothing_on_error(store):
+    ids = course_ids()
+    register('王小明', [SOCCER])
+
+    with pytest.raises(CourseBatchError) as error:
+        AdminService.apply_course_batch([
+            {'op': 'create', 'name': '圍棋', 'price': 3000},
+            {'op': 'delete', 'id': ids[SOCCER]},
+            {'op': 'update', 'id': ids[ART], 'name': DANCE, 'price': 4400},
+            {'op': 'capacity', 'id': 999999, 'capacity': 5},
+        ])
+
+    assert [e['index'] for e in error.value.errors] == [1, 2, 3]
+    assert course_ids() == ids
+
+def test_finance_summary_follows_every_write(store):
+    paid = register('王小明', [SOCCER, DANCE])
+    AdminService.toggle_payment(paid, True)
+    changed = register('陳小美', [SOCCER])
+    update(changed, '陳小美', [ART])
+    AdminService.delete_registration(register('林小華', [DANCE]))
+
+    def summary():
+        data = AdminService.get_finance_summary()
+        return (data['registrations'], data['paidRegistrations'],
+                {course['name']: (course['enrolled'], course['paid']) for course in data['courses']})
+
+    expected = (2, 1, {SOCCER: (1, 1), DANCE: (1, 1), ART: (1, 0)})
+    assert summary() == expected
+    if hasattr(store, 'fold_finance_deltas'):
+        store.fold_finance_deltas()
+        assert summary() == expected
+
+def test_bulk_payment_filter_takes_only_booleans(store):
+    paid = register('王小明', [SOCCER])
+    unpaid = register('陳小美', [SOCCER])
+    AdminService.toggle_payment(paid, True)
+
+    for value in ('false', 0, None):
+        with pytest.raises(ValueError, match='is_paid'):
+            AdminService.bulk_set_payment(True, filters={'is_paid': value})
+
+    updated = AdminService.bulk_set_payment(True, filters={'is_paid': False})
+    assert [row['id'] for row in updated] == [unpaid]
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+import stress_capacity
+
+pytestmark = [
+    pytest.mark.stress,
+    pytest.mark.skipif(not os.environ.get('DATABASE_URL'), reason='DATABASE_URL is not set')
+]
+
+def test_courses_never_exceed_capacity():
+    args = stress_capacity.parse_args([
+        '--processes', '2', '--threads', '6', '--operations', '400',
+        '--courses', '3', '--capacity', '5', '--check-interval', '0.05'
+    ])
+
+    with stress_capacity.scratch_database(os.environ['DATABASE_URL']) as url:
+        report = stress_capacity.run(args, url)
+        conn = stress_capacity.connect(url)
+        try:
+            assert stress_capacity._violations(conn, report['term']) == []
+        finally:
+            conn.close()
+
+    assert report['violations'] == []
+    # The workload has to have filled the courses for the check to mean anything
+    assert report['counts']['full'] > 0
+    assert args.capacity in report['enrolled'].values()
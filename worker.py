@@ -0,0 +1,46 @@
+import logging
+import signal
+import sys
+import time
+from config import Config
+from services.job_queue import run_next_job, prune_jobs
+from services.structured_log import setup_logging
+from storage.store import get_store
+
+logger = logging.getLogger('worker')
+
+running = True
+
+def stop(signum, frame):
+    global running
+    running = False
+
+if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    setup_logging()
+    store = get_store()
+    if store.name != 'postgres':
+        # The job queue lives in PostgreSQL; other stores only record the jobs
+        logger.error("Job worker needs the postgres store, not %s", store.name)
+        sys.exit(1)
+    store.init_schema()
+    logger.info("Job worker started")
+    pruned = folded = 0.0
+    while running:
+        try:
+            if time.monotonic() - folded > Config.FINANCE_FOLD_INTERVAL:
+                # Registrations only append finance deltas; keep that table short
+                store.fold_finance_deltas()
+                folded = time.monotonic()
+            if time.monotonic() - pruned > Config.JOB_PRUNE_INTERVAL:
+                removed = prune_jobs()
+                pruned = time.monotonic()
+                if removed:
+                    logger.info("Pruned %s finished jobs", removed)
+            if not run_next_job():
+                time.sleep(Config.JOB_POLL_INTERVAL)
+        except Exception as e:
+            logger.exception("Job worker error: %s", e)
+            time.sleep(Config.JOB_POLL_INTERVAL)
+    logger.info("Job worker stopped")